@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0014_docente_certification_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagnostico',
+            name='respuestas',
+            field=models.JSONField(blank=True, default=dict, help_text='Ejercicios respondidos con su dificultad y resultado, en orden.', verbose_name='Respuestas del diagnóstico'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0015_diagnostico_respuestas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagnostico',
+            name='log_posterior',
+            field=models.JSONField(blank=True, default=dict, help_text='Prior N(0, 1) por verosimilitud evaluada en nodos de cuadratura (normalizada).', verbose_name='Log-posterior de theta'),
+        ),
+    ]
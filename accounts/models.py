@@ -109,6 +109,22 @@ class Diagnostico(models.Model):
     fecha_inicio = models.DateTimeField(null=True, blank=True)
     duracion_segundos = models.PositiveIntegerField(default=3540)  # 59 minutos
     finalizado = models.BooleanField(default=False)
+    # Vector de respuestas del diagnóstico ({"ids": [...], "b": [...], "y": [...]})
+    # Permite actualizar theta de forma incremental sin recargar todos los Intentos
+    respuestas = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name="Respuestas del diagnóstico",
+        help_text="Ejercicios respondidos con su dificultad y resultado, en orden."
+    )
+    # Log-posterior de theta en los nodos de Gauss-Hermite ({"n": respuestas incluidas, "log_pesos": [...]})
+    # Cada respuesta nueva le suma su log-verosimilitud; de ahí salen EAP / MAP sin optimizar
+    log_posterior = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name="Log-posterior de theta",
+        help_text="Prior N(0, 1) por verosimilitud evaluada en nodos de cuadratura (normalizada)."
+    )
     
     def tiempo_restante(self):
         if not self.fecha_inicio:
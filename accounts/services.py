@@ -28,12 +28,15 @@ def diagnostico_finalizado(estudiante):
         finalizado=True
     ).exists()
 
-def diagnostico_activo(estudiante):
+def diagnostico_activo(estudiante, bloquear=False):
     # Devuelve si el diagnostico está activo (ni finalizado ni expirado)
     # Si ya finalizó, None
+    # bloquear: SELECT ... FOR UPDATE (dentro de una transacción) para que dos envíos simultáneos
+    # no lean la misma copia de respuestas/log_posterior
     
     try:
-        diag = Diagnostico.objects.get(estudiante=estudiante)
+        qs = Diagnostico.objects.select_for_update() if bloquear else Diagnostico.objects
+        diag = qs.get(estudiante=estudiante)
         if diag.finalizado or diag.is_expired():
             return None
         return diag
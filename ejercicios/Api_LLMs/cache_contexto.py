@@ -0,0 +1,429 @@
+# Cache de los contextos ({display_text, hint, ...}) que genera el LLM para cada ejercicio.
+# Antes cada GET/POST volvía a pedirle a OpenAI el mismo ejercicio para cada estudiante de la
+# misma carrera. Ahora hay dos niveles:
+#   1. LRU en memoria del proceso (sin red, TTL corto)
+#   2. cache de Django (Redis en producción) respaldado por la tabla ContextoGenerado
+# La clave cubre ejercicio, carrera normalizada, modo, modelo, versión (hash) de la plantilla del
+# prompt y hash del enunciado; si cambia cualquiera de ellos la entrada vieja deja de usarse.
+# Cambiar Ejercicio.enunciado además borra explícitamente sus contextos (ver signals.py).
+# Single-flight: si muchos estudiantes piden a la vez el mismo contexto aún no cacheado (un curso
+# que empieza el mismo ejercicio) se hace una sola llamada al LLM. Dentro del proceso los demás
+# esperan el Future del primero; entre procesos, el que no consigue el lock del cache
+# (KEY_GENERANDO) espera a que el contexto aparezca en el cache de Django.
+
+import copy
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from unidecode import unidecode
+
+from usage.services import record_llm_call
+
+from ..utils.text import normalize_text
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = "contexto:"
+KEY_GENERANDO = "contexto:generando:{}"
+
+
+def _hash(texto):
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def normalizar_carrera(carrera):
+    # "Ingeniería  Civil" y "ingenieria civil" comparten contexto
+    if not carrera:
+        return ""
+    return " ".join(unidecode(normalize_text(carrera, for_storage=True)).lower().split())
+
+
+def version_prompt(modo):
+    # Huella de la plantilla del prompt del modo (prompts.py): si cambia el texto, los contextos viejos no se usan
+    from .prompts import CONTEXTO, DIAGNOSTICO
+
+    return (DIAGNOSTICO if modo == "diagnostico" else CONTEXTO).huella
+
+
+def modelo_llm(modo):
+    if modo == "diagnostico":
+        from .requestdiagnostico import MODEL
+    else:
+        from .request import MODEL
+    return MODEL
+
+
+def clave_contexto(ejercicio, modo, carrera=""):
+    partes = [
+        str(ejercicio.pk),
+        normalizar_carrera(carrera),
+        modo,
+        modelo_llm(modo),
+        version_prompt(modo),
+        _hash(ejercicio.enunciado or "")[:16],
+    ]
+    return _hash("|".join(partes))
+
+
+class _LRU:
+    # LRU con TTL, compartido por los threads del proceso
+    def __init__(self):
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            expira, _, payload = entrada
+            if expira < time.monotonic():
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return payload
+
+    def set(self, clave, ejercicio_id, payload, ttl):
+        maximo = getattr(settings, "CONTEXTO_CACHE_LRU", 2048)
+        ttl = min(ttl, getattr(settings, "CONTEXTO_CACHE_LRU_TTL", 600))
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + ttl, ejercicio_id, payload)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > maximo:
+                self._datos.popitem(last=False)
+
+    def quitar_ejercicio(self, ejercicio_id):
+        with self._lock:
+            for clave in [c for c, (_, e, _) in self._datos.items() if e == ejercicio_id]:
+                del self._datos[clave]
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+
+_lru = _LRU()
+
+
+def buscar_contexto(ejercicio, modo, carrera=""):
+    # Contexto cacheado (LRU -> cache de Django -> DB) o None
+    from ejercicios.models import ContextoGenerado  # import local, este módulo lo importan los mixins
+
+    clave = clave_contexto(ejercicio, modo, carrera)
+    payload = _lru.get(clave)
+    if payload is not None:
+        return copy.deepcopy(payload)
+
+    payload = cache.get(CACHE_PREFIX + clave)
+    if payload is None:
+        try:
+            fila = (
+                ContextoGenerado.objects.filter(clave=clave, expira__gt=timezone.now())
+                .values_list("payload", "expira").first()
+            )
+        except Exception:
+            logger.exception("No se pudo leer ContextoGenerado para ejercicio %s", ejercicio.pk)
+            fila = None
+        if fila is None:
+            return None
+        payload, expira = fila
+        restante = int((expira - timezone.now()).total_seconds())
+        if restante > 0:
+            cache.set(CACHE_PREFIX + clave, payload, timeout=restante)
+    _lru.set(clave, ejercicio.pk, payload, getattr(settings, "CONTEXTO_CACHE_TTL", 604800))
+    return copy.deepcopy(payload)
+
+
+def guardar_contexto(ejercicio, modo, carrera, payload):
+    from ejercicios.models import ContextoGenerado
+
+    ttl = getattr(settings, "CONTEXTO_CACHE_TTL", 604800)
+    clave = clave_contexto(ejercicio, modo, carrera)
+    payload = copy.deepcopy(payload)
+    _lru.set(clave, ejercicio.pk, payload, ttl)
+    cache.set(CACHE_PREFIX + clave, payload, timeout=ttl)
+    try:
+        ContextoGenerado.objects.update_or_create(
+            clave=clave,
+            defaults={
+                "ejercicio_id": ejercicio.pk,
+                "carrera": normalizar_carrera(carrera)[:150],
+                "modo": modo,
+                "modelo_llm": modelo_llm(modo),
+                "version_prompt": version_prompt(modo),
+                "payload": payload,
+                "expira": timezone.now() + timedelta(seconds=ttl),
+            },
+        )
+    except Exception:
+        logger.exception("No se pudo guardar ContextoGenerado para ejercicio %s", ejercicio.pk)
+
+
+_vuelo_lock = threading.Lock()
+_en_vuelo = {}  # clave -> Future del contexto que este proceso está generando
+
+
+def _espera():
+    # Nunca más que el presupuesto del request: esperar más que eso no sirve a quien espera
+    return min(getattr(settings, "CONTEXTO_COALESCER_ESPERA", 30), getattr(settings, "LLM_PRESUPUESTO", 25))
+
+
+def contexto_respaldo(ejercicio, modo):
+    # El mismo respaldo que sirven las vistas cuando el LLM no está (no se cachea)
+    if modo == "diagnostico":
+        return {
+            "display_text": ejercicio.enunciado,
+            "hint": "Piensa el ejercicio en partes lo más pequeñas posibles",
+            "exercise": ejercicio.enunciado,
+            "learning_objective": "Evaluar conocimientos básicos",
+            "tags": ["diagnostico"],
+            "fallback": True,
+        }
+    return {
+        "display_text": ejercicio.enunciado,
+        "hint": "Contexto no disponible actualmente",
+        "fallback": True,
+    }
+
+
+def _tomar_lock(clave):
+    try:
+        return cache.add(KEY_GENERANDO.format(clave), 1, timeout=getattr(settings, "CONTEXTO_COALESCER_LOCK", 40))
+    except Exception:
+        logger.warning("No se pudo tomar el lock de generación del contexto %s", clave)
+        return True  # sin cache compartido cada proceso genera lo suyo
+
+
+def en_curso(clave):
+    # True si algún proceso está generando ese contexto ahora
+    if clave in _en_vuelo:
+        return True
+    try:
+        return cache.get(KEY_GENERANDO.format(clave)) is not None
+    except Exception:
+        return False
+
+
+def _esperar_otro_proceso(clave):
+    """
+    Otro proceso tiene el lock: espera su contexto en el cache de Django. Devuelve (payload, lock):
+    el payload si apareció; si no, si este proceso se quedó con el lock (el otro lo soltó sin
+    guardar nada, p. ej. un respaldo) o (None, False) si se acabó la espera (a lo sumo el
+    presupuesto del request: no queda tiempo para otra llamada, quien llama sirve el respaldo).
+    """
+    limite = time.monotonic() + _espera()
+    intervalo = 0.05
+    while True:
+        payload = cache.get(CACHE_PREFIX + clave)
+        if payload is not None:
+            return payload, False
+        if _tomar_lock(clave):
+            # pudo soltarlo justo después de guardar
+            payload = cache.get(CACHE_PREFIX + clave)
+            if payload is not None:
+                cache.delete(KEY_GENERANDO.format(clave))
+                return payload, False
+            return None, True
+        faltan = limite - time.monotonic()
+        if faltan <= 0:
+            logger.warning("Se agotó la espera del contexto %s que generaba otro proceso", clave)
+            return None, False
+        time.sleep(min(intervalo, faltan))
+        intervalo = min(intervalo * 2, 0.5)
+
+
+def _generar_lider(ejercicio, modo, carrera, clave, generar):
+    # Genera el contexto con el lock entre procesos, o toma el que generó otro proceso
+    lock = _tomar_lock(clave)
+    if not lock:
+        payload, lock = _esperar_otro_proceso(clave)
+        if payload is not None:
+            _lru.set(clave, ejercicio.pk, payload, getattr(settings, "CONTEXTO_CACHE_TTL", 604800))
+            record_llm_call(model=modelo_llm(modo), cache_hit=True, mode=modo)
+            return copy.deepcopy(payload)
+        if not lock:
+            return contexto_respaldo(ejercicio, modo)
+    try:
+        payload = generar()
+        if isinstance(payload, dict) and not payload.get("fallback"):
+            guardar_contexto(ejercicio, modo, carrera, payload)
+        return payload
+    finally:
+        if lock:
+            cache.delete(KEY_GENERANDO.format(clave))
+
+
+def _generar_coalescido(ejercicio, modo, carrera, generar):
+    clave = clave_contexto(ejercicio, modo, carrera)
+    with _vuelo_lock:
+        futuro = _en_vuelo.get(clave)
+        lider = futuro is None
+        if lider:
+            futuro = _en_vuelo[clave] = Future()
+
+    if not lider:
+        try:
+            payload = futuro.result(timeout=_espera())
+        except FutureTimeout:
+            logger.warning("Se agotó la espera del contexto %s, se sirve el respaldo", clave)
+            return contexto_respaldo(ejercicio, modo)
+        if payload is None:
+            return generar()  # venía en un lote que no lo trajo (ver obtener_contextos)
+        record_llm_call(model=modelo_llm(modo), cache_hit=True, mode=modo)
+        return copy.deepcopy(payload)
+
+    try:
+        payload = _generar_lider(ejercicio, modo, carrera, clave, generar)
+    except BaseException as e:
+        futuro.set_exception(e)
+        raise
+    else:
+        # los que esperan reciben también un respaldo: el LLM acaba de fallar para este mismo pedido
+        futuro.set_result(copy.deepcopy(payload))
+    finally:
+        with _vuelo_lock:
+            _en_vuelo.pop(clave, None)
+    return payload
+
+
+def obtener_contexto(ejercicio, modo, carrera, generar):
+    """
+    Devuelve el contexto cacheado o lo genera con `generar()` (la llamada al LLM) y lo guarda.
+    Los pedidos simultáneos del mismo contexto comparten una sola llamada (CONTEXTO_COALESCER).
+    Los contextos de respaldo (payload["fallback"]) no se cachean, así se reintenta la próxima vez.
+    """
+    if not getattr(settings, "CONTEXTO_CACHE", True):
+        return generar()
+    try:
+        payload = buscar_contexto(ejercicio, modo, carrera)
+    except Exception:
+        logger.exception("Error leyendo el cache de contextos para ejercicio %s", getattr(ejercicio, "pk", "?"))
+        payload = None
+    if payload is not None:
+        record_llm_call(model=modelo_llm(modo), cache_hit=True, mode=modo)
+        return payload
+
+    if getattr(settings, "CONTEXTO_COALESCER", True):
+        return _generar_coalescido(ejercicio, modo, carrera, generar)
+    payload = generar()
+    if isinstance(payload, dict) and not payload.get("fallback"):
+        guardar_contexto(ejercicio, modo, carrera, payload)
+    return payload
+
+
+def _liberar(clave, futuro, payload):
+    cache.delete(KEY_GENERANDO.format(clave))
+    if futuro is not None:
+        futuro.set_result(copy.deepcopy(payload))
+        with _vuelo_lock:
+            _en_vuelo.pop(clave, None)
+
+
+def obtener_contextos(ejercicios, modo, carrera, generar_lote, generar_uno, por_llamada=None):
+    """
+    obtener_contexto para varios ejercicios del mismo modo y carrera. Los que falten en el cache se
+    generan de a `por_llamada` (CONTEXTO_LOTE) con una sola llamada al LLM cada grupo:
+    generar_lote(lista) -> {ejercicio.pk: payload}; cada item se guarda con su propia clave.
+    Los que ya está generando otro request/proceso se esperan por el camino individual
+    (generar_uno(ejercicio) si al final no aparecen). Devuelve {ejercicio.pk: payload}; los de un
+    lote que falló entero no aparecen.
+    """
+    por_llamada = max(1, por_llamada or getattr(settings, "CONTEXTO_LOTE", 8))
+    resultado, faltantes = {}, []
+    for ejercicio in ejercicios:
+        try:
+            payload = buscar_contexto(ejercicio, modo, carrera) if getattr(settings, "CONTEXTO_CACHE", True) else None
+        except Exception:
+            logger.exception("Error leyendo el cache de contextos para ejercicio %s", ejercicio.pk)
+            payload = None
+        if payload is not None:
+            record_llm_call(model=modelo_llm(modo), cache_hit=True, mode=modo)
+            resultado[ejercicio.pk] = payload
+        else:
+            faltantes.append(ejercicio)
+
+    ajenos, sueltos = [], []
+    for i in range(0, len(faltantes), por_llamada):
+        # se reserva cada clave como en _generar_coalescido (lock entre procesos + Future en el
+        # proceso) justo antes de su lote, así el lock no vence mientras esperan otros lotes
+        grupo, futuros = [], {}
+        for ejercicio in faltantes[i:i + por_llamada]:
+            clave = clave_contexto(ejercicio, modo, carrera)
+            if clave in _en_vuelo or not _tomar_lock(clave):
+                ajenos.append(ejercicio)
+                continue
+            with _vuelo_lock:
+                if clave not in _en_vuelo:
+                    futuros[clave] = _en_vuelo[clave] = Future()
+            grupo.append((ejercicio, clave))
+        if not grupo:
+            continue
+        sin_liberar = {clave for _, clave in grupo}
+        try:
+            try:
+                generados = generar_lote([e for e, _ in grupo]) or {}
+            except Exception:
+                logger.exception("Error generando un lote de %d contextos (%s)", len(grupo), modo)
+                generados = {}
+            for ejercicio, clave in grupo:
+                payload = generados.get(ejercicio.pk)
+                if not isinstance(payload, dict) or payload.get("fallback"):
+                    payload = None
+                    if generados:
+                        sueltos.append(ejercicio)  # el lote respondió pero sin este: se pide solo
+                try:
+                    if payload is not None:
+                        guardar_contexto(ejercicio, modo, carrera, payload)
+                        resultado[ejercicio.pk] = payload
+                finally:
+                    sin_liberar.discard(clave)
+                    _liberar(clave, futuros.pop(clave, None), payload)
+        finally:
+            for clave in sin_liberar:
+                _liberar(clave, futuros.pop(clave, None), None)
+
+    # los ajenos (y lo que un lote no trajo) van por el camino individual; un lote que falló entero
+    # no se repite ejercicio por ejercicio: esos quedan fuera del resultado
+    for ejercicio in ajenos + sueltos:
+        resultado[ejercicio.pk] = obtener_contexto(ejercicio, modo, carrera, lambda e=ejercicio: generar_uno(e))
+    return resultado
+
+
+def contextos_faltantes(pares, modo, lote=1000):
+    """
+    Filtra los pares (ejercicio, carrera) que no tienen un contexto vigente en ContextoGenerado
+    (la fuente de verdad del cache). Consulta las claves en lotes, sin tocar el LLM.
+    """
+    from ejercicios.models import ContextoGenerado
+
+    ahora = timezone.now()
+    faltantes = []
+    for i in range(0, len(pares), lote):
+        bloque = [(ejercicio, carrera, clave_contexto(ejercicio, modo, carrera)) for ejercicio, carrera in pares[i:i + lote]]
+        vigentes = set(
+            ContextoGenerado.objects.filter(clave__in=[c for _, _, c in bloque], expira__gt=ahora)
+            .values_list("clave", flat=True)
+        )
+        faltantes.extend((ejercicio, carrera) for ejercicio, carrera, clave in bloque if clave not in vigentes)
+    return faltantes
+
+
+def invalidar_contextos(ejercicio_id):
+    # Borra los contextos del ejercicio en los tres niveles (el LRU de otros procesos expira solo)
+    from ejercicios.models import ContextoGenerado
+
+    _lru.quitar_ejercicio(ejercicio_id)
+    filas = ContextoGenerado.objects.filter(ejercicio_id=ejercicio_id)
+    claves = list(filas.values_list("clave", flat=True))
+    if claves:
+        cache.delete_many([CACHE_PREFIX + c for c in claves])
+        filas.delete()
+    return len(claves)
@@ -0,0 +1,502 @@
+# Cliente OpenAI compartido por todos los módulos de Api_LLMs (request, requestdiagnostico,
+# requestfeedback). Antes cada módulo armaba su propio OpenAI() al importarse: tres pools de
+# conexiones, un handshake TLS por módulo/proceso y ningún límite de llamadas simultáneas.
+# Ahora hay un solo AsyncOpenAI sobre un httpx.AsyncClient (keep-alive, HTTP/2 si está `h2`) que
+# vive en un event loop propio, en un thread daemon. Todas las llamadas pasan por ese loop y por un
+# semáforo (LLM_MAX_CONCURRENCIA), así los threads de WSGI/prefetch/cola comparten conexiones.
+#   - chat(**kw) / responses(**kw): fachada sync para las vistas y workers existentes
+#   - achat(**kw) / astream_chat(**kw): para vistas async (ASGI), sin bloquear el loop del servidor
+# Protección del request path:
+#   - plazo por llamada (LLM_PLAZO): si el LLM no responde a tiempo la llamada se cancela
+#   - hedging: si la respuesta tarda más de LLM_HEDGE_DESPUES se manda un segundo pedido igual a
+#     otro proveedor y gana el primero que llegue (corta la cola larga de latencias); con un solo
+#     proveedor no se duplica el pedido
+#   - circuit breaker: tras LLM_BREAKER_FALLOS fallas transitorias seguidas (timeout, conexión,
+#     429 o 5xx; un 400 es culpa del pedido, no del proveedor) se abre por LLM_BREAKER_ESPERA
+#     segundos (compartido entre procesos vía cache de Django); mientras está abierto las llamadas
+#     fallan al instante con LLMNoDisponible y quien llama sirve su respaldo sin reintentar
+# Cada llamada exitosa se anota en el registro de uso (usage.ledger: tokens, latencia, costo) con
+# el usuario y modo de usage.services.llm_context; si el usuario agotó sus tokens del día la
+# llamada falla con PresupuestoAgotado (también un LLMNoDisponible: se sirve el respaldo).
+# Con varios proveedores (LLM_PROVEEDORES) cada llamada va al más rápido y sano para su modo según
+# router.py; cada proveedor tiene su propio cliente y su propio circuit breaker, y el hedge va al
+# segundo candidato. fuente_usada() dice qué proveedor respondió (para Feedback.fuente_ia).
+# Pruebas de carga offline: LLM_GRABAR graba cada pedido/respuesta (ver replay.py) y LLM_BASE_URL
+# apunta el cliente al stub local que las reproduce.
+
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from dotenv import load_dotenv
+from openai import APIConnectionError, AsyncOpenAI
+
+from . import router
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_loop = None
+_clientes = {}
+_semaforo = None
+
+KEY_BREAKER = "llm:breaker:{}:abierto_hasta"
+
+# Proveedor que respondió la última llamada de este contexto (request/tarea)
+_proveedor_usado = contextvars.ContextVar("llm_proveedor_usado", default=None)
+
+
+class LLMNoDisponible(Exception):
+    # Circuito abierto o plazo vencido: usar el respaldo, no reintentar
+    pass
+
+
+class PresupuestoAgotado(LLMNoDisponible):
+    # El usuario del llm_context ya gastó sus tokens del día
+    pass
+
+
+class _Fallaron(Exception):
+    # Ningún pedido respondió: [(proveedor, excepción)] de cada uno y el error que se propaga
+    def __init__(self, fallidos, error):
+        super().__init__(str(error))
+        self.fallidos = fallidos
+        self.error = error
+
+
+def _es_transitoria(error):
+    # Solo estas fallas hablan de la salud del proveedor y cuentan para el circuit breaker
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, APIConnectionError, httpx.TransportError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+class _Breaker:
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self._key = KEY_BREAKER.format(nombre)
+        self._lock = threading.Lock()
+        self._fallos = 0
+        self._abierto_hasta = 0.0
+        self._probando = False
+
+    def permitir(self):
+        # False si el circuito está abierto; en semiabierto deja pasar una sola llamada de prueba
+        ahora = time.time()
+        with self._lock:
+            abierto_hasta = self._abierto_hasta
+        if abierto_hasta <= ahora:
+            try:
+                abierto_hasta = max(abierto_hasta, cache.get(self._key) or 0.0)
+            except Exception:
+                logger.warning("No se pudo leer el estado del circuit breaker del cache")
+        if abierto_hasta > ahora:
+            return False
+        with self._lock:
+            if self._fallos >= self._umbral():
+                if self._probando:
+                    return False
+                self._probando = True
+        return True
+
+    def exito(self):
+        with self._lock:
+            if self._fallos >= self._umbral():
+                logger.info("Circuit breaker LLM de %s cerrado", self.nombre)
+            self._fallos = 0
+            self._probando = False
+            self._abierto_hasta = 0.0
+
+    def fallo(self):
+        with self._lock:
+            self._fallos += 1
+            self._probando = False
+            if self._fallos < self._umbral():
+                return
+            espera = getattr(settings, "LLM_BREAKER_ESPERA", 30)
+            self._abierto_hasta = time.time() + espera
+            abierto_hasta = self._abierto_hasta
+        logger.warning("Circuit breaker LLM de %s abierto por %ss tras %d fallas seguidas", self.nombre, espera, self._fallos)
+        try:
+            cache.set(self._key, abierto_hasta, timeout=espera)
+        except Exception:
+            logger.warning("No se pudo compartir el estado del circuit breaker en el cache")
+
+    def cerrado(self):
+        # Sin fallas acumuladas ni apertura vigente (no consume la llamada de prueba del semiabierto)
+        with self._lock:
+            return self._fallos < self._umbral() and self._abierto_hasta <= time.time()
+
+    def liberar(self):
+        # La llamada de prueba no llegó a decidir (ganó el hedge de otro proveedor)
+        with self._lock:
+            self._probando = False
+
+    def _umbral(self):
+        return getattr(settings, "LLM_BREAKER_FALLOS", 5)
+
+    def reiniciar(self):
+        with self._lock:
+            self._fallos = 0
+            self._probando = False
+            self._abierto_hasta = 0.0
+        cache.delete(self._key)
+
+
+_breakers = {}
+
+
+def breaker(nombre):
+    b = _breakers.get(nombre)
+    if b is None:
+        with _lock:
+            b = _breakers.setdefault(nombre, _Breaker(nombre))
+    return b
+
+
+def _http2_disponible():
+    if not getattr(settings, "LLM_HTTP2", True):
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.info("Paquete h2 no instalado: el gateway LLM usa HTTP/1.1 con keep-alive")
+        return False
+    return True
+
+
+def _crear_cliente(proveedor):
+    transporte = httpx.AsyncHTTPTransport(
+        http2=_http2_disponible(),
+        limits=httpx.Limits(
+            max_connections=getattr(settings, "LLM_MAX_CONEXIONES", 20),
+            max_keepalive_connections=getattr(settings, "LLM_MAX_CONEXIONES", 20),
+            keepalive_expiry=getattr(settings, "LLM_KEEPALIVE", 60),
+        ),
+    )
+    if getattr(settings, "LLM_GRABAR", False):
+        from .replay import TransporteGrabador, directorio
+        logger.info("Gateway LLM grabando pedidos/respuestas en %s", directorio())
+        transporte = TransporteGrabador(transporte)
+    http_client = httpx.AsyncClient(
+        transport=transporte,
+        timeout=httpx.Timeout(getattr(settings, "LLM_TIMEOUT", 60), connect=10),
+    )
+    # base_url del proveedor: OpenAI si está vacío; LLM_BASE_URL la define para el proveedor por
+    # defecto (p. ej. `manage.py servidor_llm`)
+    base_url = proveedor.base_url
+    api_key = os.getenv(proveedor.api_key_env) or ("sin-clave" if base_url else None)
+    return AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+
+
+def _cliente(nombre):
+    # Solo desde el loop del gateway (el cliente httpx queda atado a ese loop)
+    cliente = _clientes.get(nombre)
+    if cliente is None:
+        cliente = _clientes[nombre] = _crear_cliente(router.proveedor(nombre))
+    return cliente
+
+
+def _iniciar():
+    # El cliente httpx queda atado al loop donde se crea, por eso todo se crea dentro del thread
+    global _loop
+    if _loop is not None:
+        return _loop
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            listo = threading.Event()
+
+            errores = []
+
+            def _correr():
+                global _semaforo
+                asyncio.set_event_loop(loop)
+                try:
+                    router.proveedores()
+                    _semaforo = asyncio.Semaphore(getattr(settings, "LLM_MAX_CONCURRENCIA", 8))
+                except Exception as e:
+                    errores.append(e)
+                    return
+                finally:
+                    listo.set()
+                loop.run_forever()
+
+            threading.Thread(target=_correr, name="llm-gateway", daemon=True).start()
+            listo.wait()
+            if errores:
+                raise errores[0]
+            _loop = loop
+    return _loop
+
+
+def _kwargs_de(nombre, kwargs):
+    modelo = router.proveedor(nombre).modelo
+    return {**kwargs, "model": modelo} if modelo else kwargs
+
+
+async def _un_pedido(nombre, metodo, kwargs):
+    # Devuelve (proveedor, respuesta); la latencia (sin la espera del semáforo) va a las estadísticas del router
+    async with _semaforo:
+        cliente = _cliente(nombre)
+        inicio = time.monotonic()
+        try:
+            if metodo == "responses":
+                resultado = await cliente.responses.create(**_kwargs_de(nombre, kwargs))
+            else:
+                resultado = await cliente.chat.completions.create(**_kwargs_de(nombre, kwargs))
+        except asyncio.CancelledError:
+            # perdió contra el hedge o venció el plazo: no es una falla, pero tardó al menos esto
+            # (sin esta muestra un proveedor lento que siempre pierde nunca bajaría en el orden)
+            router.registrar(nombre, (time.monotonic() - inicio) * 1000, ok=True)
+            raise
+        except Exception:
+            router.registrar(nombre, (time.monotonic() - inicio) * 1000, ok=False)
+            raise
+        router.registrar(nombre, (time.monotonic() - inicio) * 1000, ok=True)
+        return nombre, resultado
+
+
+async def _llamar(elegidos, metodo, kwargs, plazo):
+    # Un pedido con plazo; si tarda más de LLM_HEDGE_DESPUES (o falla) se lanza una vez uno idéntico
+    # al segundo proveedor elegido (nunca otro al mismo: duplicaría el gasto sin cambiar nada).
+    # Devuelve (proveedor, respuesta, [(proveedor, excepción)] de los que fallaron); si ninguno
+    # responde lanza _Fallaron con todos los que fallaron o seguían en vuelo al vencer el plazo
+    principal, respaldo = elegidos
+    hedge = getattr(settings, "LLM_HEDGE_DESPUES", 0)
+    tareas = {asyncio.ensure_future(_un_pedido(principal, metodo, kwargs))}
+    nombres = {next(iter(tareas)): principal}
+    fallidos = []
+    cubierto = respaldo == principal
+    limite = time.monotonic() + plazo
+    try:
+        while True:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                vencido = asyncio.TimeoutError()
+                raise _Fallaron(fallidos + [(nombres[t], vencido) for t in tareas], vencido)
+            listas, tareas = await asyncio.wait(
+                tareas, timeout=restante if cubierto or not hedge else min(restante, hedge),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            error = None
+            for tarea in listas:
+                if tarea.exception() is None:
+                    nombre, resultado = tarea.result()
+                    return nombre, resultado, fallidos
+                fallidos.append((nombres[tarea], tarea.exception()))
+                error = tarea
+            # si una falla pero queda otra en vuelo, se espera a la otra
+            if error is not None and not tareas and cubierto:
+                raise _Fallaron(fallidos, error.exception())
+            # sin hedge útil si ya venció el plazo: se lanzaría para cancelarlo enseguida
+            if not cubierto and (error is not None or not listas) and limite > time.monotonic():
+                cubierto = True
+                logger.debug("Hedging: segundo pedido LLM a %s (%s)", respaldo, "falló el primero" if error else f"{hedge}s sin respuesta")
+                tarea = asyncio.ensure_future(_un_pedido(respaldo, metodo, kwargs))
+                nombres[tarea] = respaldo
+                tareas.add(tarea)
+    finally:
+        for tarea in tareas:
+            tarea.cancel()
+
+
+def _ejecutar(coro):
+    return asyncio.run_coroutine_threadsafe(coro, _iniciar())
+
+
+def _plazo(plazo):
+    return plazo if plazo is not None else getattr(settings, "LLM_PLAZO", 20)
+
+
+def anotar_uso(model, usage, inicio):
+    # usage de chat.completions (prompt/completion_tokens) o de responses (input/output_tokens)
+    from usage.services import record_llm_call
+
+    try:
+        record_llm_call(
+            model=model,
+            prompt_tokens=getattr(usage, "prompt_tokens", None) or getattr(usage, "input_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", None) or getattr(usage, "output_tokens", 0) or 0,
+            latency_ms=(time.monotonic() - inicio) * 1000,
+        )
+    except Exception:
+        logger.exception("No se pudo registrar el uso del LLM")
+
+
+def _anotar_fallo(nombre, error):
+    if _es_transitoria(error):
+        breaker(nombre).fallo()
+    else:
+        # la llamada de prueba del semiabierto no decidió nada sobre la salud del proveedor
+        breaker(nombre).liberar()
+
+
+def _registrar(futuro, plazo, kwargs, inicio, elegidos):
+    # Toma el resultado del pedido (bloquea si aún no terminó), actualiza los breakers y anota el uso
+    principal = elegidos[0]
+    try:
+        nombre, resultado, fallidos = futuro.result()
+    except _Fallaron as e:
+        for fallido, error in e.fallidos:
+            _anotar_fallo(fallido, error)
+        if isinstance(e.error, (asyncio.TimeoutError, TimeoutError)):
+            raise LLMNoDisponible(f"El LLM no respondió en {plazo}s")
+        raise e.error
+    except Exception as e:
+        _anotar_fallo(principal, e)
+        raise
+    for fallido, error in fallidos:
+        _anotar_fallo(fallido, error)
+    breaker(nombre).exito()
+    if nombre != principal and principal not in {f for f, _ in fallidos}:
+        breaker(principal).liberar()
+    _proveedor_usado.set(nombre)
+    anotar_uso(_kwargs_de(nombre, kwargs).get("model", ""), getattr(resultado, "usage", None), inicio)
+    return resultado
+
+
+def fuente_usada():
+    # Fuente (Feedback.fuente_ia) del proveedor que respondió la última llamada de este contexto
+    nombre = _proveedor_usado.get()
+    if nombre is None:
+        return "chatgpt"
+    return router.proveedor(nombre).fuente
+
+
+def _elegir(metodo, hedge=True):
+    # (principal, respaldo del hedge) entre los candidatos del modo actual con el circuito cerrado
+    from usage.services import current_llm_context
+
+    _, modo = current_llm_context()
+    candidatos = router.candidatos(modo, metodo)
+    for i, nombre in enumerate(candidatos):
+        if breaker(nombre).permitir():
+            respaldo = next((n for n in candidatos[i + 1:] if breaker(n).cerrado()), nombre) if hedge else nombre
+            return nombre, respaldo
+    raise LLMNoDisponible("Circuit breaker abierto" if candidatos else f"Ningún proveedor LLM atiende {modo}/{metodo}")
+
+
+def _verificar_presupuesto():
+    from usage.services import can_user_call_llm
+
+    try:
+        puede, limite, usados = can_user_call_llm()
+    except Exception:
+        logger.exception("No se pudo verificar el presupuesto de tokens")
+        return
+    if not puede:
+        raise PresupuestoAgotado(f"Tokens del día agotados ({usados}/{limite})")
+
+
+def _enviar(metodo, kwargs, plazo):
+    _verificar_presupuesto()
+    elegidos = _elegir(metodo)
+    plazo = _plazo(plazo)
+    return _ejecutar(_llamar(elegidos, metodo, kwargs, plazo)), plazo, time.monotonic(), elegidos
+
+
+def limite_presupuesto(segundos=None):
+    # Instante (monotonic) en que vence el presupuesto total de una operación con reintentos
+    return time.monotonic() + (segundos if segundos is not None else getattr(settings, "LLM_PRESUPUESTO", 25))
+
+
+def restante(limite):
+    return max(limite - time.monotonic(), 0.0)
+
+
+def dormir(limite, segundos):
+    # Backoff entre reintentos solo si el presupuesto alcanza para esperar y volver a intentar
+    if restante(limite) <= segundos + 1:
+        return False
+    time.sleep(segundos)
+    return True
+
+
+def chat(plazo=None, **kwargs):
+    # Igual que client.chat.completions.create(**kwargs), bloquea solo el thread que llama
+    futuro, plazo, inicio, elegidos = _enviar("chat", kwargs, plazo)
+    return _registrar(futuro, plazo, kwargs, inicio, elegidos)
+
+
+def responses(plazo=None, **kwargs):
+    # Igual que client.responses.create(**kwargs)
+    futuro, plazo, inicio, elegidos = _enviar("responses", kwargs, plazo)
+    return _registrar(futuro, plazo, kwargs, inicio, elegidos)
+
+
+async def achat(plazo=None, **kwargs):
+    # el presupuesto consulta la DB (plan del usuario): no se puede hacer desde el event loop
+    futuro, plazo, inicio, elegidos = await sync_to_async(_enviar)("chat", kwargs, plazo)
+    await asyncio.wait([asyncio.wrap_future(futuro)])
+    return _registrar(futuro, plazo, kwargs, inicio, elegidos)
+
+
+async def _abrir_stream(nombre, kwargs):
+    await _semaforo.acquire()
+    inicio = time.monotonic()
+    try:
+        # el último chunk trae el usage del stream completo
+        stream = await _cliente(nombre).chat.completions.create(
+            stream=True, stream_options={"include_usage": True}, **_kwargs_de(nombre, kwargs),
+        )
+    except BaseException as e:
+        _semaforo.release()
+        if isinstance(e, Exception):
+            router.registrar(nombre, (time.monotonic() - inicio) * 1000, ok=False)
+        raise
+    # latencia hasta abrir el stream (primeros headers), comparable entre proveedores
+    router.registrar(nombre, (time.monotonic() - inicio) * 1000, ok=True)
+    return stream
+
+
+async def _siguiente(stream):
+    try:
+        return await stream.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def _cerrar_stream(stream):
+    try:
+        await stream.close()
+    finally:
+        _semaforo.release()
+
+
+async def astream_chat(**kwargs):
+    """
+    chat.completions con stream=True desde cualquier event loop: el stream vive en el loop del
+    gateway y cada chunk se pide con run_coroutine_threadsafe. Ocupa un lugar del semáforo
+    hasta que termina (o quien consume cierra el generador).
+    """
+    await sync_to_async(_verificar_presupuesto)()
+    nombre, _ = _elegir("chat", hedge=False)
+    inicio = time.monotonic()
+    try:
+        stream = await asyncio.wrap_future(_ejecutar(_abrir_stream(nombre, kwargs)))
+    except Exception as e:
+        _anotar_fallo(nombre, e)
+        raise
+    breaker(nombre).exito()
+    _proveedor_usado.set(nombre)
+    usage = None
+    try:
+        while True:
+            chunk = await asyncio.wrap_future(_ejecutar(_siguiente(stream)))
+            if chunk is None:
+                anotar_uso(_kwargs_de(nombre, kwargs).get("model", ""), usage, inicio)
+                return
+            usage = getattr(chunk, "usage", None) or usage
+            yield chunk
+    finally:
+        await asyncio.wrap_future(_ejecutar(_cerrar_stream(stream)))
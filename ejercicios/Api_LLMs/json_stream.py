@@ -0,0 +1,174 @@
+# Parser incremental del JSON de feedback que devuelve el LLM en streaming.
+# El modelo manda {"texto": "...", "feedback_json": {...}, "pasos": [{...}, ...]} de a pedazos;
+# para mostrar algo apenas llega el primer token no se puede esperar al JSON completo.
+# ParserFeedback recorre los caracteres una sola vez (guarda el estado entre pedazos, así no
+# importa dónde se corte un escape o un \uXXXX) y emite:
+#   ("texto", fragmento)  a medida que avanza el string de "texto"
+#   ("paso", dict)        cada vez que se cierra un elemento de "pasos"
+# Al final resultado() parsea una sola vez el objeto raíz ya delimitado (lo que venga antes o
+# después, como ```json, se ignora). extraer_objeto() hace lo mismo para un texto completo.
+
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class ParserFeedback:
+    def __init__(self, campo_texto="texto", campo_pasos="pasos"):
+        self.campo_texto = campo_texto
+        self.campo_pasos = campo_pasos
+        self.buffer = []
+        self._pos = 0              # caracteres ya consumidos
+        self._inicio = False       # ya apareció la primera "{" (se ignora lo anterior, p.ej. ```json)
+        self._pos_inicio = None    # posición de esa "{"
+        self._pos_fin = None       # posición de la "}" que cierra el objeto raíz (lo posterior se ignora)
+        self._pila = []            # "{" / "[" abiertos
+        self._claves = []          # clave actual de cada objeto abierto (None si no hay)
+        self._en_string = False
+        self._escape = None        # None, "" (después de \) o los dígitos de un \uXXXX
+        self._string = []          # string actual (solo se guarda si es una clave)
+        self._esperando_clave = False
+        self._inicio_paso = None   # posición donde empezó el elemento actual de "pasos"
+
+    def _ruta_valor(self):
+        # Clave del valor que se está leyendo en el objeto raíz ("texto", "pasos", ...) o None
+        if len(self._pila) == 1 and self._pila[0] == "{":
+            return self._claves[0]
+        return None
+
+    def feed(self, fragmento):
+        eventos = []
+        if not fragmento:
+            return eventos
+        self.buffer.append(fragmento)
+        texto = []
+        for ch in fragmento:
+            pos = self._pos
+            self._pos += 1
+            if self._pos_fin is not None:
+                continue
+            if not self._inicio:
+                if ch != "{":
+                    continue
+                self._inicio = True
+                self._pos_inicio = pos
+
+            if self._en_string:
+                valor = self._leer_char_string(ch)
+                if valor is None:
+                    continue
+                if valor is False:  # fin del string
+                    self._en_string = False
+                    if self._esperando_clave:
+                        self._claves[-1] = "".join(self._string)
+                        self._esperando_clave = False
+                    continue
+                if self._esperando_clave:
+                    self._string.append(valor)
+                elif self._ruta_valor() == self.campo_texto:
+                    texto.append(valor)
+                continue
+
+            if ch == '"':
+                self._en_string = True
+                self._string = []
+                self._escape = None
+            elif ch in "{[":
+                if ch == "{" and self._en_pasos():
+                    self._inicio_paso = pos
+                self._pila.append(ch)
+                self._claves.append(None)
+                self._esperando_clave = ch == "{"
+            elif ch in "}]":
+                if not self._pila:
+                    continue
+                self._pila.pop()
+                self._claves.pop()
+                self._esperando_clave = False
+                if not self._pila:
+                    self._pos_fin = pos
+                if ch == "}" and self._inicio_paso is not None and self._en_pasos():
+                    if texto:
+                        eventos.append(("texto", "".join(texto)))
+                        texto = []
+                    paso = self._cerrar_paso(pos)
+                    if paso is not None:
+                        eventos.append(("paso", paso))
+            elif ch == ",":
+                if self._pila and self._pila[-1] == "{":
+                    self._claves[-1] = None
+                    self._esperando_clave = True
+            elif ch == ":":
+                self._esperando_clave = False
+        if texto:
+            eventos.append(("texto", "".join(texto)))
+        return eventos
+
+    def _leer_char_string(self, ch):
+        # Devuelve el carácter decodificado, None si todavía falta (escape a medias) o False si cierra
+        if self._escape is None:
+            if ch == "\\":
+                self._escape = ""
+                return None
+            if ch == '"':
+                return False
+            return ch
+        if self._escape == "":
+            if ch == "u":
+                self._escape = "u"
+                return None
+            self._escape = None
+            return _ESCAPES.get(ch, ch)
+        # \uXXXX
+        self._escape += ch
+        if len(self._escape) < 5:
+            return None
+        codigo, self._escape = self._escape[1:], None
+        try:
+            return chr(int(codigo, 16))
+        except ValueError:
+            return ""
+
+    def _en_pasos(self):
+        # Parado directamente dentro del array "pasos" del objeto raíz (un "{" acá abre un paso)
+        return self._pila == ["{", "["] and self._claves[0] == self.campo_pasos
+
+    def _cerrar_paso(self, fin):
+        completo = "".join(self.buffer)
+        crudo = completo[self._inicio_paso:fin + 1]
+        self._inicio_paso = None
+        try:
+            paso = json.loads(crudo)
+        except json.JSONDecodeError:
+            logger.debug("Paso del stream no parseable: %s", crudo[:200])
+            return None
+        return paso if isinstance(paso, dict) else None
+
+    def texto_completo(self):
+        return "".join(self.buffer)
+
+    def resultado(self):
+        """
+        El objeto raíz ya parseado (dict) o None si no llegó completo o no es JSON válido.
+        Sin re-escanear el texto: se parsea una vez el tramo delimitado durante feed().
+        """
+        if self._pos_fin is None:
+            return None
+        crudo = self.texto_completo()[self._pos_inicio:self._pos_fin + 1]
+        try:
+            # strict=False acepta saltos de línea sin escapar dentro de los strings
+            parsed = json.loads(crudo, strict=False)
+        except json.JSONDecodeError as e:
+            logger.warning("JSON del LLM inválido: %s", str(e))
+            return None
+        return parsed if isinstance(parsed, dict) else None
+
+
+def extraer_objeto(texto):
+    # Primer objeto JSON de un texto completo (dict) o None, en una sola pasada
+    parser = ParserFeedback()
+    parser.feed(texto)
+    return parser.resultado()
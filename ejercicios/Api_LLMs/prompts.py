@@ -0,0 +1,135 @@
+# Plantillas de prompt versionadas de Api_LLMs.
+# Antes build_prompt armaba en cada llamada un f-string con la carrera repetida en medio del system
+# (y la indentación del código incluida), y el feedback reenviaba el formato JSON completo aunque
+# structured outputs ya lo impone. Ahora cada plantilla tiene:
+#   - system: texto fijo, compilado una vez al importar (sin variables): es el mismo prefijo en todas
+#     las llamadas, así el proveedor puede reutilizar su cache de prompt
+#   - user: lo único que cambia (carrera, enunciado, respuesta...) va al final
+#   - version + huella: la huella (hash de versión y textos) versiona los caches de contextos y de
+#     feedback; cambiar una plantilla invalida solo lo generado con ella
+# Los tokens de cada plantilla se miden con `manage.py medir_prompts`.
+
+import hashlib
+import json
+
+from django.conf import settings
+
+
+def _compactar(texto):
+    # Sin indentación ni líneas vacías de sobra: son tokens que no aportan nada
+    return "\n".join(linea.strip() for linea in texto.strip().splitlines() if linea.strip())
+
+
+class Plantilla:
+    def __init__(self, nombre, version, system, user):
+        self.nombre = nombre
+        self.version = version
+        self.system = _compactar(system)
+        self.user = user
+        self.huella = hashlib.sha256(f"{version}\n{self.system}\n{user}".encode("utf-8")).hexdigest()[:16]
+
+    def mensajes(self, **variables):
+        """(system, user) listos para enviar."""
+        return self.system, self.user.format(**variables)
+
+    def extra(self):
+        # prompt_cache_key agrupa las llamadas con el mismo prefijo en el mismo cache del proveedor
+        if not getattr(settings, "LLM_PROMPT_CACHE_KEY", True):
+            return {}
+        return {"extra_body": {"prompt_cache_key": f"sinekys-{self.nombre}-{self.version}"}}
+
+
+CONTEXTO = Plantilla(
+    "contexto", "2",
+    """
+    Eres un profesor universitario experto en la carrera que se indica en el mensaje. Conviertes ejercicios matemáticos en contextos reales de aplicación profesional para estudiantes de esa carrera.
+    Reglas:
+    1. No proporciones la solución ni expliques cómo resolverlo.
+    2. display_text: el enunciado reformulado como una situación concreta y plausible de esa carrera donde se debe aplicar lo aprendido.
+    3. hint: una pista específica al contexto profesional de esa carrera, máximo 2 oraciones.
+    4. Lenguaje de estudiante universitario de la carrera (no de secundaria), como si en un entorno real se le pidiera el cálculo.
+    """,
+    "Carrera: {carrera}\nEjercicio: {ejercicio}",
+)
+
+DIAGNOSTICO = Plantilla(
+    "diagnostico", "2",
+    """
+    Eres un profesor de matemáticas de nivel introductorio. Contextualizas enunciados para la prueba diagnóstica inicial de Sinekys (nivel básico).
+    Responde en español con un lenguaje claro, sencillo y general.
+    No incluyas referencias a carreras o especialidades ni ejemplos contextualizadores.
+    display_text: el enunciado para el estudiante; exercise: el ejercicio matemático; learning_objective: qué evalúa; tags: temas; hint: una pista breve.
+    """,
+    "Ejercicio: {ejercicio}",
+)
+
+FEEDBACK = Plantilla(
+    "feedback", "2",
+    """
+    Actúas como el motor pedagógico oficial de Sinekys. Produces retroalimentación matemática concisa, clara, estructurada y sin relleno.
+    Tono técnico, directo y orientado a corregir. NO des sermones, NO interpretes intenciones.
+    Campos:
+    - texto: explicación breve de 3 a 6 líneas, sin introducciones ni frases genéricas.
+    - feedback_json.pasos_correctos: los pasos correctos; el último es la respuesta correcta final.
+    - feedback_json.errores: tipo "conceptual" o "procedimiento" y su detalle.
+    - pasos: cada paso del estudiante con tipo "correcto" o "error" y su contenido.
+    Reglas:
+    - No describas obviedades ni uses frases como 'es importante', 'debemos entender', 'tu objetivo es'.
+    - Solo lo esencial para corregir, sin redundancias.
+    - Si la respuesta es absurda, indícalo técnicamente ('no coincide con la solución').
+    - Si no se pueden generar pasos, devuelve listas vacías.
+    - Háblale directamente al estudiante en tono neutro: 'Te equivocaste en esto', 'Tu respuesta debió ser', 'Aquí lo hiciste bien, porque...'.
+    """,
+    "{datos}",
+)
+
+# Lotes: mismo system que la plantilla individual (mismo prefijo cacheable) más la regla de los items.
+# Los contextos generados en lote se guardan con la misma clave de cache que los individuales.
+_REGLA_LOTE = """
+Recibirás varios ejercicios, uno por línea como JSON con su id. Devuelve en items exactamente un elemento por ejercicio, con el mismo id, contextualizado de forma independiente.
+"""
+
+CONTEXTO_LOTE = Plantilla(
+    "contexto_lote", "1",
+    CONTEXTO.system + "\n" + _REGLA_LOTE,
+    "Carrera: {carrera}\nEjercicios:\n{ejercicios}",
+)
+
+DIAGNOSTICO_LOTE = Plantilla(
+    "diagnostico_lote", "1",
+    DIAGNOSTICO.system + "\n" + _REGLA_LOTE,
+    "Ejercicios:\n{ejercicios}",
+)
+
+PLANTILLAS = {p.nombre: p for p in (CONTEXTO, CONTEXTO_LOTE, DIAGNOSTICO, DIAGNOSTICO_LOTE, FEEDBACK)}
+
+
+def lista_ejercicios(items):
+    # Una línea JSON por par (id, enunciado): {"id": pk, "ejercicio": enunciado}
+    return "\n".join(
+        json.dumps({"id": pk, "ejercicio": enunciado}, ensure_ascii=False, separators=(",", ":"))
+        for pk, enunciado in items
+    )
+
+
+def datos_feedback(payload):
+    # Solo los campos con contenido (la carrera casi nunca viene): menos tokens por llamada
+    datos = {
+        clave: payload.get(clave)
+        for clave in ("enunciado", "solucion", "carrera", "pasos", "respuesta_estudiante")
+        if payload.get(clave)
+    }
+    return json.dumps(datos, ensure_ascii=False, separators=(",", ":"))
+
+
+def contar_tokens(texto, modelo=None):
+    """Tokens de `texto` con tiktoken si está instalado; si no, estimación de ~4 caracteres por token."""
+    try:
+        import tiktoken
+    except ImportError:
+        return max(1, len(texto) // 4)
+    try:
+        codificador = tiktoken.encoding_for_model(modelo or "gpt-4o-mini")
+    except KeyError:
+        codificador = tiktoken.get_encoding("o200k_base")
+    return len(codificador.encode(texto))
@@ -0,0 +1,213 @@
+# Grabación y reproducción de llamadas al LLM para pruebas de carga sin OpenAI.
+#   - Con LLM_GRABAR el gateway envuelve su transporte httpx en TransporteGrabador: cada pedido
+#     exitoso se guarda en LLM_GRABACIONES_DIR, direccionado por contenido
+#     (sha256 del endpoint + cuerpo JSON canónico), junto con la latencia observada.
+#   - `manage.py servidor_llm` levanta un stub HTTP con la misma API (chat/completions y responses,
+#     con y sin stream) que responde desde esas grabaciones con latencia simulada.
+#   - Con LLM_BASE_URL=http://127.0.0.1:8765/v1 el gateway le habla al stub en vez de a OpenAI, así
+#     DiagnosticTestView / EjercicioView se pueden medir de punta a punta offline y reproduciblemente.
+# Un pedido sin grabación se puede simular (respuesta armada desde el JSON schema del structured
+# output), así el stub sirve aunque no se haya grabado nada.
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import httpx
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+ENDPOINTS = ("chat/completions", "responses")
+
+_lock = threading.Lock()
+
+
+def directorio():
+    return getattr(settings, "LLM_GRABACIONES_DIR", os.path.join(settings.BASE_DIR, "llm_grabaciones"))
+
+
+def endpoint_de(path):
+    # "/v1/chat/completions" -> "chat/completions"
+    path = path.strip("/")
+    for endpoint in ENDPOINTS:
+        if path.endswith(endpoint):
+            return endpoint
+    return path
+
+
+def clave(endpoint, cuerpo):
+    """Clave de contenido de un pedido: mismo endpoint y mismo JSON (sin importar el orden) -> misma clave."""
+    if isinstance(cuerpo, (bytes, str)):
+        cuerpo = json.loads(cuerpo or b"{}")
+    canonico = json.dumps([endpoint, cuerpo], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonico.encode("utf-8")).hexdigest()
+
+
+def _ruta(clave_pedido, base=None):
+    return os.path.join(base or directorio(), clave_pedido[:2], f"{clave_pedido}.json")
+
+
+def cargar(clave_pedido, base=None):
+    try:
+        with open(_ruta(clave_pedido, base), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def guardar(endpoint, cuerpo, status, content_type, respuesta, latencia_ms, base=None):
+    """
+    Guarda (o suma la latencia a) la grabación de un pedido. Si el mismo pedido se graba varias
+    veces se conserva la primera respuesta y se acumulan las latencias: el stub las usa como
+    distribución empírica.
+    """
+    pedido = json.loads(cuerpo or b"{}")
+    clave_pedido = clave(endpoint, pedido)
+    ruta = _ruta(clave_pedido, base)
+    with _lock:
+        grabacion = cargar(clave_pedido, base)
+        if grabacion is None:
+            grabacion = {
+                "endpoint": endpoint,
+                "pedido": pedido,
+                "status": status,
+                "content_type": content_type,
+                "respuesta": respuesta,
+                "latencias_ms": [],
+            }
+        grabacion["latencias_ms"].append(round(latencia_ms, 1))
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(grabacion, f, ensure_ascii=False)
+        os.replace(temporal, ruta)
+    return clave_pedido
+
+
+class TransporteGrabador(httpx.AsyncBaseTransport):
+    # Deja pasar el pedido al transporte real y graba las respuestas 200 (el stream se lee completo)
+    def __init__(self, interno, base=None):
+        self.interno = interno
+        self.base = base
+
+    async def handle_async_request(self, request):
+        cuerpo = await request.aread()
+        inicio = time.monotonic()
+        respuesta = await self.interno.handle_async_request(request)
+        try:
+            contenido = b"".join([parte async for parte in respuesta.stream])
+        finally:
+            await respuesta.aclose()
+        latencia_ms = (time.monotonic() - inicio) * 1000
+
+        # contenido crudo (quizás comprimido): httpx lo decodifica según content-encoding al leerlo
+        headers = [(k, v) for k, v in respuesta.headers.multi_items() if k.lower() != "transfer-encoding"]
+        if respuesta.status_code == 200 and request.method == "POST":
+            try:
+                crudo = httpx.Response(200, headers=headers, content=contenido)
+                guardar(
+                    endpoint_de(request.url.path), cuerpo, 200,
+                    respuesta.headers.get("content-type", "application/json"),
+                    crudo.text, latencia_ms, self.base,
+                )
+            except Exception:
+                logger.exception("No se pudo grabar la respuesta del LLM")
+        return httpx.Response(
+            respuesta.status_code, headers=headers, content=contenido,
+            request=request, extensions=respuesta.extensions,
+        )
+
+    async def aclose(self):
+        await self.interno.aclose()
+
+
+# --- Respuestas simuladas (pedidos sin grabación) ---
+
+def _valor_de_schema(schema, defs):
+    if "$ref" in schema:
+        return _valor_de_schema(defs.get(schema["$ref"].rsplit("/", 1)[-1], {}), defs)
+    for variante in ("anyOf", "oneOf"):
+        if variante in schema:
+            return _valor_de_schema(schema[variante][0], defs)
+    tipo = schema.get("type")
+    if isinstance(tipo, list):
+        tipo = next((t for t in tipo if t != "null"), "null")
+    if tipo == "object":
+        return {k: _valor_de_schema(v, defs) for k, v in schema.get("properties", {}).items()}
+    if tipo == "array":
+        return [_valor_de_schema(schema.get("items", {}), defs)]
+    if tipo in ("integer", "number"):
+        return 0
+    if tipo == "boolean":
+        return False
+    if tipo == "null":
+        return None
+    return "Respuesta simulada"
+
+
+def contenido_simulado(endpoint, pedido):
+    # JSON que cumple el schema pedido (response_format o text.format); texto fijo si no hay schema
+    if endpoint == "responses":
+        formato = (pedido.get("text") or {}).get("format") or {}
+        schema = formato.get("schema")
+    else:
+        formato = pedido.get("response_format") or {}
+        schema = (formato.get("json_schema") or {}).get("schema")
+    if not schema:
+        return "Respuesta simulada"
+    return json.dumps(_valor_de_schema(schema, schema.get("$defs", {})), ensure_ascii=False)
+
+
+def _tokens(texto):
+    return max(1, len(texto) // 4)
+
+
+def respuesta_simulada(endpoint, pedido, clave_pedido):
+    """Cuerpo con el formato del API de OpenAI: dict, o lista de eventos SSE si el pedido es stream."""
+    contenido = contenido_simulado(endpoint, pedido)
+    modelo = pedido.get("model", "")
+    entrada = _tokens(json.dumps(pedido.get("messages") or pedido.get("input") or "", ensure_ascii=False))
+    salida = _tokens(contenido)
+    creado = int(time.time())
+    if endpoint == "responses":
+        return {
+            "id": f"resp_{clave_pedido[:24]}", "object": "response", "created_at": creado,
+            "model": modelo, "status": "completed",
+            "output": [{
+                "type": "message", "id": f"msg_{clave_pedido[:24]}", "status": "completed", "role": "assistant",
+                "content": [{"type": "output_text", "text": contenido, "annotations": []}],
+            }],
+            "usage": {"input_tokens": entrada, "output_tokens": salida, "total_tokens": entrada + salida},
+        }
+    base = {"id": f"chatcmpl-{clave_pedido[:24]}", "created": creado, "model": modelo}
+    if not pedido.get("stream"):
+        return {
+            **base, "object": "chat.completion",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": contenido}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": entrada, "completion_tokens": salida, "total_tokens": entrada + salida},
+        }
+    eventos = []
+    for i in range(0, len(contenido), 24):
+        delta = {"content": contenido[i:i + 24]}
+        if i == 0:
+            delta["role"] = "assistant"
+        eventos.append({**base, "object": "chat.completion.chunk",
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+    eventos.append({**base, "object": "chat.completion.chunk",
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+    if (pedido.get("stream_options") or {}).get("include_usage"):
+        eventos.append({**base, "object": "chat.completion.chunk", "choices": [],
+                        "usage": {"prompt_tokens": entrada, "completion_tokens": salida, "total_tokens": entrada + salida}})
+    return eventos
+
+
+def eventos_sse(grabacion_o_eventos):
+    """Separa un cuerpo SSE grabado (o una lista de chunks simulados) en eventos `data: ...\\n\\n`."""
+    if isinstance(grabacion_o_eventos, list):
+        eventos = [f"data: {json.dumps(e, ensure_ascii=False)}\n\n" for e in grabacion_o_eventos]
+        return eventos + ["data: [DONE]\n\n"]
+    return [f"{e.strip()}\n\n" for e in grabacion_o_eventos.split("\n\n") if e.strip()]
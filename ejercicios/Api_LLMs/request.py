@@ -1,95 +1,38 @@
-import os, json, time,re,logging
-import unicodedata
-from openai import OpenAI
+import os, logging
 from dotenv import load_dotenv
 from ..utils.text import normalize_text
+from . import gateway
+from .prompts import CONTEXTO, CONTEXTO_LOTE, lista_ejercicios
+from .respuestas import ContextoEjercicio, LoteContextoEjercicio, formato_respuesta, parsear
 
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("SINEKYS_OPENAI_API_KEY"))
 MODEL = os.getenv("MODEL", "gpt-4o-mini") 
 logger = logging.getLogger(__name__)
 
-#extraer contenido json de texto con múltiples estrategias robustas
-def _extract_json_like(text:str) -> str | None:
-    # estrategia 1: Buscar entre llaves
-    start = text.find("{")
-    end = text.rfind("}") + 1
-    if start != -1 and end != -1 and end > start:
-        return text[start:end]
-    # Regex para json válido
-    m = re.search(r'\{(?:[^{}]|(?R))*\}', text, re.DOTALL)
-    if m:
-        return m.group(0)
-    # Estrategia 2: Buscar regex
-    m = re.search(r'(\{.*\})', text, re.DOTALL)
-    if m:
-        return m.group(1)
-    
-    # Estrategia 3: Buscar bloques de texto que parezcan JSON
-    m = re.search(r'(\{(?:[^{}]|(?R))*\})', text, re.DOTALL | re.IGNORECASE)
-    if m:
-        return m.group(1)
-    return None
-
-# sanitiza y mantiene caracteres utf8 válidos
-def _sanitize_json_string(json_str: str) -> str:
-    if not isinstance(json_str, str):
-        return json_str
-    # Normalizar Unicode manteniendo caracteres legítimos
-    json_str = unicodedata.normalize('NFKC', json_str)
-    # Escapar solo caracteres problemáticos para JSON
-    json_str = json_str.replace('\\', '\\\\').replace('"', '\\"')
-    # Eliminar caracteres de control excepto espacios
-    return re.sub(r'[\x00-\x1f\x7f-\x9f]', ' ', json_str).strip()
 # Función para ejercicio estándar y grupos
 def build_prompt(carrera, ejercicio_enunciado):
+    # Plantilla fija en prompts.CONTEXTO: el system no cambia entre carreras, carrera y enunciado van al final
     # ejemplos_contexto = {
         # Traer aquí ejemplos reales usando fine-tuning o RAG 
     # }
-    system = (     
-        f"""
-            Eres un profesor universitario *experto* en {carrera}. Tu tarea es convertir ejercicios matemáticos en *contextos reales de aplicación profesional* para estudiantes de esa carrera.
-
-            INSTRUCCIONES:
-            1. No proporciones la solución al ejercicio.
-            2. No expliques cómo resolverlo.
-            3. Genera únicamente un JSON válido con los siguientes campos:
-            - "display_text": Enunciado del ejercicio, reformulado para que el estudiante visualice **una situación concreta en {carrera}** donde debe aplicar lo aprendido.
-            - "hint": Una pista **específica al contexto profesional de {carrera}**, máximo 2 oraciones.
-
-            REQUISITOS:
-            - El contexto debe describir un escenario plausible en esa carrera donde el ejercicio importa.
-            - El lenguaje debe ser del nivel “estudiante universitario de la carrera” (no de escuela secundaria) igual como si estuviera en un entorno real y se le está pidiendo el cálculo de algo.
-            - El JSON debe tener exactamente esos campos, sin texto adicional, comentarios, explicaciones.
-
-            """
-
-            # EJEMPLO DE SALIDA VÁLIDA:
-            # {{"display_text": "{ejemplos['ejercicio']}", "hint": "{ejemplos['contexto']}"}}
-        #"display_text, exercise, learning_objective, tags, hint (opcional)." #Revisar si estos atributos de respuestas son realmente necesario y/o se ajustan a la DB
-    )
-    user = f"""
-        Contextualiza este ejercicio para estudiantes de {carrera}:
-        Ejercicio: {ejercicio_enunciado}
-        """
-    # logger.debug("Prompt system: %s", system.strip())
-    # logger.debug("Prompt user: %s", user.strip())
-    
-    return system.strip(), user.strip()
+    return CONTEXTO.mensajes(carrera=carrera, ejercicio=ejercicio_enunciado)
 
-def safe_create_response(payload, carrera, max_retries=2):
+def safe_create_response(payload, carrera, max_retries=2, presupuesto=None):
     ejercicio_enunciado = payload.get("EJERCICIO", "")
     carrera_sanitizada = normalize_text(carrera, for_storage=True)
     # ejercicio_sanitizado = normalize_text(ejercicio_enunciado, for_storage=True)
     system, user = build_prompt(carrera, ejercicio_enunciado)
+    # presupuesto total (llamadas + esperas) para no dejar el request colgado si el LLM está lento
+    limite = gateway.limite_presupuesto(presupuesto)
     attempt = 0
     while attempt < max_retries:
         try:
             attempt += 1
             # logger.debug("LLM Request attempt %d for carrera=%s, ejercicio_id=%s", attempt, carrera_sanitizada, getattr(payload, "ejercicio_id", "?"))
             
-            resp = client.chat.completions.create(
+            resp = gateway.chat(
+                plazo=gateway.restante(limite),
                 model=MODEL,
                 messages=[
                     {"role": "system", "content": system},
@@ -98,34 +41,23 @@ def safe_create_response(payload, carrera, max_retries=2):
                 temperature=0.3,
                 max_tokens=512,
                 # max_output_tokens=256,
-                response_format={"type": "json_object"} #forzar que el formato json es el válido
+                response_format=formato_respuesta(ContextoEjercicio),  # structured output: JSON que cumple el schema
+                **CONTEXTO.extra()
             )
             # obtener contenido
-            text = resp.choices[0].message.content.strip()
-            # logger.debug("LLM Response received for carrera=%s, ejercicio_id=%s: %s", carrera_sanitizada, getattr(payload, "ejercicio_id", "?"), text[:1000])
-            try: 
-                parsed = json.loads(text)
-                # logger.debug("safe_create_response: JSON parsed successfully on attempt %d for carrera=%s, ejercicio_id=%s", attempt, carrera_sanitizada, getattr(payload, "ejercicio_id", "?"))
-                if "display_text" in parsed:
-                    parsed["display_text"] = normalize_text(parsed["display_text"], for_storage=True)
-                    return parsed
-                logger.warning("safe_create_response: 'display_text' missing in parsed JSON on attempt %d for carrera=%s, ejercicio_id=%s", attempt, carrera_sanitizada, getattr(payload, "ejercicio_id", "?"))
-            except json.JSONDecodeError as e:
-                logger.warning("safe_create_response: fallo parseo JSON en attempt %d for carrera=%s, ejercicio_id=%s, error=%s", attempt, carrera_sanitizada, getattr(payload, "ejercicio_id", "?"), str(e))
-                json_candidate = _extract_json_like(text)
-                if json_candidate:
-                    try:
-                        sanitized = _sanitize_json_string(json_candidate)
-                        parsed = json.loads(sanitized)
-                        if "display_text" in parsed:
-                            # logger.debug("safe_create_response: JSON parsed successfully after sanitization on attempt %d for carrera=%s, ejercicio_id=%s", attempt, carrera_sanitizada, getattr(payload, "ejercicio_id", "?"))
-                            return parsed
-                        logger.warning("safe_create_response: 'display_text' missing in sanitized JSON on attempt %)d for carrera=%s, ejercicio_id=%s", attempt, carrera_sanitizada, getattr(payload, "ejercicio_id", "?"))
-                    except json.JSONDecodeError as e2:
-                        logger.warning("safe_create_response: fallo parseo JSON sanitizado en attempt %d for carrera=%s, ejercicio_id=%s, error=%s", attempt, carrera_sanitizada, getattr(payload, "ejercicio_id", "?"), str(e2))
-                        # logger.debug("JSON candidate: %s", json_candidate)
-            if attempt < max_retries:
-                time.sleep(attempt * 0.7)
+            text = resp.choices[0].message.content or ""
+            contexto = parsear(text, ContextoEjercicio)
+            if contexto is not None:
+                parsed = contexto.model_dump()
+                parsed["display_text"] = normalize_text(parsed["display_text"], for_storage=True)
+                return parsed
+            # con structured outputs una respuesta inválida es un rechazo o un corte del modelo:
+            # repetir la misma llamada no ayuda, se usa el respaldo (los reintentos son para errores de red)
+            logger.warning("safe_create_response: respuesta sin JSON válido en attempt %d for carrera=%s, ejercicio_id=%s", attempt, carrera_sanitizada, getattr(payload, "ejercicio_id", "?"))
+            break
+        except gateway.LLMNoDisponible as exc:
+            logger.warning("safe_create_response: LLM no disponible (%s), usando respaldo. carrera=%s", exc, carrera_sanitizada)
+            break
         except Exception as exc:
             logger.error("Error en intento %d: %s", attempt, str(exc))
             logger.exception("Detalles de la excepción:")
@@ -133,10 +65,12 @@ def safe_create_response(payload, carrera, max_retries=2):
             if attempt >= max_retries:
                 logger.exception("safe_create_response: max_retries alcanzado. carrera=%s", carrera_sanitizada)
                 break
-            time.sleep(attempt * 1.0)
+            if not gateway.dormir(limite, attempt * 1.0):
+                break
     return {
         "display_text": ejercicio_enunciado,
-        "hint": f"Contexto académico para {carrera_sanitizada}: este tipo de ejercicio es relevante en tu formación profesional."
+        "hint": f"Contexto académico para {carrera_sanitizada}: este tipo de ejercicio es relevante en tu formación profesional.",
+        "fallback": True,
     }
 
 def contextualize_exercise(ejercicio, carrera):
@@ -166,9 +100,63 @@ def contextualize_exercise(ejercicio, carrera):
         logger.exception("Error en contextualize_exercise: %s", str(e))
         return {
             "display_text": normalize_text(ejercicio.enunciado, for_storage=True),
-            "hint": f"Contexto para {normalize_text(carrera, for_storage=True)} no disponible temporalmente"
+            "hint": f"Contexto para {normalize_text(carrera, for_storage=True)} no disponible temporalmente",
+            "fallback": True,
         }
          
+def contextualize_exercises(ejercicios, carrera, max_retries=2, presupuesto=None):
+    """
+    Contextualiza varios ejercicios para una carrera en una sola llamada (structured output con un
+    item por ejercicio). Devuelve {ejercicio.pk: {"display_text", "hint"}} solo con los que vinieron
+    bien; los que falten quedan para la llamada individual o el respaldo de quien llama.
+    """
+    ejercicios = list(ejercicios)
+    if not ejercicios:
+        return {}
+    carrera_str = normalize_text(carrera, for_storage=True)
+    system, user = CONTEXTO_LOTE.mensajes(
+        carrera=carrera_str,
+        ejercicios=lista_ejercicios((e.pk, normalize_text(e.enunciado, for_storage=True)) for e in ejercicios),
+    )
+    limite = gateway.limite_presupuesto(presupuesto)
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            resp = gateway.chat(
+                plazo=gateway.restante(limite),
+                model=MODEL,
+                messages=[
+                    {"role": "system", "content": system},
+                    {"role": "user", "content": user}
+                ],
+                temperature=0.3,
+                max_tokens=min(320 * len(ejercicios) + 64, 8192),
+                response_format=formato_respuesta(LoteContextoEjercicio),
+                **CONTEXTO_LOTE.extra()
+            )
+            break
+        except gateway.LLMNoDisponible as exc:
+            logger.warning("contextualize_exercises: LLM no disponible (%s). carrera=%s", exc, carrera_str)
+            return {}
+        except Exception as exc:
+            logger.error("contextualize_exercises: error en intento %d: %s", attempt, str(exc))
+            if attempt >= max_retries or not gateway.dormir(limite, attempt * 1.0):
+                return {}
+
+    lote = parsear(resp.choices[0].message.content or "", LoteContextoEjercicio)
+    if lote is None:
+        logger.warning("contextualize_exercises: lote sin JSON válido. carrera=%s, ejercicios=%d", carrera_str, len(ejercicios))
+        return {}
+    pedidos = {e.pk for e in ejercicios}
+    resultado = {
+        item.id: {"display_text": normalize_text(item.display_text, for_storage=True), "hint": item.hint}
+        for item in lote.items if item.id in pedidos and item.display_text
+    }
+    if len(resultado) < len(pedidos):
+        logger.warning("contextualize_exercises: %d de %d ejercicios sin contexto en el lote", len(pedidos) - len(resultado), len(pedidos))
+    return resultado
+
 # Ok, hasta el momento tengo 2 errores, el primero es que siempre me da el mismo ejercicio | Error solucionado Error solucionado Error solucionado Error solucionado
 # El segundo es que no me da un contexto apropiado | Pendiente
 
@@ -1,62 +1,61 @@
-import os, json, time
-from openai import OpenAI
+import os, logging
 from dotenv import load_dotenv
+from . import gateway
+from .prompts import DIAGNOSTICO, DIAGNOSTICO_LOTE, lista_ejercicios
+from .respuestas import ContextoDiagnostico, LoteContextoDiagnostico, formato_texto, parsear
 # Ojo, creo que esto es importnate mencionarlo, estas llamadas pueden ser algo costosas
-# Podría usar Redis para cachear los contexto, tanto de diagnostico como general y group
+# Los contextos se cachean en cache_contexto.py (LRU + cache de Django + tabla ContextoGenerado)
 load_dotenv()
-client = OpenAI(api_key=os.getenv("SINEKYS_OPENAI_API_KEY"))
 MODEL = os.getenv("MODEL", "gpt-4o-mini") 
+logger = logging.getLogger(__name__)
 
 
 def build_prompt_diagnostico(payload):
-    system = (
-        "Eres un profesor de matemáticas de nivel introductorio. "
-        "Responde en español con un lenguaje claro, sencillo y general. "
-        "Cuando te pidan contextualizar un enunciado para una prueba diagnóstica, "
-        "genera un JSON válido con las siguientes claves: "
-        "display_text, exercise, learning_objective, tags, hint (opcional). "
-        "No incluyas referencias a carreras o especialidades, ni ejemplos contextualizadores, nada de eso."
-    )
-    user = json.dumps(payload, ensure_ascii=False)
-    return system, user
+    # Plantilla fija en prompts.DIAGNOSTICO (tipo, nivel y uso ya van en el system); solo el enunciado cambia
+    return DIAGNOSTICO.mensajes(ejercicio=payload.get("EJERCICIO", ""))
 
 
-def safe_create_response_diagnostico(payload, max_retries=2):
+def safe_create_response_diagnostico(payload, max_retries=2, presupuesto=None):
     system, user = build_prompt_diagnostico(payload)
+    limite = gateway.limite_presupuesto(presupuesto)
     attempt = 0
     while True:
         try:
-            resp = client.responses.create(
+            resp = gateway.responses(
+                plazo=gateway.restante(limite),
                 model=MODEL,
                 instructions=system,
                 input=user,
                 temperature=0.2,
-                max_output_tokens=256
+                max_output_tokens=256,
+                text=formato_texto(ContextoDiagnostico),  # structured output
+                **DIAGNOSTICO.extra()
             )
-            text = resp.output_text.strip()
-            start = text.find("{")
-            end = text.rfind("}") + 1
-            json_text = text[start:end]
-            parsed = json.loads(json_text)
-            return parsed
+            contexto = parsear(resp.output_text, ContextoDiagnostico)
+            if contexto is None:
+                # JSON inválido pese al schema: no se reintenta, contextualize_exercise_diagnostico usa su respaldo
+                raise ValueError("Respuesta del LLM sin JSON válido para el diagnóstico")
+            return contexto.model_dump()
+        except ValueError:
+            raise
+        except gateway.LLMNoDisponible:
+            raise  # breaker abierto o sin tiempo: contextualize_exercise_diagnostico usa su respaldo
         except Exception:
             attempt += 1
-            if attempt > max_retries:
+            if attempt > max_retries or not gateway.dormir(limite, 1 + attempt*0.5):
                 raise
-            time.sleep(1 + attempt*0.5)
+
+def payload_diagnostico(ejercicio):
+    # También lo usa pregenerar_contextos para armar los pedidos del Batch API
+    return {"EJERCICIO": ejercicio.enunciado}
+
 
 def contextualize_exercise_diagnostico(ejercicio):
     """
     Versión neutra: genera un contexto simple para pruebas diagnósticas.
     """
     try:
-        payload = {
-        "EJERCICIO": ejercicio.enunciado,
-        "TIPO": "diagnostico",
-        "NIVEL": "basico",
-        "USO_EN_SISTEMA": "Prueba diagnóstica inicial",
-        }
-        return safe_create_response_diagnostico(payload)
+        return safe_create_response_diagnostico(payload_diagnostico(ejercicio))
     except Exception:
         # fallback seguro
         return {
@@ -64,5 +63,37 @@ def contextualize_exercise_diagnostico(ejercicio):
             "hint":"Piensa el ejercicio en partes lo más pequeñas posibles",
             "exercise": ejercicio.enunciado,
             "learning_objective": "Evaluar conocimientos básicos",
-            "tags": ["diagnostico"]
+            "tags": ["diagnostico"],
+            "fallback": True,
         }
+
+
+def contextualize_exercises_diagnostico(ejercicios, presupuesto=None):
+    """
+    Versión en lote: varios ejercicios del diagnóstico en una sola llamada.
+    Devuelve {ejercicio.pk: contexto} solo con los que vinieron bien (sin respaldo).
+    """
+    ejercicios = list(ejercicios)
+    if not ejercicios:
+        return {}
+    system, user = DIAGNOSTICO_LOTE.mensajes(ejercicios=lista_ejercicios((e.pk, e.enunciado) for e in ejercicios))
+    limite = gateway.limite_presupuesto(presupuesto)
+    try:
+        resp = gateway.responses(
+            plazo=gateway.restante(limite),
+            model=MODEL,
+            instructions=system,
+            input=user,
+            temperature=0.2,
+            max_output_tokens=min(256 * len(ejercicios) + 64, 8192),
+            text=formato_texto(LoteContextoDiagnostico),
+            **DIAGNOSTICO_LOTE.extra()
+        )
+    except Exception as exc:
+        logger.warning("contextualize_exercises_diagnostico: %s (%d ejercicios)", exc, len(ejercicios))
+        return {}
+    lote = parsear(resp.output_text, LoteContextoDiagnostico)
+    if lote is None:
+        return {}
+    pedidos = {e.pk for e in ejercicios}
+    return {item.id: item.model_dump(exclude={"id"}) for item in lote.items if item.id in pedidos}
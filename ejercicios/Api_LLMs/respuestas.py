@@ -0,0 +1,135 @@
+# Capa común para las respuestas del LLM.
+# Antes request.py y requestfeedback.py tenían cada uno su _extract_json_like (con `(?R)`, que el
+# `re` de Python no soporta) y _sanitize_json_string, y repasaban el texto completo varias veces
+# antes de rendirse y volver a llamar al LLM. Ahora:
+#   - cada respuesta tiene un modelo pydantic y se pide con structured outputs estrictos
+#     (formato_respuesta / formato_texto arman el JSON schema para chat.completions / responses)
+#   - parsear() extrae el primer objeto JSON en una sola pasada (json_stream.extraer_objeto,
+#     tolera ```json y texto alrededor) y lo valida una vez contra el modelo
+# Los nombres alternativos de campo que a veces devolvía el modelo se aceptan como alias.
+
+import copy
+import logging
+from typing import List, Optional, Type, TypeVar
+
+from pydantic import AliasChoices, BaseModel, Field, ValidationError
+
+from .json_stream import extraer_objeto
+
+logger = logging.getLogger(__name__)
+
+M = TypeVar("M", bound=BaseModel)
+
+
+class ContextoEjercicio(BaseModel):
+    display_text: str
+    hint: str = ""
+
+
+class ContextoDiagnostico(BaseModel):
+    display_text: str
+    exercise: str = ""
+    learning_objective: str = ""
+    tags: List[str] = Field(default_factory=list)
+    hint: str = ""
+
+
+# Lotes: varios ejercicios contextualizados en una sola llamada; `id` es el pk del Ejercicio
+class ItemContextoEjercicio(ContextoEjercicio):
+    id: int
+
+
+class LoteContextoEjercicio(BaseModel):
+    items: List[ItemContextoEjercicio]
+
+
+class ItemContextoDiagnostico(ContextoDiagnostico):
+    id: int
+
+
+class LoteContextoDiagnostico(BaseModel):
+    items: List[ItemContextoDiagnostico]
+
+
+class ErrorFeedback(BaseModel):
+    tipo: str
+    detalle: str
+
+
+class CorreccionFeedback(BaseModel):
+    pasos_correctos: List[str] = Field(default_factory=list)
+    errores: List[ErrorFeedback] = Field(default_factory=list)
+
+
+class PasoFeedback(BaseModel):
+    tipo: str
+    contenido: str
+
+
+class FeedbackIA(BaseModel):
+    texto: str = Field("", validation_alias=AliasChoices("texto", "contexto", "explanacion"))
+    feedback_json: CorreccionFeedback = Field(
+        default_factory=CorreccionFeedback,
+        validation_alias=AliasChoices("feedback_json", "correccion", "feedback"),
+    )
+    pasos: List[PasoFeedback] = Field(default_factory=list)
+
+
+def _estricto(schema):
+    # Structured outputs estrictos: todo objeto con additionalProperties=false y todas sus
+    # propiedades requeridas; sin títulos ni defaults (no los acepta el modo estricto)
+    schema = copy.deepcopy(schema)
+
+    def ajustar(nodo):
+        if isinstance(nodo, dict):
+            nodo.pop("title", None)
+            nodo.pop("default", None)
+            if nodo.get("type") == "object" and "properties" in nodo:
+                nodo["additionalProperties"] = False
+                nodo["required"] = list(nodo["properties"])
+            for valor in nodo.values():
+                ajustar(valor)
+        elif isinstance(nodo, list):
+            for valor in nodo:
+                ajustar(valor)
+
+    ajustar(schema)
+    return schema
+
+
+_schemas = {}
+
+
+def schema_de(modelo: Type[BaseModel]):
+    schema = _schemas.get(modelo)
+    if schema is None:
+        schema = _schemas[modelo] = _estricto(modelo.model_json_schema(by_alias=False))
+    return schema
+
+
+def formato_respuesta(modelo: Type[BaseModel]):
+    # response_format para chat.completions
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": modelo.__name__, "strict": True, "schema": schema_de(modelo)},
+    }
+
+
+def formato_texto(modelo: Type[BaseModel]):
+    # text.format para el API de responses
+    return {"format": {"type": "json_schema", "name": modelo.__name__, "strict": True, "schema": schema_de(modelo)}}
+
+
+def validar(datos, modelo: Type[M]) -> Optional[M]:
+    if not isinstance(datos, dict):
+        return None
+    try:
+        return modelo.model_validate(datos)
+    except ValidationError as e:
+        logger.warning("Respuesta del LLM no cumple %s: %s", modelo.__name__, e.errors()[:3])
+        return None
+
+
+def parsear(texto: str, modelo: Type[M]) -> Optional[M]:
+    """Primer objeto JSON de `texto` validado contra `modelo`, o None si no hay uno válido."""
+    return validar(extraer_objeto(texto or ""), modelo)
@@ -0,0 +1,127 @@
+# Elección del proveedor LLM para cada llamada del gateway.
+# LLM_PROVEEDORES define los backends compatibles con el API de OpenAI (OpenAI, DeepSeek, un
+# servidor local tipo vLLM/Ollama...), cada uno con su base_url, variable de la API key, modelo,
+# fuente (el valor de Feedback.fuente_ia) y los modos que atiende (diagnostico/normal/feedback).
+# El router lleva, por proceso, una ventana móvil de latencias y errores de cada backend y ordena
+# los candidatos del modo de la llamada:
+#   1. los que tienen pocas muestras primero (para medirlos)
+#   2. luego los sanos por p95 (y p50) ascendente; con probabilidad LLM_ROUTER_EXPLORAR se adelanta
+#      uno sano al azar para que sus estadísticas no envejezcan
+#   3. al final los que superan LLM_ROUTER_MAX_ERRORES, como último recurso
+# El gateway manda el pedido al primero con el circuito cerrado y el hedge al siguiente.
+
+import random
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+_lock = threading.Lock()
+_proveedores = None
+_estadisticas = {}
+
+
+class Proveedor:
+    def __init__(self, nombre, base_url="", api_key_env="SINEKYS_OPENAI_API_KEY", modelo="",
+                 fuente="chatgpt", modos=None, responses=True):
+        self.nombre = nombre
+        self.base_url = base_url or None
+        self.api_key_env = api_key_env
+        self.modelo = modelo  # vacío: se usa el `model` que manda quien llama
+        self.fuente = fuente
+        self.modos = set(modos or ())  # vacío: todos los modos
+        self.responses = responses  # False si el servidor solo tiene chat/completions
+
+    def atiende(self, modo, metodo):
+        if metodo == "responses" and not self.responses:
+            return False
+        return not self.modos or modo in self.modos
+
+
+class _Ventana:
+    # Últimas llamadas de un proveedor: (instante, latencia en ms, ok)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._muestras = deque(maxlen=getattr(settings, "LLM_ROUTER_VENTANA", 200))
+
+    def registrar(self, latencia_ms, ok):
+        with self._lock:
+            self._muestras.append((time.monotonic(), latencia_ms, ok))
+
+    def resumen(self):
+        desde = time.monotonic() - getattr(settings, "LLM_ROUTER_VENTANA_SEG", 600)
+        with self._lock:
+            muestras = [m for m in self._muestras if m[0] >= desde]
+        latencias = sorted(ms for _, ms, ok in muestras if ok)
+        errores = sum(1 for _, _, ok in muestras if not ok)
+        return {
+            "n": len(muestras),
+            "p50": _percentil(latencias, 0.50),
+            "p95": _percentil(latencias, 0.95),
+            "errores": errores / len(muestras) if muestras else 0.0,
+        }
+
+
+def _percentil(ordenados, q):
+    if not ordenados:
+        return None
+    return ordenados[min(len(ordenados) - 1, int(q * len(ordenados)))]
+
+
+def proveedores():
+    global _proveedores
+    if _proveedores is None:
+        with _lock:
+            if _proveedores is None:
+                config = getattr(settings, "LLM_PROVEEDORES", None) or {
+                    "chatgpt": {"base_url": getattr(settings, "LLM_BASE_URL", "")},
+                }
+                _proveedores = {nombre: Proveedor(nombre, **datos) for nombre, datos in config.items()}
+    return _proveedores
+
+
+def proveedor(nombre):
+    return proveedores()[nombre]
+
+
+def _ventana(nombre):
+    ventana = _estadisticas.get(nombre)
+    if ventana is None:
+        with _lock:
+            ventana = _estadisticas.setdefault(nombre, _Ventana())
+    return ventana
+
+
+def registrar(nombre, latencia_ms, ok):
+    _ventana(nombre).registrar(latencia_ms, ok)
+
+
+def candidatos(modo, metodo="chat"):
+    """Nombres de los proveedores que atienden `modo`/`metodo`, del preferido al último recurso."""
+    minimo = getattr(settings, "LLM_ROUTER_MIN_MUESTRAS", 5)
+    max_errores = getattr(settings, "LLM_ROUTER_MAX_ERRORES", 0.5)
+    nuevos, sanos, enfermos = [], [], []
+    for nombre, p in proveedores().items():
+        if not p.atiende(modo, metodo):
+            continue
+        r = _ventana(nombre).resumen()
+        if r["n"] < minimo:
+            nuevos.append((r["n"], nombre))
+        elif r["errores"] > max_errores or r["p95"] is None:
+            enfermos.append((r["errores"], nombre))
+        else:
+            sanos.append((r["p95"], r["p50"], nombre))
+    sanos.sort()
+    orden = [n for _, n in sorted(nuevos)] + [n for *_, n in sanos] + [n for _, n in sorted(enfermos)]
+    if len(sanos) > 1 and random.random() < getattr(settings, "LLM_ROUTER_EXPLORAR", 0.05):
+        elegido = random.choice(sanos)[-1]
+        orden.remove(elegido)
+        orden.insert(len(nuevos), elegido)
+    return orden
+
+
+def estado():
+    # Para diagnóstico/admin: estadísticas actuales de cada proveedor
+    return {nombre: {"fuente": p.fuente, "modelo": p.modelo, **_ventana(nombre).resumen()}
+            for nombre, p in proveedores().items()}
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class EjerciciosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ejercicios'
+
+    def ready(self):
+        import ejercicios.signals
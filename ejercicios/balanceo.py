@@ -0,0 +1,158 @@
+# Balanceo de contenido para el diagnóstico adaptativo (método de desviaciones ponderadas,
+# Stocking & Swanson). El blueprint fija cuántos ítems de cada materia, unidad y tipo de
+# ejercicio debería tener un diagnóstico de largo L; en cada paso se elige el ítem que más
+# información aporta descontando cuánto se alejaría lo respondido de esas cuotas.
+#
+# Todo lo que depende del banco (categoría de cada ítem, cuotas) se calcula una vez por índice
+# y queda guardado en él; por paso solo se cuentan las categorías de los ids ya respondidos
+# (que vienen en Diagnostico.respuestas), sin consultas a la DB ni a la M2M de tipos.
+
+import logging
+
+import numpy as np
+from django.conf import settings
+
+from .irt import obtener_modelo
+
+logger = logging.getLogger(__name__)
+
+
+class Blueprint:
+    """
+    Cuotas de contenido sobre un IndiceBanco.
+    Por defecto la proporción de cada materia, unidad y tipo es la que tiene en el banco;
+    settings.CAT_BLUEPRINT puede fijarlas explícitamente, por ejemplo
+    {"unidad": {"3": 0.4, "4": 0.6}, "tipo": {"funciones": 0.5}} (ids de materia/unidad y
+    código de tipo). El mínimo y máximo de cada categoría son floor / ceil de proporción * L.
+    """
+
+    def __init__(self, indice, largo, proporciones=None, codigos_tipo=None):
+        proporciones = proporciones or {}
+        self.largo = max(int(largo), 1)
+        n = len(indice)
+
+        self.materias, self.cat_materia = np.unique(indice.materia_ids, return_inverse=True)
+        self.unidades, self.cat_unidad = np.unique(indice.unidad_ids, return_inverse=True)
+        # incidencia ítem x tipo (un ítem puede tener varios tipos)
+        self.tipo_ids = np.array(sorted(indice.tipo_bits, key=indice.tipo_bits.get), dtype=np.int64)
+        bits = np.array([indice.tipo_bits[t] for t in self.tipo_ids], dtype=np.int64)
+        self.tipo_items = ((indice.tipos[:, None] >> bits[None, :]) & 1).astype(np.float32)
+
+        base_materia = np.bincount(self.cat_materia, minlength=len(self.materias)) / max(n, 1)
+        base_unidad = np.bincount(self.cat_unidad, minlength=len(self.unidades)) / max(n, 1)
+        base_tipo = self.tipo_items.sum(axis=0) / max(n, 1)
+
+        codigos_tipo = codigos_tipo or {}
+        self.prop_materia = self._proporciones(self.materias, base_materia, proporciones.get("materia"))
+        self.prop_unidad = self._proporciones(self.unidades, base_unidad, proporciones.get("unidad"))
+        self.prop_tipo = self._proporciones(
+            self.tipo_ids, base_tipo, proporciones.get("tipo"), alias={v: k for k, v in codigos_tipo.items()}
+        )
+
+        self.min_materia, self.max_materia = self._cuotas(self.prop_materia)
+        self.min_unidad, self.max_unidad = self._cuotas(self.prop_unidad)
+        self.min_tipo, self.max_tipo = self._cuotas(self.prop_tipo)
+
+    @staticmethod
+    def _proporciones(ids, base, configuradas, alias=None):
+        # Proporción objetivo por categoría: la configurada si existe, si no la del banco
+        if not configuradas:
+            return base
+        alias = alias or {}
+        prop = np.zeros(len(ids), dtype=float)
+        posicion = {int(i): k for k, i in enumerate(ids)}
+        for clave, valor in configuradas.items():
+            clave = alias.get(clave, clave)
+            try:
+                k = posicion.get(int(clave))
+            except (TypeError, ValueError):
+                k = None
+            if k is None:
+                logger.warning("Categoría %s del blueprint no existe en el banco; se ignora", clave)
+                continue
+            prop[k] = float(valor)
+        return prop
+
+    def _cuotas(self, proporciones):
+        objetivo = proporciones * self.largo
+        return np.floor(objetivo), np.ceil(objetivo)
+
+    def conteos(self, posiciones):
+        # Ítems ya administrados por categoría (posiciones en el índice de los ids respondidos)
+        return (
+            np.bincount(self.cat_materia[posiciones], minlength=len(self.materias)),
+            np.bincount(self.cat_unidad[posiciones], minlength=len(self.unidades)),
+            self.tipo_items[posiciones].sum(axis=0),
+        )
+
+    def _penalizacion(self, conteo, n, proporcion, minimo, maximo):
+        # Variación de la desviación (en ítems) entre sumar o no un ítem de cada categoría.
+        # Lo que falta del test se prorratea según la proporción objetivo: conteo + x + restantes * p.
+        restantes = max(self.largo - n - 1, 0)
+
+        def desviacion(c):
+            proyectado = c + restantes * proporcion
+            return np.maximum(0.0, minimo - proyectado) + np.maximum(0.0, proyectado - maximo)
+        return desviacion(conteo + 1) - desviacion(conteo)
+
+    def penalizaciones(self, posiciones_respondidas):
+        """
+        Penalización de contenido por ítem del banco (array de largo len(indice)).
+        Solo importa la diferencia entre ítems, así que se suma la variación de desviación
+        de cada categoría a la que pertenece el ítem (negativa si el ítem ayuda a cumplir una cuota).
+        """
+        n = len(posiciones_respondidas)
+        c_materia, c_unidad, c_tipo = self.conteos(posiciones_respondidas)
+        d_materia = self._penalizacion(c_materia, n, self.prop_materia, self.min_materia, self.max_materia)
+        d_unidad = self._penalizacion(c_unidad, n, self.prop_unidad, self.min_unidad, self.max_unidad)
+        d_tipo = self._penalizacion(c_tipo, n, self.prop_tipo, self.min_tipo, self.max_tipo)
+        penal = d_materia[self.cat_materia] + d_unidad[self.cat_unidad]
+        if len(self.tipo_ids):
+            penal = penal + self.tipo_items @ d_tipo.astype(np.float32)
+        return penal
+
+
+def obtener_blueprint(indice):
+    # Blueprint del índice (se calcula una vez por versión del índice y largo del diagnóstico)
+    largo = getattr(settings, "DIAGNOSTICO_MAX_EJERCICIOS", 30)
+    blueprint = indice._blueprint
+    if blueprint is not None and blueprint.largo == largo:
+        return blueprint
+    proporciones = getattr(settings, "CAT_BLUEPRINT", None) or {}
+    codigos_tipo = {}
+    if proporciones.get("tipo"):
+        from .models import TipoEjercicio
+        codigos_tipo = dict(TipoEjercicio.objects.values_list("id", "tipo_ejercicio"))
+    blueprint = Blueprint(indice, largo, proporciones, codigos_tipo)
+    indice._blueprint = blueprint
+    return blueprint
+
+
+def candidatos_balanceados(indice, theta, excluidos, k, modelo=None):
+    """
+    Los k ítems no respondidos con mejor puntaje información / contenido, de mayor a menor:
+        puntaje = I(theta) / max I(theta) - CAT_PESO_CONTENIDO * penalización de contenido
+    Devuelve posiciones en el índice.
+    """
+    modelo = modelo or obtener_modelo()
+    libres = np.flatnonzero(~excluidos)
+    if libres.size == 0:
+        return libres
+    blueprint = obtener_blueprint(indice)
+
+    if indice.info_grid is not None and modelo is indice.modelo:
+        info = indice.info_grid[indice.fila_grid(theta), libres]
+    else:
+        info = indice.informacion(theta, libres, modelo)
+    info_max = float(info.max())
+    puntaje = info / info_max if info_max > 0 else np.zeros_like(info, dtype=float)
+
+    peso = getattr(settings, "CAT_PESO_CONTENIDO", 1.0)
+    if peso:
+        penal = blueprint.penalizaciones(np.flatnonzero(excluidos))
+        puntaje = puntaje - peso * penal[libres]
+
+    k = min(k, libres.size)
+    top = np.argpartition(-puntaje, k - 1)[:k]
+    top = top[np.argsort(-puntaje[top], kind="stable")]
+    return libres[top]
@@ -0,0 +1,414 @@
+# Índice en memoria del banco de ítems (Ejercicio) para la selección adaptativa.
+# En vez de materializar todos los Ejercicio en cada request, cada proceso mantiene
+# arrays de NumPy ordenados por dificultad que se cargan una sola vez.
+# Se invalida con las señales de Ejercicio (ver signals.py); la versión vive en el cache
+# de Django para que los otros workers también recarguen.
+
+import copy
+import logging
+import threading
+
+import numpy as np
+from django.core.cache import cache
+
+from .irt import obtener_modelo, cota_informacion
+from .utils.cache import incrementar
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION_KEY = "banco_items:version"
+# Ventana inicial (a cada lado de theta) para buscar candidatos no respondidos
+VENTANA_INICIAL = 32
+
+# Grilla de theta para la tabla de información precalculada
+GRID_MIN = -3.0
+GRID_MAX = 3.0
+GRID_PASO = 0.01
+# Candidatos guardados por punto de la grilla (ordenados por información, de mayor a menor)
+TOP_K = 64
+# La matriz completa grilla x ítems (float32) solo se guarda si cabe en este tamaño
+MAX_BYTES_TABLA_COMPLETA = 64 * 1024 * 1024
+# Filas de la grilla que se calculan a la vez al construir la tabla
+FILAS_POR_LOTE = 16
+# Tipos de ejercicio distintos que caben en la máscara de bits de `tipos`
+MAX_TIPOS = 63
+
+
+class IndiceBanco:
+    """
+    Arrays alineados y ordenados por dificultad:
+    dificultad, discriminacion, ids, materia_ids, unidad_ids, adivinanza, tipos.
+    `tipos` es una máscara de bits por ítem con sus TipoEjercicio (el bit de cada tipo está en
+    tipo_bits), así el balanceo de contenido no necesita consultar la M2M en cada paso.
+
+    Además guarda, para cada theta de la grilla (paso 0.01 en [-3, 3]), los TOP_K ítems más
+    informativos (top_pos / top_info), y si el banco es chico la matriz completa info_grid.
+    Seleccionar es entonces buscar la fila de la grilla y filtrar por el bitmap de respondidos.
+    Las instancias no se modifican: con_item / sin_item devuelven un índice nuevo.
+    """
+
+    def __init__(self, dificultad, discriminacion, ids, materia_ids, unidad_ids, adivinanza=None,
+                 tipos=None, tipo_bits=None, modelo=None, construir_tabla=True):
+        dificultad = np.asarray(dificultad, dtype=float)
+        orden = np.argsort(dificultad, kind="stable")
+        self.dificultad = dificultad[orden]
+        self.discriminacion = np.asarray(discriminacion, dtype=float)[orden]
+        self.ids = np.asarray(ids, dtype=np.int64)[orden]
+        self.materia_ids = np.asarray(materia_ids, dtype=np.int64)[orden]
+        self.unidad_ids = np.asarray(unidad_ids, dtype=np.int64)[orden]
+        if adivinanza is None:
+            adivinanza = np.zeros_like(dificultad)
+        self.adivinanza = np.asarray(adivinanza, dtype=float)[orden]
+        if tipos is None:
+            tipos = np.zeros(len(dificultad), dtype=np.int64)
+        self.tipos = np.asarray(tipos, dtype=np.int64)[orden]
+        self.tipo_bits = dict(tipo_bits or {})
+        self._indexar_ids()
+
+        self.modelo = modelo or obtener_modelo()
+        self.grid = np.round(np.arange(GRID_MIN, GRID_MAX + GRID_PASO / 2, GRID_PASO), 4)
+        self.info_grid = None
+        self.top_pos = None
+        self.top_info = None
+        if construir_tabla:
+            self._construir_tabla()
+
+    def _indexar_ids(self):
+        self.a_max = float(self.discriminacion.max()) if len(self.discriminacion) else 1.0
+        # ids ordenados -> posición en los arrays principales (para armar la máscara de excluidos)
+        self._orden_ids = np.argsort(self.ids, kind="stable")
+        self._ids_ordenados = self.ids[self._orden_ids]
+        # blueprint de contenido calculado sobre este índice (ver balanceo.py)
+        self._blueprint = None
+
+    @classmethod
+    def desde_db(cls):
+        from .models import Ejercicio  # import local, el módulo se importa desde apps/signals
+        filas = list(
+            Ejercicio.objects.values_list(
+                "dificultad", "discriminacion", "id", "materia_id", "unidad_id", "adivinanza"
+            )
+        )
+        if not filas:
+            return cls([], [], [], [], [], [])
+        columnas = list(zip(*filas))
+
+        # tipos de cada ejercicio en una sola consulta a la tabla intermedia de la M2M
+        tipo_bits = {}
+        tipos_por_id = {}
+        relaciones = Ejercicio.tipo_ejercicio.through.objects.values_list("ejercicio_id", "tipoejercicio_id")
+        for ejercicio_id, tipo_id in relaciones:
+            bit = _bit_tipo(tipo_bits, tipo_id)
+            if bit is not None:
+                tipos_por_id[ejercicio_id] = tipos_por_id.get(ejercicio_id, 0) | (1 << bit)
+        tipos = [tipos_por_id.get(i, 0) for i in columnas[2]]
+        return cls(*columnas, tipos=tipos, tipo_bits=tipo_bits)
+
+    def mascara_tipos(self, tipo_ids):
+        # Máscara de bits para un conjunto de TipoEjercicio; agrega bits nuevos a tipo_bits si hace falta
+        mascara = 0
+        for tipo_id in tipo_ids:
+            bit = _bit_tipo(self.tipo_bits, tipo_id)
+            if bit is not None:
+                mascara |= 1 << bit
+        return mascara
+
+    def __len__(self):
+        return len(self.ids)
+
+    def posiciones(self, ids):
+        # Posiciones (en los arrays principales) de los ids que existen en el banco
+        ids = np.asarray(list(ids), dtype=np.int64)
+        if ids.size == 0 or len(self) == 0:
+            return np.empty(0, dtype=np.int64)
+        idx = np.searchsorted(self._ids_ordenados, ids)
+        idx = np.clip(idx, 0, len(self) - 1)
+        encontrados = self._ids_ordenados[idx] == ids
+        return self._orden_ids[idx[encontrados]]
+
+    def mascara_excluidos(self, ids):
+        # Bitmap (bool) de ítems ya respondidos
+        mascara = np.zeros(len(self), dtype=bool)
+        mascara[self.posiciones(ids)] = True
+        return mascara
+
+    def informacion(self, theta, posiciones, modelo):
+        return modelo.informacion(
+            theta,
+            self.discriminacion[posiciones],
+            self.dificultad[posiciones],
+            self.adivinanza[posiciones],
+        )
+
+    # ---------------------- Tabla de información precalculada ----------------------
+
+    def _info_columnas(self, posiciones, filas=None):
+        # Información (float32) de los ítems en `posiciones` para las filas de la grilla
+        grid = self.grid if filas is None else self.grid[filas]
+        return self.modelo.informacion(
+            grid[:, None],
+            self.discriminacion[posiciones],
+            self.dificultad[posiciones],
+            self.adivinanza[posiciones],
+        ).astype(np.float32)
+
+    def _top_k_filas(self, filas):
+        # Top-K (posiciones, información) de las filas indicadas, sobre todo el banco
+        n = len(self)
+        k = min(TOP_K, n)
+        top_pos = np.empty((len(filas), k), dtype=np.int32)
+        top_info = np.empty((len(filas), k), dtype=np.float32)
+        todas = np.arange(n)
+        for ini in range(0, len(filas), FILAS_POR_LOTE):
+            lote = filas[ini:ini + FILAS_POR_LOTE]
+            if self.info_grid is not None:
+                info = self.info_grid[lote]
+            else:
+                info = self._info_columnas(todas, lote)
+            if k < n:
+                parte = np.argpartition(-info, k - 1, axis=1)[:, :k]
+            else:
+                parte = np.broadcast_to(todas, info.shape)
+            valores = np.take_along_axis(info, parte, axis=1)
+            orden = np.argsort(-valores, axis=1, kind="stable")
+            top_pos[ini:ini + len(lote)] = np.take_along_axis(parte, orden, axis=1)
+            top_info[ini:ini + len(lote)] = np.take_along_axis(valores, orden, axis=1)
+        return top_pos, top_info
+
+    def _construir_tabla(self):
+        n = len(self)
+        filas = np.arange(len(self.grid))
+        if len(self.grid) * n * 4 <= MAX_BYTES_TABLA_COMPLETA:
+            self.info_grid = self._info_columnas(np.arange(n))
+        else:
+            self.info_grid = None
+        self.top_pos, self.top_info = self._top_k_filas(filas)
+
+    def fila_grid(self, theta):
+        return int(np.clip(np.rint((theta - GRID_MIN) / GRID_PASO), 0, len(self.grid) - 1))
+
+    def candidatos_tabla(self, theta, excluidos):
+        # Candidatos precalculados para theta que no estén respondidos, de mayor a menor información
+        g = self.fila_grid(theta)
+        pos = self.top_pos[g]
+        libres = ~excluidos[pos]
+        return pos[libres], self.top_info[g][libres]
+
+    # ------------------------------- Selección -------------------------------
+
+    def seleccionar_maxima_informacion(self, theta, excluidos=None, modelo=None, rng=None):
+        """
+        Devuelve el id del ítem no respondido con máxima información de Fisher en theta,
+        o None si no quedan.
+        Primero busca en la tabla precalculada (theta redondeado a la grilla); si todos los
+        candidatos de esa fila ya fueron respondidos usa la matriz completa o, si no existe,
+        la búsqueda por ventana alrededor de theta.
+        """
+        n = len(self)
+        if n == 0:
+            return None
+        if excluidos is None:
+            excluidos = np.zeros(n, dtype=bool)
+        if excluidos.all():
+            return None
+        modelo = modelo or obtener_modelo()
+        rng = rng or np.random.default_rng()
+
+        if self.top_pos is not None and modelo is self.modelo:
+            pos, info = self.candidatos_tabla(theta, excluidos)
+            if pos.size:
+                mejores = pos[np.isclose(info, info[0], rtol=0, atol=1e-7)]
+                return int(self.ids[mejores[0] if len(mejores) == 1 else rng.choice(mejores)])
+            if self.info_grid is not None:
+                fila = np.where(excluidos, -np.inf, self.info_grid[self.fila_grid(theta)])
+                mejores = np.flatnonzero(np.isclose(fila, fila.max(), rtol=0, atol=1e-7))
+                return int(self.ids[mejores[0] if len(mejores) == 1 else rng.choice(mejores)])
+        return self._seleccionar_por_ventana(theta, excluidos, modelo, rng)
+
+    def candidatos(self, theta, excluidos, k, modelo=None):
+        # Los k ítems no respondidos más informativos en theta (posiciones, información), de mayor a menor
+        modelo = modelo or obtener_modelo()
+        usa_tabla = self.top_pos is not None and modelo is self.modelo
+        if usa_tabla:
+            pos, info = self.candidatos_tabla(theta, excluidos)
+            if pos.size >= k or pos.size == int((~excluidos).sum()):
+                return pos[:k], info[:k]
+        libres = np.flatnonzero(~excluidos)
+        if usa_tabla and self.info_grid is not None:
+            info = self.info_grid[self.fila_grid(theta), libres]
+        else:
+            info = self.informacion(theta, libres, modelo)
+        top = np.argsort(-info, kind="stable")[:k]
+        return libres[top], info[top]
+
+    def _seleccionar_por_ventana(self, theta, excluidos, modelo, rng):
+        # Parte de un bisect alrededor de theta y abre la ventana hasta que ningún ítem fuera
+        # de ella pueda superar al mejor encontrado (cota_informacion), así no se recorre el banco.
+        n = len(self)
+        a_max = self.a_max if modelo.usa_discriminacion else 1.0
+
+        pos = int(np.searchsorted(self.dificultad, theta))
+        ventana = VENTANA_INICIAL
+        while True:
+            ini = max(0, pos - ventana)
+            fin = min(n, pos + ventana)
+            candidatos = ini + np.flatnonzero(~excluidos[ini:fin])
+            if ini == 0 and fin == n:
+                break
+            if candidatos.size:
+                mejor_info = float(np.max(self.informacion(theta, candidatos, modelo)))
+                # distancia mínima en b de los ítems que quedan fuera de la ventana
+                fuera = []
+                if ini > 0:
+                    fuera.append(theta - self.dificultad[ini - 1])
+                if fin < n:
+                    fuera.append(self.dificultad[fin] - theta)
+                if cota_informacion(min(fuera), a_max) <= mejor_info:
+                    break
+            ventana *= 2
+
+        info = self.informacion(theta, candidatos, modelo)
+        mejores = candidatos[np.isclose(info, info.max(), rtol=0, atol=1e-12)]
+        if len(mejores) > 1:
+            return int(self.ids[rng.choice(mejores)])
+        return int(self.ids[mejores[0]])
+
+
+    # ------------------------ Actualización incremental ------------------------
+
+    def _copia(self):
+        return copy.copy(self)
+
+    def con_item(self, ejercicio_id, discriminacion, dificultad, adivinanza, materia_id, unidad_id, tipo_ids=()):
+        # Índice nuevo con el ítem agregado (o reemplazado si ya existía); la tabla se actualiza
+        # solo en las filas de la grilla donde el ítem entra al top-K.
+        base = self.sin_item(ejercicio_id) if self.posiciones([ejercicio_id]).size else self
+        nuevo = base._copia()
+        nuevo.tipo_bits = dict(base.tipo_bits)
+        pos = int(np.searchsorted(base.dificultad, dificultad, side="right"))
+        nuevo.dificultad = np.insert(base.dificultad, pos, float(dificultad))
+        nuevo.discriminacion = np.insert(base.discriminacion, pos, float(discriminacion))
+        nuevo.adivinanza = np.insert(base.adivinanza, pos, float(adivinanza or 0.0))
+        nuevo.ids = np.insert(base.ids, pos, int(ejercicio_id))
+        nuevo.materia_ids = np.insert(base.materia_ids, pos, int(materia_id))
+        nuevo.unidad_ids = np.insert(base.unidad_ids, pos, int(unidad_id))
+        nuevo.tipos = np.insert(base.tipos, pos, nuevo.mascara_tipos(tipo_ids))
+        nuevo._indexar_ids()
+        if base.top_pos is None:
+            return nuevo
+        if len(nuevo) <= TOP_K:
+            nuevo._construir_tabla()
+            return nuevo
+
+        columna = nuevo._info_columnas(np.array([pos]))[:, 0]
+        if base.info_grid is not None and len(nuevo.grid) * len(nuevo) * 4 <= MAX_BYTES_TABLA_COMPLETA:
+            nuevo.info_grid = np.insert(base.info_grid, pos, columna, axis=1)
+        else:
+            nuevo.info_grid = None
+        top_pos = base.top_pos + (base.top_pos >= pos)
+        top_info = base.top_info.copy()
+        filas = np.flatnonzero(columna > top_info[:, -1])
+        if filas.size:
+            k = top_pos.shape[1]
+            pos_m = np.concatenate([top_pos[filas], np.full((filas.size, 1), pos, dtype=np.int32)], axis=1)
+            info_m = np.concatenate([top_info[filas], columna[filas, None]], axis=1)
+            orden = np.argsort(-info_m, axis=1, kind="stable")[:, :k]
+            top_pos[filas] = np.take_along_axis(pos_m, orden, axis=1)
+            top_info[filas] = np.take_along_axis(info_m, orden, axis=1)
+        nuevo.top_pos, nuevo.top_info = top_pos, top_info
+        return nuevo
+
+    def sin_item(self, ejercicio_id):
+        # Índice nuevo sin el ítem; solo se recalculan las filas de la grilla donde estaba en el top-K
+        posiciones = self.posiciones([ejercicio_id])
+        if posiciones.size == 0:
+            return self
+        pos = int(posiciones[0])
+        nuevo = self._copia()
+        for campo in ("dificultad", "discriminacion", "adivinanza", "ids", "materia_ids", "unidad_ids", "tipos"):
+            setattr(nuevo, campo, np.delete(getattr(self, campo), pos))
+        nuevo._indexar_ids()
+        if self.top_pos is None:
+            return nuevo
+        if len(nuevo) <= TOP_K:
+            nuevo._construir_tabla()
+            return nuevo
+
+        nuevo.info_grid = None if self.info_grid is None else np.delete(self.info_grid, pos, axis=1)
+        afectadas = np.flatnonzero(np.any(self.top_pos == pos, axis=1))
+        top_pos = self.top_pos - (self.top_pos > pos)
+        top_info = self.top_info.copy()
+        if afectadas.size:
+            top_pos[afectadas], top_info[afectadas] = nuevo._top_k_filas(afectadas)
+        nuevo.top_pos, nuevo.top_info = top_pos, top_info
+        return nuevo
+
+
+def _bit_tipo(tipo_bits, tipo_id):
+    # Bit asignado a un TipoEjercicio (se asignan en orden de aparición)
+    if tipo_id not in tipo_bits:
+        if len(tipo_bits) >= MAX_TIPOS:
+            logger.warning("Demasiados tipos de ejercicio para el índice; se ignora el tipo %s", tipo_id)
+            return None
+        tipo_bits[tipo_id] = len(tipo_bits)
+    return tipo_bits[tipo_id]
+
+
+_indice = None
+_indice_version = None
+_lock = threading.Lock()
+
+
+def _version_actual():
+    return cache.get(CACHE_VERSION_KEY, 0)
+
+
+def obtener_indice():
+    # Índice del proceso; se recarga solo si alguna señal cambió la versión
+    global _indice, _indice_version
+    version = _version_actual()
+    indice = _indice
+    if indice is not None and _indice_version == version:
+        return indice
+    with _lock:
+        if _indice is None or _indice_version != version:
+            _indice = IndiceBanco.desde_db()
+            _indice_version = version
+            logger.info("Índice del banco de ítems cargado: %d ítems (version=%s)", len(_indice), version)
+        return _indice
+
+
+def invalidar_indice():
+    global _indice
+    with _lock:
+        _indice = None
+    incrementar(CACHE_VERSION_KEY)
+
+
+def _aplicar_cambio(cambio):
+    # Aplica el cambio sobre el índice del proceso sin recargarlo desde la DB.
+    # Si otro proceso cambió la versión entretanto, se descarta y se recarga completo.
+    global _indice, _indice_version
+    with _lock:
+        version_nueva = incrementar(CACHE_VERSION_KEY)
+        if _indice is None or _indice_version is None or version_nueva != _indice_version + 1:
+            _indice = None
+            return
+        try:
+            _indice = cambio(_indice)
+            _indice_version = version_nueva
+        except Exception:
+            logger.exception("No se pudo actualizar el índice del banco de forma incremental; se recargará")
+            _indice = None
+
+
+def actualizar_item_en_indice(ejercicio):
+    tipo_ids = list(ejercicio.tipo_ejercicio.values_list("id", flat=True))
+    _aplicar_cambio(lambda indice: indice.con_item(
+        ejercicio.pk, ejercicio.discriminacion, ejercicio.dificultad, ejercicio.adivinanza,
+        ejercicio.materia_id, ejercicio.unidad_id, tipo_ids,
+    ))
+
+
+def quitar_item_de_indice(ejercicio_id):
+    _aplicar_cambio(lambda indice: indice.sin_item(ejercicio_id))
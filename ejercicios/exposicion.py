@@ -0,0 +1,238 @@
+# Control de exposición de ítems.
+# Solo cuentan las administraciones del diagnóstico. Los contadores de EjercicioVecesMostrado se
+# incrementan en el cache (incr atómico) y se vuelcan a la DB en lote cada EXPOSICION_FLUSH_SEGUNDOS,
+# desde un thread en segundo plano lanzado después del commit del request (o con el comando
+# flush_exposicion), así contar no agrega escrituras ni locks al request.
+# Sympson-Hetter: un ítem "seleccionado" (que llega al filtro) se administra con probabilidad k_i,
+# así P(administrado) = k_i * P(seleccionado) y k_i = min(1, tasa_maxima / P(seleccionado)) deja la
+# tasa de exposición en tasa_maxima. Por eso se cuentan también las veces seleccionado: calcular k
+# con la tasa de administración (que ya viene reducida por k) se estabiliza en
+# sqrt(tasa_maxima * P(seleccionado)), por encima del límite.
+# Como P(seleccionado) sale de conteos acumulados (incluyen el período con k más altos) el ajuste va
+# con atraso; para que la tasa observada no pase el límite mientras tanto, un ítem que lo alcanzó
+# queda congelado (k = 0) hasta que su tasa vuelve a bajar (Sympson-Hetter online con congelamiento).
+
+import logging
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .utils.cache import incrementar
+
+logger = logging.getLogger(__name__)
+
+KEY_MOSTRADO = "exposicion:mostrado:{}"
+KEY_ACERTADO = "exposicion:acertado:{}"
+KEY_SELECCIONADO = "exposicion:seleccionado:{}"
+
+_lock = threading.Lock()
+_pendientes = set()  # ids con deltas en cache que este proceso todavía no volcó
+_ultimo_flush = time.monotonic()
+
+# Parámetros Sympson-Hetter del proceso: ids ordenados y su k
+_k_ids = np.empty(0, dtype=np.int64)
+_k_valores = np.empty(0, dtype=float)
+_k_cargados = False
+
+
+def registrar_exposicion(ejercicio_id, considerados=()):
+    # considerados: los ítems que pasaron por el filtro en esta elección (ver elegir_con_exposicion);
+    # el administrado siempre cuenta como seleccionado
+    seleccionados = {int(i) for i in considerados} | {int(ejercicio_id)}
+    incrementar(KEY_MOSTRADO.format(ejercicio_id))
+    for i in seleccionados:
+        incrementar(KEY_SELECCIONADO.format(i))
+    with _lock:
+        _pendientes.update(seleccionados)
+    flush_si_corresponde()
+
+
+def registrar_acierto(ejercicio_id):
+    incrementar(KEY_ACERTADO.format(ejercicio_id))
+    with _lock:
+        _pendientes.add(int(ejercicio_id))
+    flush_si_corresponde()
+
+
+def flush_si_corresponde():
+    # Nunca vuelca en el thread del request: se lanza en segundo plano cuando la transacción
+    # del request hace commit (si hace rollback no se lanza y los deltas esperan al próximo)
+    global _ultimo_flush
+    intervalo = getattr(settings, "EXPOSICION_FLUSH_SEGUNDOS", 60)
+    with _lock:
+        if time.monotonic() - _ultimo_flush < intervalo:
+            return
+        _ultimo_flush = time.monotonic()
+    transaction.on_commit(_lanzar_flush)
+
+
+def _lanzar_flush():
+    threading.Thread(target=_flush_en_thread, name="exposicion-flush", daemon=True).start()
+
+
+def _flush_en_thread():
+    close_old_connections()
+    try:
+        flush_exposicion()
+    except Exception:
+        logger.exception("Error volcando contadores de exposición")
+    finally:
+        connection.close()
+
+
+_KEYS_DELTAS = (KEY_MOSTRADO, KEY_ACERTADO, KEY_SELECCIONADO)
+
+
+def _tomar(key, leido):
+    # Descuenta lo leído con un decr atómico. Si otro flush (el thread de otro worker o el cron) ya se
+    # llevó parte, el contador queda negativo: se devuelve el faltante y solo se toma lo que quedaba.
+    # Lo que llegue entremedio queda para el próximo flush.
+    if leido <= 0:
+        return 0
+    try:
+        restante = cache.decr(key, leido)
+    except ValueError:
+        # la key expiró o la borraron entremedio
+        return 0
+    if restante >= 0:
+        return leido
+    devolver = min(leido, -restante)
+    incrementar(key, devolver)
+    return leido - devolver
+
+
+def _tomar_deltas(ids):
+    # Deltas (mostrado, acertado, seleccionado) de cada id, descontados del cache
+    keys = [key.format(i) for i in ids for key in _KEYS_DELTAS]
+    valores = cache.get_many(keys)
+    deltas = {}
+    for i in ids:
+        delta = tuple(_tomar(key.format(i), int(valores.get(key.format(i)) or 0)) for key in _KEYS_DELTAS)
+        if any(delta):
+            deltas[i] = delta
+    return deltas
+
+
+def flush_exposicion(ids=None):
+    """
+    Vuelca a EjercicioVecesMostrado los contadores acumulados en el cache con un solo UPDATE
+    (CASE por ejercicio) y refresca los parámetros de exposición. Devuelve cuántos ejercicios cambiaron.
+    """
+    from .models import EjercicioVecesMostrado
+
+    with _lock:
+        if ids is None:
+            ids = list(_pendientes)
+            _pendientes.clear()
+        else:
+            ids = [int(i) for i in ids]
+    deltas = _tomar_deltas(ids) if ids else {}
+    if deltas:
+        try:
+            with transaction.atomic():
+                EjercicioVecesMostrado.objects.bulk_create(
+                    [EjercicioVecesMostrado(ejercicio_id=i) for i in deltas],
+                    ignore_conflicts=True,
+                )
+                EjercicioVecesMostrado.objects.filter(ejercicio_id__in=list(deltas)).update(
+                    veces_mostrado=F("veces_mostrado") + Case(
+                        *[When(ejercicio_id=i, then=Value(d[0])) for i, d in deltas.items()],
+                        default=Value(0), output_field=IntegerField(),
+                    ),
+                    veces_acertado=F("veces_acertado") + Case(
+                        *[When(ejercicio_id=i, then=Value(d[1])) for i, d in deltas.items()],
+                        default=Value(0), output_field=IntegerField(),
+                    ),
+                    veces_seleccionado=F("veces_seleccionado") + Case(
+                        *[When(ejercicio_id=i, then=Value(d[2])) for i, d in deltas.items()],
+                        default=Value(0), output_field=IntegerField(),
+                    ),
+                )
+        except Exception:
+            # devolver los deltas al cache para no perderlos
+            for i, delta in deltas.items():
+                for key, valor in zip(_KEYS_DELTAS, delta):
+                    if valor:
+                        incrementar(key.format(i), valor)
+            with _lock:
+                _pendientes.update(deltas)
+            raise
+    recalcular_parametros_exposicion()
+    return len(deltas)
+
+
+def calcular_parametros_exposicion(veces_seleccionado, veces_mostrado, n_diagnosticos):
+    # k_i = min(1, tasa_maxima / P(S_i)), con P(S_i) = veces seleccionado / diagnósticos administrados;
+    # k_i = 0 (congelado) mientras su tasa de exposición observada esté en el límite o por encima
+    tasa_maxima = getattr(settings, "EXPOSICION_TASA_MAXIMA", 0.25)
+    n = max(n_diagnosticos, 1)
+    seleccion = np.asarray(veces_seleccionado, dtype=float) / n
+    k = np.minimum(1.0, tasa_maxima / np.maximum(seleccion, 1e-12))
+    k[np.asarray(veces_mostrado, dtype=float) / n >= tasa_maxima] = 0.0
+    return k
+
+
+def establecer_parametros_exposicion(ids, k):
+    # Reemplaza los parámetros del proceso (también lo usa simular_cat con exposiciones simuladas)
+    global _k_ids, _k_valores, _k_cargados
+    ids = np.asarray(ids, dtype=np.int64)
+    k = np.asarray(k, dtype=float)
+    orden = np.argsort(ids)
+    with _lock:
+        _k_ids, _k_valores = ids[orden], k[orden]
+        _k_cargados = True
+
+
+def recalcular_parametros_exposicion():
+    from accounts.models import Diagnostico
+    from .models import EjercicioVecesMostrado
+
+    n_diagnosticos = Diagnostico.objects.count()
+    filas = list(EjercicioVecesMostrado.objects.values_list("ejercicio_id", "veces_seleccionado", "veces_mostrado"))
+    if not filas or n_diagnosticos == 0:
+        establecer_parametros_exposicion([], [])
+        return
+    ids, seleccionado, mostrado = zip(*filas)
+    establecer_parametros_exposicion(ids, calcular_parametros_exposicion(seleccionado, mostrado, n_diagnosticos))
+
+
+def parametros_exposicion(ids):
+    # k de Sympson-Hetter para cada id (1.0 si el ítem no tiene exposición registrada)
+    ids = np.asarray(ids, dtype=np.int64)
+    k_ids, k_valores = _k_ids, _k_valores
+    k = np.ones(len(ids), dtype=float)
+    if len(k_ids) == 0 or len(ids) == 0:
+        return k
+    idx = np.clip(np.searchsorted(k_ids, ids), 0, len(k_ids) - 1)
+    encontrados = k_ids[idx] == ids
+    k[encontrados] = k_valores[idx[encontrados]]
+    return k
+
+
+def elegir_con_exposicion(ids, rng=None, bloque=None):
+    """
+    Randomesque + Sympson-Hetter: los candidatos vienen ordenados por información y se recorren en
+    bloques de `bloque` (primero los K mejores), en orden aleatorio dentro de cada bloque; cada uno
+    se administra con probabilidad k_i y el primero que pasa es el elegido. Seguir bajando por la
+    lista (en vez de administrar igual a uno de los K rechazados) es lo que mantiene
+    P(administrado | seleccionado) = k_i. Si no pasa ninguno se administra el primero del recorrido.
+    Devuelve (id elegido, ids considerados); los considerados son los seleccionados de SH y se
+    cuentan al administrar (registrar_exposicion).
+    """
+    rng = rng or np.random.default_rng()
+    ids = np.asarray(ids, dtype=np.int64)
+    if not _k_cargados:
+        recalcular_parametros_exposicion()
+    if len(ids) == 1:
+        return int(ids[0]), [int(ids[0])]
+    bloque = bloque or len(ids)
+    ids = np.concatenate([rng.permutation(ids[ini:ini + bloque]) for ini in range(0, len(ids), bloque)])
+    pasan = np.flatnonzero(rng.random(len(ids)) < parametros_exposicion(ids))
+    elegido = int(pasan[0]) if len(pasan) else 0
+    considerados = ids[:elegido + 1] if len(pasan) else ids
+    return int(ids[elegido]), [int(i) for i in considerados]
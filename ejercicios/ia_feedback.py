@@ -8,13 +8,15 @@ def save_ai_feedback_intento(
     contexto_ia: Optional[str],
     feedback_json:Optional[Dict[str, Any]] = None,
     fuente: str='chatgpt',
-    pasos_feedback: Optional[List[Dict[str,Any]]] = None
+    pasos_feedback: Optional[List[Dict[str,Any]]] = None,
+    clave_memo: str = ''
     ) -> Feedback:
     fb = Feedback.objects.create(
         intento=intento,
         contexto_ejercicio = (contexto_ia or ""),
         feedback = feedback_json or {},
-        fuente_ia=fuente
+        fuente_ia=fuente,
+        clave_memo=clave_memo
     )
     
     if pasos_feedback:
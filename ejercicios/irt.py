@@ -0,0 +1,100 @@
+# Modelos IRT (1PL / 2PL / 3PL) usados tanto para estimar theta como para seleccionar ítems.
+# Todo está vectorizado: theta puede ser un escalar o un array con shape (T, 1) y los
+# parámetros de los ítems arrays (J,), así se evalúa la matriz completa T x J de una vez.
+#
+#   P(theta) = c + (1 - c) * sigmoid(a * (theta - b))
+#
+# 1PL fija a=1, c=0; 2PL fija c=0; 3PL usa los tres parámetros.
+
+from functools import lru_cache
+
+import numpy as np
+from scipy.special import expit  # sigmoid numéricamente estable
+from django.conf import settings
+
+# Para que log(P) y log(1-P) nunca sean -inf
+EPS = 1e-9
+
+
+class ModeloIRT:
+    def __init__(self, nombre, usa_discriminacion=True, usa_adivinanza=False):
+        self.nombre = nombre
+        self.usa_discriminacion = usa_discriminacion
+        self.usa_adivinanza = usa_adivinanza
+
+    def __repr__(self):
+        return f"ModeloIRT({self.nombre})"
+
+    def parametros(self, a, b, c=None):
+        # Normaliza (a, b, c) según el modelo: los parámetros que el modelo no usa se ignoran
+        b = np.asarray(b, dtype=float)
+        if self.usa_discriminacion and a is not None:
+            a = np.asarray(a, dtype=float)
+        else:
+            a = np.ones_like(b)
+        if self.usa_adivinanza and c is not None:
+            c = np.asarray(c, dtype=float)
+        else:
+            c = np.zeros_like(b)
+        return a, b, c
+
+    def probabilidad(self, theta, a, b, c=None):
+        a, b, c = self.parametros(a, b, c)
+        return c + (1.0 - c) * expit(a * (theta - b))
+
+    def informacion(self, theta, a, b, c=None):
+        # Información de Fisher por ítem: a^2 * (P - c)^2 * (1 - P) / ((1 - c)^2 * P)
+        a, b, c = self.parametros(a, b, c)
+        p_star = expit(a * (theta - b))
+        p = c + (1.0 - c) * p_star
+        return a * a * (1.0 - c) * p_star * p_star * (1.0 - p_star) / np.maximum(p, EPS)
+
+    def log_verosimilitud(self, theta, y, a, b, c=None):
+        # Suma sobre el último eje (ítems); y en {0, 1}
+        y = np.asarray(y, dtype=float)
+        p = np.clip(self.probabilidad(theta, a, b, c), EPS, 1.0 - EPS)
+        return np.sum(y * np.log(p) + (1.0 - y) * np.log1p(-p), axis=-1)
+
+    def score_e_informacion(self, theta, y, a, b, c=None):
+        # Derivada de la log-verosimilitud y la información total en theta (Fisher scoring)
+        a, b, c = self.parametros(a, b, c)
+        p_star = expit(a * (theta - b))
+        p = np.maximum(c + (1.0 - c) * p_star, EPS)
+        score = np.sum(a * (y - p) * p_star / p, axis=-1)
+        info = np.sum(a * a * (1.0 - c) * p_star * p_star * (1.0 - p_star) / p, axis=-1)
+        return score, info
+
+
+MODELOS = {
+    "1PL": ModeloIRT("1PL", usa_discriminacion=False, usa_adivinanza=False),
+    "2PL": ModeloIRT("2PL", usa_discriminacion=True, usa_adivinanza=False),
+    "3PL": ModeloIRT("3PL", usa_discriminacion=True, usa_adivinanza=True),
+}
+
+
+def obtener_modelo(nombre=None):
+    nombre = (nombre or getattr(settings, "IRT_MODELO", "2PL")).upper()
+    try:
+        return MODELOS[nombre]
+    except KeyError:
+        raise ValueError(f"Modelo IRT desconocido: {nombre}. Opciones: {', '.join(MODELOS)}")
+
+
+def cota_informacion(distancia, a_max):
+    # Cota superior de la información de cualquier ítem con |theta - b| >= distancia y a <= a_max.
+    # x^2 * s(x) * (1 - s(x)) es máxima en x ~ 2.3994, y la 3PL nunca supera a la 2PL.
+    distancia = max(float(distancia), EPS)
+    x = min(a_max * distancia, 2.3994)
+    s = expit(x)
+    return x * x * s * (1.0 - s) / (distancia * distancia)
+
+
+@lru_cache(maxsize=8)
+def nodos_cuadratura(n=21):
+    # Nodos y log-pesos de Gauss-Hermite para integrar sobre una prior N(0, 1).
+    # Quedan cacheados: no modificar los arrays devueltos.
+    x, w = np.polynomial.hermite.hermgauss(n)
+    nodos, log_pesos = np.sqrt(2.0) * x, np.log(w / np.sqrt(np.pi))
+    nodos.flags.writeable = False
+    log_pesos.flags.writeable = False
+    return nodos, log_pesos
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from ejercicios.models import Ejercicio
+from ejercicios.exposicion import flush_exposicion
+
+
+class Command(BaseCommand):
+    help = "Vuelca a EjercicioVecesMostrado los contadores de exposición acumulados en el cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help='Ejercicios revisados por lote')
+
+    def handle(self, *args, **options):
+        # Revisa todos los ejercicios (no solo los pendientes de este proceso), así se recuperan
+        # los deltas que dejó un worker que terminó antes de su flush periódico
+        ids = list(Ejercicio.objects.values_list('pk', flat=True))
+        lote = options['lote']
+        total = 0
+        for ini in range(0, len(ids), lote):
+            total += flush_exposicion(ids[ini:ini + lote])
+        self.stdout.write(self.style.SUCCESS(f"Contadores de exposición volcados: {total} ejercicios actualizados"))
+
+# Pensado para cron, p.ej. cada 5 minutos:
+#python manage.py flush_exposicion
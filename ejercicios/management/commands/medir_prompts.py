@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Carrera
+from ejercicios.models import Ejercicio
+from ejercicios.utils.text import normalize_text
+from ejercicios.Api_LLMs.prompts import PLANTILLAS, contar_tokens, datos_feedback, lista_ejercicios
+from ejercicios.Api_LLMs.request import MODEL
+
+# Largo mínimo del prefijo para que OpenAI lo reutilice de su cache de prompts
+PREFIJO_CACHEABLE = 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide los tokens de cada plantilla de prompt (system fijo + parte variable con ejercicios reales) "
+        "y qué fracción de cada llamada es prefijo fijo reutilizable"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--muestras', type=int, default=20, help='Ejercicios de la DB usados como ejemplo')
+
+    def handle(self, *args, **options):
+        ejercicios = list(Ejercicio.objects.order_by('pk').only('pk', 'enunciado', 'solucion')[:options['muestras']])
+        carrera = Carrera.objects.order_by('pk').values_list('nombre', flat=True).first() or "Ingeniería Civil"
+        carrera = normalize_text(carrera, for_storage=True)
+        enunciados = [normalize_text(e.enunciado, for_storage=True) for e in ejercicios] or ["Resuelve 2x + 3 = 11"]
+        soluciones = [str(getattr(e, 'solucion', '') or '') for e in ejercicios] or ["x = 4"]
+
+        variables = {
+            'contexto': [{'carrera': carrera, 'ejercicio': e} for e in enunciados],
+            'diagnostico': [{'ejercicio': e} for e in enunciados],
+            'contexto_lote': [{'carrera': carrera, 'ejercicios': lista_ejercicios(enumerate(enunciados, start=1))}],
+            'diagnostico_lote': [{'ejercicios': lista_ejercicios(enumerate(enunciados, start=1))}],
+            'feedback': [
+                {'datos': datos_feedback({'enunciado': e, 'solucion': s, 'respuesta_estudiante': '7',
+                                          'pasos': ['2x = 14', 'x = 7']})}
+                for e, s in zip(enunciados, soluciones)
+            ],
+        }
+
+        self.stdout.write(f"Modelo: {MODEL}, muestras: {len(enunciados)}")
+        self.stdout.write(f"{'plantilla':<17} {'versión':<8} {'huella':<17} {'system':>7} {'user prom':>10} {'total':>7} {'fijo':>6}")
+        for nombre, plantilla in PLANTILLAS.items():
+            system = contar_tokens(plantilla.system, MODEL)
+            users = [contar_tokens(plantilla.mensajes(**v)[1], MODEL) for v in variables[nombre]]
+            user = sum(users) / len(users)
+            total = system + user
+            self.stdout.write(
+                f"{nombre:<17} {plantilla.version:<8} {plantilla.huella:<17} {system:>7} {user:>10.1f} "
+                f"{total:>7.1f} {system / total:>6.0%}"
+            )
+            if nombre.endswith('_lote'):
+                self.stdout.write(f"  lote de {len(enunciados)}: {total / len(enunciados):.1f} tokens por ejercicio")
+            if system < PREFIJO_CACHEABLE:
+                self.stdout.write(f"  (prefijo fijo bajo {PREFIJO_CACHEABLE} tokens: el proveedor puede no cachearlo)")
+
+# python manage.py medir_prompts --muestras 50
@@ -0,0 +1,250 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.models import Carrera
+from ejercicios.models import Ejercicio
+from ejercicios.utils.text import normalize_text
+from ejercicios.Api_LLMs.cache_contexto import contextos_faltantes, guardar_contexto, obtener_contextos
+from ejercicios.Api_LLMs.prompts import CONTEXTO, DIAGNOSTICO
+from ejercicios.Api_LLMs.respuestas import (
+    ContextoDiagnostico, ContextoEjercicio, formato_respuesta, formato_texto, parsear,
+)
+from usage.services import llm_context
+
+MODOS = ("normal", "diagnostico")
+
+
+class _Ritmo:
+    # Limita los pedidos por minuto entre todos los threads (espaciado uniforme)
+    def __init__(self, rpm):
+        self.intervalo = 60.0 / rpm if rpm else 0.0
+        self.siguiente = time.monotonic()
+        self.lock = threading.Lock()
+
+    def esperar(self):
+        if not self.intervalo:
+            return
+        with self.lock:
+            ahora = time.monotonic()
+            turno = max(self.siguiente, ahora)
+            self.siguiente = turno + self.intervalo
+        if turno > ahora:
+            time.sleep(turno - ahora)
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera por adelantado los contextos LLM que faltan en el cache para cada (Ejercicio x Carrera) "
+        "y los del diagnóstico, en paralelo y respetando un límite de pedidos por minuto. "
+        "También exporta/importa archivos JSONL del Batch API de OpenAI"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modo', choices=MODOS + ('todos',), default='todos')
+        parser.add_argument('--carrera', action='append', default=[], help='Nombre de carrera (repetible); por defecto todas')
+        parser.add_argument('--materia', type=int, action='append', default=[], help='Solo ejercicios de esta materia (id, repetible)')
+        parser.add_argument('--limite', type=int, default=None, help='Máximo de contextos a generar')
+        parser.add_argument('--concurrencia', type=int, default=None, help='Llamadas simultáneas (por defecto settings.LLM_MAX_CONCURRENCIA)')
+        parser.add_argument('--rpm', type=int, default=300, help='Pedidos por minuto al LLM (0 = sin límite)')
+        parser.add_argument('--lote', type=int, default=50, help='Contextos por lote')
+        parser.add_argument('--por-llamada', type=int, default=None,
+                            help='Ejercicios contextualizados en cada llamada al LLM (por defecto settings.CONTEXTO_LOTE; 1 = uno por llamada)')
+        parser.add_argument('--pausa', type=float, default=30.0, help='Segundos de espera si un lote falla en su mayoría (rate limit)')
+        parser.add_argument('--dry-run', action='store_true', help='Solo cuenta lo que falta')
+        parser.add_argument('--exportar-jsonl', default=None, help='Escribe los pedidos faltantes como JSONL del Batch API y termina')
+        parser.add_argument('--importar-jsonl', default=None, help='Guarda en el cache el JSONL de salida de un batch')
+
+    def handle(self, *args, **options):
+        if options['importar_jsonl']:
+            self.importar(options['importar_jsonl'])
+            return
+
+        inicio = time.perf_counter()
+        pendientes = self.faltantes(options)
+        self.stdout.write(
+            f"Contextos faltantes: {len(pendientes)} "
+            f"({sum(1 for m, _, _ in pendientes if m == 'normal')} normal, "
+            f"{sum(1 for m, _, _ in pendientes if m == 'diagnostico')} diagnóstico)"
+        )
+        if options['dry_run'] or not pendientes:
+            return
+        if options['exportar_jsonl']:
+            self.exportar(pendientes, options['exportar_jsonl'])
+            return
+
+        generados, fallidos = self.generar(pendientes, options)
+        self.stdout.write(self.style.SUCCESS(
+            f"Contextos generados: {generados}, fallidos: {fallidos} ({time.perf_counter() - inicio:.1f}s)"
+        ))
+
+    def faltantes(self, options):
+        ejercicios = Ejercicio.objects.order_by('pk')
+        if options['materia']:
+            ejercicios = ejercicios.filter(materia_id__in=options['materia'])
+        ejercicios = list(ejercicios.only('pk', 'enunciado'))
+
+        modos = MODOS if options['modo'] == 'todos' else (options['modo'],)
+        pendientes = []
+        if 'diagnostico' in modos:
+            pares = contextos_faltantes([(e, "") for e in ejercicios], 'diagnostico')
+            pendientes.extend(('diagnostico', e, c) for e, c in pares)
+        if 'normal' in modos:
+            carreras = Carrera.objects.order_by('pk')
+            if options['carrera']:
+                carreras = carreras.filter(nombre__in=options['carrera'])
+                if not carreras.exists():
+                    raise CommandError("Ninguna carrera coincide con --carrera")
+            # mismo string que arma select_mode, así la clave del cache coincide
+            nombres = [normalize_text(c.nombre, for_storage=True) for c in carreras]
+            pares = contextos_faltantes([(e, n) for n in nombres for e in ejercicios], 'normal')
+            pendientes.extend(('normal', e, c) for e, c in pares)
+        if options['limite'] is not None:
+            pendientes = pendientes[:options['limite']]
+        return pendientes
+
+    def generar(self, pendientes, options):
+        from ejercicios.mixins import contextualize_exercise, contextualize_exercise_diagnostico
+        from ejercicios.Api_LLMs.request import contextualize_exercises
+        from ejercicios.Api_LLMs.requestdiagnostico import contextualize_exercises_diagnostico
+
+        concurrencia = options['concurrencia'] or getattr(settings, 'LLM_MAX_CONCURRENCIA', 8)
+        por_llamada = max(1, options['por_llamada'] or getattr(settings, 'CONTEXTO_LOTE', 8))
+        ritmo = _Ritmo(options['rpm'])
+
+        def uno(llamada):
+            # varios ejercicios del mismo modo y carrera en una sola llamada al LLM
+            modo, carrera, ejercicios = llamada
+            ritmo.esperar()
+            try:
+                with llm_context(mode=modo):
+                    if modo == 'diagnostico':
+                        contextos = obtener_contextos(
+                            ejercicios, modo, "", contextualize_exercises_diagnostico,
+                            contextualize_exercise_diagnostico, por_llamada,
+                        )
+                    else:
+                        contextos = obtener_contextos(
+                            ejercicios, modo, carrera,
+                            lambda lista: contextualize_exercises(lista, carrera),
+                            lambda e: contextualize_exercise(e, carrera), por_llamada,
+                        )
+                return sum(1 for p in contextos.values() if isinstance(p, dict) and not p.get('fallback'))
+            finally:
+                connection.close()
+
+        generados = fallidos = 0
+        for i in range(0, len(pendientes), options['lote']):
+            lote = pendientes[i:i + options['lote']]
+            grupos = {}
+            for modo, ejercicio, carrera in lote:
+                grupos.setdefault((modo, carrera), []).append(ejercicio)
+            llamadas = [
+                (modo, carrera, ejercicios[j:j + por_llamada])
+                for (modo, carrera), ejercicios in grupos.items()
+                for j in range(0, len(ejercicios), por_llamada)
+            ]
+            with ThreadPoolExecutor(max_workers=concurrencia, thread_name_prefix='pregenerar') as pool:
+                resultados = list(pool.map(uno, llamadas))
+            ok = sum(resultados)
+            generados += ok
+            fallidos += len(lote) - ok
+            self.stdout.write(
+                f"  lote {i // options['lote'] + 1}: {ok}/{len(lote)} en {len(llamadas)} llamadas (concurrencia={concurrencia})"
+            )
+            if ok * 2 < len(lote) and i + len(lote) < len(pendientes):
+                # casi todo cayó al respaldo: típicamente rate limit; bajar el ritmo y esperar
+                concurrencia = max(1, concurrencia // 2)
+                self.stdout.write(self.style.WARNING(f"  Lote mayormente fallido, pausa de {options['pausa']:.0f}s"))
+                time.sleep(options['pausa'])
+        return generados, fallidos
+
+    def exportar(self, pendientes, ruta):
+        # Un pedido por línea con el mismo prompt y parámetros que request.py / requestdiagnostico.py
+        from ejercicios.Api_LLMs.request import MODEL, build_prompt
+        from ejercicios.Api_LLMs.requestdiagnostico import MODEL as MODEL_DIAG, build_prompt_diagnostico, payload_diagnostico
+
+        with open(ruta, 'w', encoding='utf-8') as f:
+            for modo, ejercicio, carrera in pendientes:
+                custom_id = json.dumps([modo, ejercicio.pk, carrera], ensure_ascii=False)
+                if modo == 'diagnostico':
+                    system, user = build_prompt_diagnostico(payload_diagnostico(ejercicio))
+                    linea = {
+                        "custom_id": custom_id, "method": "POST", "url": "/v1/responses",
+                        "body": {"model": MODEL_DIAG, "instructions": system, "input": user,
+                                 "temperature": 0.2, "max_output_tokens": 256,
+                                 "text": formato_texto(ContextoDiagnostico),
+                                 **DIAGNOSTICO.extra().get("extra_body", {})},
+                    }
+                else:
+                    system, user = build_prompt(carrera, normalize_text(ejercicio.enunciado, for_storage=True))
+                    linea = {
+                        "custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions",
+                        "body": {"model": MODEL, "temperature": 0.3, "max_tokens": 512,
+                                 "response_format": formato_respuesta(ContextoEjercicio),
+                                 "messages": [{"role": "system", "content": system}, {"role": "user", "content": user}],
+                                 **CONTEXTO.extra().get("extra_body", {})},
+                    }
+                f.write(json.dumps(linea, ensure_ascii=False) + "\n")
+        self.stdout.write(self.style.SUCCESS(f"{len(pendientes)} pedidos escritos en {ruta}"))
+
+    def importar(self, ruta):
+        guardados = errores = 0
+        ejercicios = {}
+        with open(ruta, encoding='utf-8') as f:
+            for numero, linea in enumerate(f, start=1):
+                if not linea.strip():
+                    continue
+                try:
+                    fila = json.loads(linea)
+                    modo, ejercicio_id, carrera = json.loads(fila["custom_id"])
+                    payload = self.payload_de_respuesta(modo, fila)
+                except (ValueError, KeyError, TypeError) as e:
+                    self.stderr.write(f"  línea {numero}: {e}")
+                    errores += 1
+                    continue
+                if ejercicio_id not in ejercicios:
+                    ejercicios[ejercicio_id] = Ejercicio.objects.filter(pk=ejercicio_id).first()
+                ejercicio = ejercicios[ejercicio_id]
+                if ejercicio is None or payload is None:
+                    errores += 1
+                    continue
+                guardar_contexto(ejercicio, modo, carrera, payload)
+                guardados += 1
+        self.stdout.write(self.style.SUCCESS(f"Contextos importados: {guardados}, descartados: {errores}"))
+
+    def payload_de_respuesta(self, modo, fila):
+        respuesta = fila.get("response") or {}
+        if fila.get("error") or respuesta.get("status_code", 200) != 200:
+            return None
+        body = respuesta.get("body") or {}
+        if modo == 'diagnostico':
+            texto = "".join(
+                c.get("text", "")
+                for item in body.get("output", []) if item.get("type") == "message"
+                for c in item.get("content", []) if c.get("type") == "output_text"
+            )
+            contexto = parsear(texto, ContextoDiagnostico)
+        else:
+            contexto = parsear(body["choices"][0]["message"]["content"], ContextoEjercicio)
+        if contexto is None:
+            return None
+        payload = contexto.model_dump()
+        if modo != 'diagnostico':
+            payload["display_text"] = normalize_text(payload["display_text"], for_storage=True)
+        return payload
+
+# Todo lo que falte, 300 pedidos/minuto:
+#python manage.py pregenerar_contextos
+# 20 ejercicios por llamada (menos round-trips y menos tokens de prompt repetidos):
+#python manage.py pregenerar_contextos --por-llamada 20
+# Solo una carrera nueva:
+#python manage.py pregenerar_contextos --modo normal --carrera "Ingeniería Civil"
+# Batch API (o un stub local que responda con el mismo formato):
+#python manage.py pregenerar_contextos --exportar-jsonl pedidos.jsonl
+#python manage.py pregenerar_contextos --importar-jsonl salida.jsonl
@@ -0,0 +1,51 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ejercicios.memo_feedback import metricas
+from ejercicios.tareas import procesar_pendientes
+
+
+class Command(BaseCommand):
+    help = "Worker de la cola de feedback IA: toma las TareaFeedback pendientes, llama al LLM y guarda el Feedback"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--intervalo', type=float, default=2.0, help='Segundos entre consultas cuando la cola está vacía')
+        parser.add_argument('--una-vez', action='store_true', help='Procesa lo pendiente y termina (para cron)')
+        parser.add_argument('--metricas', action='store_true', help='Muestra la tasa de reutilización de feedback (memo) y termina')
+
+    def handle(self, *args, **options):
+        if options['metricas']:
+            m = metricas()
+            self.stdout.write(
+                f"Feedback reutilizado: {m['aciertos']} | generado por el LLM: {m['fallos']} | "
+                f"tasa de acierto: {m['tasa_acierto']:.1%}"
+            )
+            return
+        self.detener = False
+        signal.signal(signal.SIGTERM, self.terminar)
+        signal.signal(signal.SIGINT, self.terminar)
+
+        total = 0
+        while not self.detener:
+            close_old_connections()
+            procesadas = procesar_pendientes(limite=50)
+            total += procesadas
+            if procesadas:
+                self.stdout.write(f"Tareas de feedback procesadas: {procesadas}")
+            if options['una_vez']:
+                break
+            if not procesadas:
+                time.sleep(options['intervalo'])
+        self.stdout.write(self.style.SUCCESS(f"Worker de feedback detenido ({total} tareas procesadas)"))
+
+    def terminar(self, *args):
+        # termina la tarea en curso antes de salir
+        self.detener = True
+
+# Worker permanente (systemd/supervisor):
+#python manage.py procesar_feedback
+# o por cron:
+#python manage.py procesar_feedback --una-vez
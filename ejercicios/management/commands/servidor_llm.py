@@ -0,0 +1,170 @@
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ejercicios.Api_LLMs.replay import (
+    ENDPOINTS, cargar, clave, directorio, endpoint_de, eventos_sse, respuesta_simulada,
+)
+
+LATENCIAS = ('grabada', 'fija', 'normal', 'lognormal')
+
+
+class _Latencia:
+    # Muestrea la latencia simulada de cada respuesta (con semilla, para corridas reproducibles)
+    def __init__(self, tipo, mediana_ms, desviacion_ms, sigma, factor, semilla):
+        self.tipo = tipo
+        self.mediana_ms = mediana_ms
+        self.desviacion_ms = desviacion_ms
+        self.sigma = sigma
+        self.factor = factor
+        self.rng = random.Random(semilla)
+        self.lock = threading.Lock()
+
+    def segundos(self, grabadas=None):
+        with self.lock:
+            if self.tipo == 'grabada' and grabadas:
+                ms = self.rng.choice(grabadas)
+            elif self.tipo == 'fija':
+                ms = self.mediana_ms
+            elif self.tipo == 'normal':
+                ms = max(0.0, self.rng.gauss(self.mediana_ms, self.desviacion_ms))
+            else:
+                # lognormal (y 'grabada' sin grabación): cola larga como la de un LLM real
+                ms = self.mediana_ms * math.exp(self.sigma * self.rng.gauss(0.0, 1.0))
+        return ms * self.factor / 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Stub HTTP compatible con el API de OpenAI (chat/completions y responses, con stream) que "
+        "responde desde las grabaciones de LLM_GRABACIONES_DIR con latencia simulada. Apuntar el "
+        "gateway con LLM_BASE_URL=http://host:puerto/v1 para pruebas de carga sin OpenAI"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--puerto', type=int, default=8765)
+        parser.add_argument('--dir', default=None, help='Directorio de grabaciones (por defecto settings.LLM_GRABACIONES_DIR)')
+        parser.add_argument('--si-falta', choices=['simular', 'error'], default='simular',
+                            help='Pedido sin grabación: respuesta armada desde el JSON schema, o 404')
+        parser.add_argument('--latencia', choices=LATENCIAS, default='grabada',
+                            help='grabada = muestrea las latencias grabadas de ese pedido')
+        parser.add_argument('--mediana-ms', type=float, default=1500.0, help='Mediana (fija/normal/lognormal)')
+        parser.add_argument('--desviacion-ms', type=float, default=500.0, help='Desviación estándar de la normal')
+        parser.add_argument('--sigma', type=float, default=0.5, help='Sigma de la lognormal')
+        parser.add_argument('--factor', type=float, default=1.0, help='Multiplica toda latencia (0 = sin espera)')
+        parser.add_argument('--primer-token', type=float, default=0.3,
+                            help='Fracción de la latencia antes del primer chunk en respuestas stream')
+        parser.add_argument('--semilla', type=int, default=0)
+
+    def handle(self, *args, **options):
+        base = options['dir'] or directorio()
+        latencia = _Latencia(
+            options['latencia'], options['mediana_ms'], options['desviacion_ms'],
+            options['sigma'], options['factor'], options['semilla'],
+        )
+        contadores = {'grabadas': 0, 'simuladas': 0, 'faltantes': 0}
+        lock = threading.Lock()
+        comando = self
+
+        def contar(tipo):
+            with lock:
+                contadores[tipo] += 1
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                endpoint = endpoint_de(self.path)
+                cuerpo = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if endpoint not in ENDPOINTS:
+                    return self.json(404, {'error': {'message': f'Endpoint no soportado: {self.path}', 'type': 'not_found'}})
+                try:
+                    pedido = json.loads(cuerpo or b'{}')
+                except ValueError:
+                    return self.json(400, {'error': {'message': 'JSON inválido', 'type': 'invalid_request_error'}})
+
+                clave_pedido = clave(endpoint, pedido)
+                grabacion = cargar(clave_pedido, base)
+                if grabacion is not None:
+                    contar('grabadas')
+                    respuesta = grabacion['respuesta']
+                    espera = latencia.segundos(grabacion.get('latencias_ms'))
+                    if pedido.get('stream'):
+                        return self.stream(eventos_sse(respuesta), espera)
+                    time.sleep(espera)
+                    return self.enviar(grabacion.get('status', 200), grabacion.get('content_type', 'application/json'),
+                                       respuesta.encode('utf-8'))
+
+                if options['si_falta'] == 'error':
+                    contar('faltantes')
+                    return self.json(404, {'error': {'message': f'Sin grabación para {clave_pedido}', 'type': 'not_found'}})
+                contar('simuladas')
+                respuesta = respuesta_simulada(endpoint, pedido, clave_pedido)
+                espera = latencia.segundos()
+                if pedido.get('stream'):
+                    return self.stream(eventos_sse(respuesta), espera)
+                time.sleep(espera)
+                return self.json(200, respuesta)
+
+            def json(self, status, datos):
+                self.enviar(status, 'application/json', json.dumps(datos, ensure_ascii=False).encode('utf-8'))
+
+            def enviar(self, status, content_type, contenido):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(contenido)))
+                self.end_headers()
+                self.wfile.write(contenido)
+
+            def stream(self, eventos, espera):
+                # primer chunk tras una fracción de la latencia, el resto repartido entre los eventos
+                time.sleep(espera * options['primer_token'])
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                pausa = espera * (1 - options['primer_token']) / max(len(eventos), 1)
+                for i, evento in enumerate(eventos):
+                    if i:
+                        time.sleep(pausa)
+                    self.wfile.write(evento.encode('utf-8'))
+                    self.wfile.flush()
+                self.close_connection = True
+
+        try:
+            servidor = ThreadingHTTPServer((options['host'], options['puerto']), Handler)
+        except OSError as e:
+            raise CommandError(f"No se pudo abrir {options['host']}:{options['puerto']}: {e}")
+        servidor.daemon_threads = True
+        comando.stdout.write(
+            f"Stub LLM en http://{options['host']}:{options['puerto']}/v1 "
+            f"(grabaciones: {base}, latencia: {options['latencia']}, si falta: {options['si_falta']})"
+        )
+        try:
+            servidor.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            servidor.server_close()
+            comando.stdout.write(
+                f"Respuestas grabadas: {contadores['grabadas']}, simuladas: {contadores['simuladas']}, "
+                f"sin grabación: {contadores['faltantes']}"
+            )
+
+# Grabar contra OpenAI mientras se navega / corre una prueba:
+#LLM_GRABAR=1 python manage.py runserver
+# Reproducir offline (latencias grabadas, x1) y apuntar Django al stub:
+#python manage.py servidor_llm --puerto 8765
+#LLM_BASE_URL=http://127.0.0.1:8765/v1 LLM_HEDGE_DESPUES=0 python manage.py runserver
+# Sin grabaciones, latencia lognormal de mediana 1.2s:
+#python manage.py servidor_llm --latencia lognormal --mediana-ms 1200 --sigma 0.6
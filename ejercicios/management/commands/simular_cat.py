@@ -0,0 +1,237 @@
+import json
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from accounts.models import Diagnostico
+from ejercicios.banco_items import IndiceBanco
+from ejercicios.exposicion import calcular_parametros_exposicion, establecer_parametros_exposicion
+from ejercicios.irt import obtener_modelo
+from ejercicios.parada import evaluar_parada
+from ejercicios.services import (
+    THETA_MIN, THETA_MAX, respuestas_vacias, _agregar_respuesta, estimar_diagnostico, elegir_siguiente,
+)
+
+# Bandas de theta real para el reporte condicional
+BANDAS = [-3.0, -2.0, -1.0, 0.0, 1.0, 2.0, 3.0]
+
+
+class Command(BaseCommand):
+    help = (
+        "Simula diagnósticos adaptativos completos con estudiantes sintéticos de theta conocido "
+        "(selección, estimación y reglas de término reales, sin DB) y reporta sesgo/RMSE, "
+        "largo del test, exposición y latencia por paso"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--estudiantes', type=int, default=1000, help='Diagnósticos a simular')
+        parser.add_argument('--banco', choices=['sintetico', 'db'], default='sintetico', help='Banco sintético o los Ejercicio de la DB')
+        parser.add_argument('--items', type=int, default=500, help='Ítems del banco sintético')
+        parser.add_argument('--unidades', type=int, default=6, help='Unidades del banco sintético')
+        parser.add_argument('--tipos', type=int, default=4, help='Tipos de ejercicio del banco sintético')
+        parser.add_argument('--distribucion', choices=['normal', 'uniforme'], default='normal', help='Distribución del theta real')
+        parser.add_argument('--estimador', default=None, help='EAP, MAP o MLE (por defecto settings.IRT_ESTIMADOR)')
+        parser.add_argument('--sin-exposicion', action='store_true', help='Desactiva el control de exposición')
+        parser.add_argument('--sin-balanceo', action='store_true', help='Desactiva el balanceo de contenido')
+        parser.add_argument('--refresco-exposicion', type=int, default=50, help='Cada cuántos estudiantes se recalculan los parámetros de exposición')
+        parser.add_argument('--semilla', type=int, default=0)
+        parser.add_argument('--json', default=None, help='Archivo donde guardar las métricas')
+        parser.add_argument('--max-rmse', type=float, default=None, help='Falla si el RMSE supera este valor')
+        parser.add_argument('--max-p95-ms', type=float, default=None, help='Falla si el p95 de latencia por paso supera este valor')
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['semilla'])
+        cambios = {}
+        if options['estimador']:
+            cambios['IRT_ESTIMADOR'] = options['estimador'].upper()
+        if options['sin_exposicion']:
+            cambios['EXPOSICION_CONTROL'] = False
+        if options['sin_balanceo']:
+            cambios['CAT_BALANCEO_CONTENIDO'] = False
+
+        with override_settings(**cambios):
+            modelo = obtener_modelo()
+            inicio = time.perf_counter()
+            indice = self.cargar_banco(options, modelo, rng)
+            if len(indice) == 0:
+                raise CommandError("El banco de ítems está vacío.")
+            self.stdout.write(
+                f"Banco: {len(indice)} ítems ({options['banco']}), modelo {modelo.nombre}, "
+                f"estimador {getattr(settings, 'IRT_ESTIMADOR', 'EAP')} ({time.perf_counter() - inicio:.1f}s)"
+            )
+            resultados = self.simular(indice, modelo, rng, options)
+
+        metricas = self.metricas(indice, resultados)
+        self.reportar(metricas)
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(metricas, f, indent=2)
+            self.stdout.write(f"Métricas guardadas en {options['json']}")
+
+        fallas = []
+        if options['max_rmse'] is not None and metricas['rmse'] > options['max_rmse']:
+            fallas.append(f"RMSE {metricas['rmse']:.3f} > {options['max_rmse']}")
+        if options['max_p95_ms'] is not None and metricas['latencia_ms']['paso']['p95'] > options['max_p95_ms']:
+            fallas.append(f"p95 por paso {metricas['latencia_ms']['paso']['p95']:.2f} ms > {options['max_p95_ms']}")
+        if fallas:
+            raise CommandError("Regresión: " + "; ".join(fallas))
+
+    def cargar_banco(self, options, modelo, rng):
+        if options['banco'] == 'db':
+            return IndiceBanco.desde_db()
+        n = options['items']
+        dificultad = np.clip(rng.normal(0.0, 1.2, n), THETA_MIN, THETA_MAX)
+        discriminacion = np.clip(rng.lognormal(0.0, 0.3, n), 0.3, 2.0)
+        adivinanza = rng.uniform(0.0, 0.2, n) if modelo.usa_adivinanza else np.zeros(n)
+        unidades = rng.integers(1, options['unidades'] + 1, n)
+        tipo_bits = {t: t - 1 for t in range(1, options['tipos'] + 1)}
+        tipos = 1 << rng.integers(0, options['tipos'], n)
+        return IndiceBanco(
+            dificultad, discriminacion, np.arange(1, n + 1), np.ones(n), unidades, adivinanza,
+            tipos=tipos, tipo_bits=tipo_bits, modelo=modelo,
+        )
+
+    def simular(self, indice, modelo, rng, options):
+        n_est = options['estudiantes']
+        if options['distribucion'] == 'normal':
+            thetas = np.clip(rng.normal(0.0, 1.0, n_est), THETA_MIN, THETA_MAX)
+        else:
+            thetas = rng.uniform(THETA_MIN, THETA_MAX, n_est)
+
+        # exposición simulada: parte sin restricción y se recalcula cada `refresco` estudiantes
+        # (igual que en producción, k sale de las veces que cada ítem llegó al filtro, ver exposicion.py)
+        veces_mostrado = np.zeros(len(indice))
+        veces_seleccionado = np.zeros(len(indice))
+        establecer_parametros_exposicion([], [])
+        refresco = max(options['refresco_exposicion'], 1)
+
+        estimados, errores, largos, motivos = [], [], [], []
+        t_sel, t_est, t_par = [], [], []
+        for k, theta_real in enumerate(thetas):
+            if k and k % refresco == 0:
+                establecer_parametros_exposicion(indice.ids, calcular_parametros_exposicion(veces_seleccionado, veces_mostrado, k))
+            diagnostico = Diagnostico(
+                theta=0.0, error_estimacion=1.0, respuestas=respuestas_vacias(), log_posterior={},
+                fecha_inicio=timezone.now(),
+            )
+            motivo = ""
+            while True:
+                t0 = time.perf_counter()
+                siguiente, considerados = elegir_siguiente(indice, diagnostico.theta, diagnostico.respuestas["ids"], rng=rng)
+                t1 = time.perf_counter()
+                if siguiente is None:
+                    motivo = "No hay más ejercicios disponibles"
+                    break
+                pos = int(indice.posiciones([siguiente])[0])
+                a, b, c = indice.discriminacion[pos], indice.dificultad[pos], indice.adivinanza[pos]
+                correcto = rng.random() < float(modelo.probabilidad(theta_real, a, b, c))
+                veces_mostrado[pos] += 1
+                veces_seleccionado[indice.posiciones(list({*considerados, siguiente}))] += 1
+
+                t2 = time.perf_counter()
+                _agregar_respuesta(diagnostico.respuestas, siguiente, a, b, c, correcto)
+                estimar_diagnostico(diagnostico, diagnostico.respuestas, recien_agregada=True)
+                t3 = time.perf_counter()
+                finalizado, motivo = evaluar_parada(diagnostico, diagnostico.theta, diagnostico.error_estimacion, indice)
+                t4 = time.perf_counter()
+                t_sel.append(t1 - t0)
+                t_est.append(t3 - t2)
+                t_par.append(t4 - t3)
+                if finalizado:
+                    break
+            estimados.append(diagnostico.theta)
+            errores.append(diagnostico.error_estimacion)
+            largos.append(len(diagnostico.respuestas["ids"]))
+            motivos.append(motivo)
+
+        return {
+            "theta_real": thetas,
+            "theta_estimado": np.array(estimados, dtype=float),
+            "se": np.array(errores, dtype=float),
+            "largo": np.array(largos),
+            "motivos": motivos,
+            "veces_mostrado": veces_mostrado,
+            "tiempos": {"seleccion": np.array(t_sel), "estimacion": np.array(t_est), "parada": np.array(t_par)},
+        }
+
+    def metricas(self, indice, r):
+        real, estimado, se = r["theta_real"], r["theta_estimado"], r["se"]
+        error = estimado - real
+
+        bandas = []
+        for lo, hi in zip(BANDAS[:-1], BANDAS[1:]):
+            sel = (real >= lo) & ((real < hi) | (hi == BANDAS[-1]))
+            if not sel.any():
+                continue
+            bandas.append({
+                "desde": lo, "hasta": hi, "n": int(sel.sum()),
+                "sesgo": float(error[sel].mean()),
+                "rmse": float(np.sqrt(np.mean(error[sel] ** 2))),
+                "largo_medio": float(r["largo"][sel].mean()),
+            })
+
+        def percentiles(t):
+            t = t * 1000.0
+            if not len(t):
+                return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+            p50, p95, p99 = np.percentile(t, [50, 95, 99])
+            return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "max": float(t.max())}
+
+        tiempos = r["tiempos"]
+        tasas = r["veces_mostrado"] / max(len(real), 1)
+        motivos = {}
+        for motivo in r["motivos"]:
+            motivos[motivo] = motivos.get(motivo, 0) + 1
+
+        return {
+            "estudiantes": int(len(real)),
+            "items": int(len(indice)),
+            "sesgo": float(error.mean()),
+            "rmse": float(np.sqrt(np.mean(error ** 2))),
+            "correlacion": float(np.corrcoef(real, estimado)[0, 1]) if np.std(estimado) > 0 else 0.0,
+            "se_medio": float(se.mean()),
+            "cobertura_95": float(np.mean(np.abs(error) <= 1.96 * se)),
+            "largo": {"medio": float(r["largo"].mean()), "min": int(r["largo"].min()), "max": int(r["largo"].max())},
+            "motivos": motivos,
+            "bandas": bandas,
+            "exposicion": {
+                "tasa_maxima": float(tasas.max()),
+                "sobre_limite": int(np.sum(tasas > getattr(settings, "EXPOSICION_TASA_MAXIMA", 0.25))),
+                "sin_usar": float(np.mean(tasas == 0)),
+            },
+            "latencia_ms": {
+                "seleccion": percentiles(tiempos["seleccion"]),
+                "estimacion": percentiles(tiempos["estimacion"]),
+                "parada": percentiles(tiempos["parada"]),
+                "paso": percentiles(tiempos["seleccion"] + tiempos["estimacion"] + tiempos["parada"]),
+            },
+        }
+
+    def reportar(self, m):
+        self.stdout.write(
+            f"Estudiantes={m['estudiantes']} sesgo={m['sesgo']:+.3f} RMSE={m['rmse']:.3f} "
+            f"r={m['correlacion']:.3f} SE medio={m['se_medio']:.3f} cobertura 95%={m['cobertura_95']:.1%}"
+        )
+        self.stdout.write(
+            f"Largo del test: medio={m['largo']['medio']:.1f} min={m['largo']['min']} max={m['largo']['max']}"
+        )
+        for motivo, n in sorted(m["motivos"].items(), key=lambda x: -x[1]):
+            self.stdout.write(f"  {motivo or 'sin motivo'}: {n}")
+        self.stdout.write("Por theta real:")
+        for b in m["bandas"]:
+            self.stdout.write(
+                f"  [{b['desde']:+.0f}, {b['hasta']:+.0f}) n={b['n']:5d} sesgo={b['sesgo']:+.3f} "
+                f"RMSE={b['rmse']:.3f} largo={b['largo_medio']:.1f}"
+            )
+        e = m["exposicion"]
+        self.stdout.write(
+            f"Exposición: tasa máxima={e['tasa_maxima']:.2f} ítems sobre el límite={e['sobre_limite']} "
+            f"sin usar={e['sin_usar']:.1%}"
+        )
+        self.stdout.write("Latencia por paso (ms):")
+        for etapa, p in m["latencia_ms"].items():
+            self.stdout.write(f"  {etapa:<10} p50={p['p50']:.3f} p95={p['p95']:.3f} p99={p['p99']:.3f} max={p['max']:.3f}")
@@ -0,0 +1,114 @@
+# Memoización del feedback IA por error repetido.
+# Muchos estudiantes mandan la misma respuesta equivocada (con los mismos pasos) al mismo ejercicio y
+# cada intento pedía feedback nuevo al LLM. Ahora el Feedback generado guarda una clave_memo:
+#   hash(ejercicio, normalizar_respuesta(respuesta), hash de los pasos normalizados,
+#        enunciado + solución, versión del prompt de feedback)
+# y un intento con la misma clave recibe una copia de ese Feedback y sus FeedbackPasos sin llamar
+# al LLM. El cache de Django guarda clave -> id del Feedback plantilla (la DB es el respaldo).
+# Aciertos y fallos se cuentan en el cache: ver metricas() o `manage.py procesar_feedback --metricas`.
+
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Feedback, FeedbackPasos
+from .utils.cache import incrementar
+from .utils.text import normalizar_respuesta
+from usage.services import record_llm_call
+
+logger = logging.getLogger(__name__)
+
+KEY_PLANTILLA = "feedback:memo:{}"
+KEY_ACIERTOS = "feedback:memo:aciertos"
+KEY_FALLOS = "feedback:memo:fallos"
+
+def _hash(texto):
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def version_prompt():
+    # Si cambia la plantilla de feedback, los feedbacks viejos dejan de reutilizarse
+    from .Api_LLMs.prompts import FEEDBACK
+    return FEEDBACK.huella
+
+
+def clave_feedback(ejercicio_id, payload):
+    pasos = [normalizar_respuesta(str(p)) for p in payload.get("pasos") or []]
+    partes = [
+        str(ejercicio_id),
+        normalizar_respuesta(payload.get("respuesta_estudiante") or ""),
+        _hash("\n".join(p for p in pasos if p)),
+        _hash(f"{payload.get('enunciado', '')}|{payload.get('solucion', '')}")[:16],
+        version_prompt(),
+    ]
+    return _hash("|".join(partes))
+
+
+def _buscar_plantilla(clave):
+    feedback_id = cache.get(KEY_PLANTILLA.format(clave))
+    if feedback_id is not None:
+        plantilla = Feedback.objects.filter(pk=feedback_id, clave_memo=clave).first()
+        if plantilla is not None:
+            return plantilla
+    plantilla = Feedback.objects.filter(clave_memo=clave).order_by("-fecha_feedback").first()
+    if plantilla is not None:
+        recordar(plantilla)
+    return plantilla
+
+
+def recordar(feedback):
+    # Deja el Feedback recién creado como plantilla de su clave
+    if feedback.clave_memo:
+        cache.set(KEY_PLANTILLA.format(feedback.clave_memo), feedback.pk, timeout=getattr(settings, "FEEDBACK_MEMO_TTL", 7 * 24 * 3600))
+
+
+def reutilizar_feedback(intento, payload, contar_fallo=False):
+    """
+    Copia al intento el Feedback de otro intento con la misma clave y lo devuelve, o None si es un
+    error nuevo. contar_fallo=True cuando el que llama va a usar el LLM (así cada intento suma a lo
+    más un fallo aunque se consulte en el submit y de nuevo en el worker).
+    """
+    if not getattr(settings, "FEEDBACK_MEMO", True):
+        return None
+    try:
+        clave = clave_feedback(intento.ejercicio_id, payload)
+        plantilla = _buscar_plantilla(clave)
+    except Exception:
+        logger.exception("Error buscando feedback memorizado para intento %s", intento.pk)
+        return None
+    if plantilla is None:
+        if contar_fallo:
+            incrementar(KEY_FALLOS)
+        return None
+
+    fb = Feedback.objects.create(
+        intento=intento,
+        contexto_ejercicio=plantilla.contexto_ejercicio,
+        feedback=plantilla.feedback,
+        fuente_ia=plantilla.fuente_ia,
+        clave_memo=clave,
+    )
+    FeedbackPasos.objects.bulk_create([
+        FeedbackPasos(
+            feedback=fb, tipo_feedback_id=p.tipo_feedback_id, orden=p.orden,
+            contenido=p.contenido, datos_aux=p.datos_aux,
+        )
+        for p in FeedbackPasos.objects.filter(feedback=plantilla).order_by("orden")
+    ])
+    incrementar(KEY_ACIERTOS)
+    record_llm_call(cache_hit=True, mode="feedback", user_id=intento.estudiante.user_id)
+    logger.debug("Feedback del intento %s reutilizado de Feedback #%s", intento.pk, plantilla.pk)
+    return fb
+
+
+def metricas():
+    aciertos = cache.get(KEY_ACIERTOS) or 0
+    fallos = cache.get(KEY_FALLOS) or 0
+    total = aciertos + fallos
+    return {
+        "aciertos": aciertos,
+        "fallos": fallos,
+        "tasa_acierto": aciertos / total if total else 0.0,
+    }
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:55
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ejercicios', '0010_alter_intento_uuid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ejercicio',
+            name='adivinanza',
+            field=models.FloatField(default=0.0, help_text='Parámetro c de IRT (3PL): probabilidad de acertar al azar', validators=[django.core.validators.MinValueValidator(0.0), django.core.validators.MaxValueValidator(0.5)], verbose_name='adivinanza'),
+        ),
+    ]
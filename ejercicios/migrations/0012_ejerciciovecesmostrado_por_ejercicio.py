@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ejercicios', '0011_ejercicio_adivinanza'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ejerciciovecesmostrado',
+            name='ejercicio',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='exposicion', to='ejercicios.ejercicio'),
+        ),
+        migrations.AlterField(
+            model_name='ejerciciovecesmostrado',
+            name='veces_acertado',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='ejerciciovecesmostrado',
+            name='veces_mostrado',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
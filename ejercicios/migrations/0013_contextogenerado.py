@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ejercicios', '0012_ejerciciovecesmostrado_por_ejercicio'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContextoGenerado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=64, unique=True)),
+                ('carrera', models.CharField(blank=True, max_length=150)),
+                ('modo', models.CharField(max_length=30)),
+                ('modelo_llm', models.CharField(max_length=100)),
+                ('version_prompt', models.CharField(max_length=16)),
+                ('payload', models.JSONField()),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('expira', models.DateTimeField(db_index=True)),
+                ('ejercicio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='contextos', to='ejercicios.ejercicio')),
+            ],
+            options={
+                'verbose_name': 'Contexto generado',
+                'verbose_name_plural': 'Contextos generados',
+            },
+        ),
+    ]
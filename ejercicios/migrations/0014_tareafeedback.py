@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:13
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ejercicios', '0013_contextogenerado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TareaFeedback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_proceso', 'En proceso'), ('completada', 'Completada'), ('fallida', 'Fallida')], default='pendiente', max_length=20)),
+                ('payload', models.JSONField(verbose_name='datos para el LLM')),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('disponible_desde', models.DateTimeField(default=django.utils.timezone.now, help_text='No se toma antes (backoff entre reintentos)')),
+                ('tomada_en', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('creada', models.DateTimeField(auto_now_add=True)),
+                ('actualizada', models.DateTimeField(auto_now=True)),
+                ('intento', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='tarea_feedback', to='ejercicios.intento')),
+            ],
+            options={
+                'verbose_name': 'Tarea de feedback',
+                'verbose_name_plural': 'Tareas de feedback',
+                'indexes': [models.Index(fields=['estado', 'disponible_desde'], name='ejercicios__estado_5f57cd_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ejercicios', '0014_tareafeedback'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feedback',
+            name='clave_memo',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
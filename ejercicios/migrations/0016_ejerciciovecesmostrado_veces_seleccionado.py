@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:35
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def inicializar_seleccionados(apps, schema_editor):
+    # Todo ítem administrado fue seleccionado: punto de partida para no perder el control ya acumulado
+    EjercicioVecesMostrado = apps.get_model('ejercicios', 'EjercicioVecesMostrado')
+    EjercicioVecesMostrado.objects.update(veces_seleccionado=F('veces_mostrado'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ejercicios', '0015_feedback_clave_memo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ejerciciovecesmostrado',
+            name='veces_seleccionado',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(inicializar_seleccionados, reverse_code=migrations.RunPython.noop),
+    ]
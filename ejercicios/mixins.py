@@ -4,6 +4,7 @@ from accounts.models import Diagnostico, Estudiante
 from ejercicios.utils.text import normalize_text
 from .models import Intento,IntentoPaso
 from accounts.services import diagnostico_finalizado
+from usage.services import llm_context
 from django.db import transaction
 from django.utils import timezone
 from django.http import JsonResponse, HttpResponseBadRequest 
@@ -21,10 +22,12 @@ def _ejercicio_session_key(estudiante):
     return f"ejercicio_current_ej_{estudiante.pk}"
 
 try:
-    from ejercicios.services import seleccionar_siguiente_ejercicio
+    from ejercicios.services import seleccionar_siguiente_ejercicio, liberar_reservas
 except ImportError as e:
     logger.error("Error al importar servicios: %s", str(e))
-    def seleccionar_siguiente_ejercicio(estudiante):
+    def liberar_reservas(diagnostico):
+        pass
+    def seleccionar_siguiente_ejercicio(estudiante, diagnostico=None):
         from ejercicios.models import Ejercicio
         logger.warning("--ERROR-- Usando selección aleatoria | Fallo en importación")
         return Ejercicio.objects.order_by('?').first()
@@ -45,6 +48,14 @@ except ImportError as e:
         return {"display_text": ejercicio.enunciado, "hint": f'Contexto para {carrera or "General"} no disponible'}
     
 
+try:
+    from .Api_LLMs.cache_contexto import obtener_contexto
+except ImportError as e:
+    logger.error("Error al importar cache_contexto: %s", str(e))
+    def obtener_contexto(ejercicio, modo, carrera, generar):
+        return generar()
+
+
 # Esta la usaré más adelante
 def get_type_of_user(request):
     try:
@@ -67,16 +78,18 @@ def obtener_o_validar_diagnostico(estudiante) -> Diagnostico:
     from accounts.services import obtener_o_validar_diagnostico #Import local, pa evitar ciclos
     return obtener_o_validar_diagnostico(estudiante)
 
-def diagnostico_activo_para_api(estudiante):
+def diagnostico_activo_para_api(estudiante, bloquear=False):
     from accounts.services import diagnostico_activo
-    return diagnostico_activo(estudiante)
+    return diagnostico_activo(estudiante, bloquear=bloquear)
 
 #Es muy probable que vuelva a modificar esta función, pero por ahora queda así
 # Seleccionad entre modos: diagnostico, ejercicio (solo) y me falta en grupo
 def select_mode(estudiante,ejercicio, modo: str ):
     try:
+        # los contextos se cachean por (ejercicio, carrera, modo, modelo, prompt), ver cache_contexto.py
         if modo == "diagnostico":
-            return contextualize_exercise_diagnostico(ejercicio)
+            with llm_context(user_id=getattr(estudiante, "user_id", None), mode=modo):
+                return obtener_contexto(ejercicio, modo, "", lambda: contextualize_exercise_diagnostico(ejercicio))
         if not estudiante:
             raise ValueError("Se requiere ser estudiante en modo normal")
         # obtener un string representativo de la carrera, preferir un campo explícito
@@ -90,14 +103,16 @@ def select_mode(estudiante,ejercicio, modo: str ):
             carrera_str = normalize_text(carrera_str, for_storage=True)
         logger.info("Seleccionando modo %s para estudiante %s en carrera %s",
                     modo, estudiante.user.username, carrera_str)
-        return contextualize_exercise(ejercicio, carrera_str)
+        with llm_context(user_id=estudiante.user_id, mode=modo):
+            return obtener_contexto(ejercicio, modo, carrera_str, lambda: contextualize_exercise(ejercicio, carrera_str))
 
     except Exception as e:
         logger.exception("Error al generar contexto para ejercicio %s en modo %s: %s", 
                         getattr(ejercicio, "id", "?"), modo, str(e))
         return {
             "display_text": ejercicio.enunciado,
-            "hint": "Contexto no disponible actualmente"
+            "hint": "Contexto no disponible actualmente",
+            "fallback": True,
         }
 
 
@@ -120,10 +135,11 @@ def prepare_next_payload_diagnostico(estudiante, wants_json:bool = False) -> Tup
                 "motivo": "Tiempo agotado" if diagnostico.is_expired() else "Precisión alcanzada"
             }, None
     
-    ejercicio = seleccionar_siguiente_ejercicio(estudiante)
+    ejercicio = seleccionar_siguiente_ejercicio(estudiante, diagnostico=diagnostico)
     if not ejercicio:
         diagnostico.finalizado = True
         diagnostico.save(update_fields=['finalizado'])
+        liberar_reservas(diagnostico)
         if wants_json:
             return None , JsonResponse({
                 "succes": False,
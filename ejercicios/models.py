@@ -1,6 +1,7 @@
 from django.db import models
 from django.conf import settings
 from django.core import validators
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from accounts.models import AbstractBaseModel, Estudiante
 import uuid
@@ -79,6 +80,15 @@ class Ejercicio(AbstractBaseModel):
             validators.MaxValueValidator(2.0)     # Será 2 // Al menos eso está en documentaciones que he visto
         ]
     )
+    adivinanza = models.FloatField(
+        verbose_name=_("adivinanza"),
+        default=0.0,
+        help_text=_("Parámetro c de IRT (3PL): probabilidad de acertar al azar"),
+        validators=[
+            validators.MinValueValidator(0.0),
+            validators.MaxValueValidator(0.5)
+        ]
+    )
     fuente = models.CharField(
         max_length=100,
         choices=[
@@ -109,10 +119,35 @@ class Ejercicio(AbstractBaseModel):
         return self.enunciado
     
 class EjercicioVecesMostrado(models.Model):
-    ejercicio = models.ForeignKey(Ejercicio, on_delete=models.CASCADE)
-    veces_mostrado=models.PositiveBigIntegerField()
-    veces_acertado=models.PositiveBigIntegerField()
-    
+    # Una fila por ejercicio; se actualiza en lotes desde el cache (ver exposicion.py)
+    ejercicio = models.OneToOneField(Ejercicio, on_delete=models.CASCADE, related_name="exposicion")
+    veces_mostrado=models.PositiveBigIntegerField(default=0)
+    veces_acertado=models.PositiveBigIntegerField(default=0)
+    # veces que llegó al filtro Sympson-Hetter (administrado o no); de acá sale su parámetro k
+    veces_seleccionado=models.PositiveBigIntegerField(default=0)
+
+
+class ContextoGenerado(models.Model):
+    # Contexto ({display_text, hint}) generado por el LLM para un ejercicio; segundo nivel del cache
+    # de contextos (ver Api_LLMs/cache_contexto.py). La clave resume ejercicio, carrera, modo,
+    # modelo, versión del prompt y enunciado.
+    clave = models.CharField(max_length=64, unique=True)
+    ejercicio = models.ForeignKey(Ejercicio, on_delete=models.CASCADE, related_name="contextos")
+    carrera = models.CharField(max_length=150, blank=True)
+    modo = models.CharField(max_length=30)
+    modelo_llm = models.CharField(max_length=100)
+    version_prompt = models.CharField(max_length=16)
+    payload = models.JSONField()
+    creado = models.DateTimeField(auto_now_add=True)
+    expira = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = "Contexto generado"
+        verbose_name_plural = "Contextos generados"
+
+    def __str__(self):
+        return f"{self.ejercicio_id} - {self.modo} - {self.carrera or 'general'}"
+
 class PasoEjercicio(models.Model):
 
     ejercicio = models.ForeignKey(Ejercicio, on_delete=models.CASCADE)
@@ -169,11 +204,49 @@ class Feedback(models.Model):
         verbose_name="fuente IA"
     )
     fecha_feedback = models.DateTimeField(auto_now_add=True, verbose_name="fecha del feedback")
+    # Hash de (ejercicio, respuesta normalizada, pasos normalizados, prompt); permite reutilizar este
+    # feedback para el mismo error en otro intento (ver memo_feedback.py). Vacío si no es reutilizable.
+    clave_memo = models.CharField(max_length=64, blank=True, db_index=True)
 
     def __str__(self):
         snippet= (self.contexto_ejercicio or "")[:80]
         return f"Feeback #{self.pk} - {snippet}" 
 
+class TareaFeedback(models.Model):
+    # Generación pendiente del feedback IA de un intento. Es la cola de trabajos en la DB: el submit
+    # solo crea la tarea y un worker (ver ejercicios/tareas.py y el comando procesar_feedback) llama
+    # al LLM fuera de la transacción del request y crea el Feedback.
+    PENDIENTE = "pendiente"
+    EN_PROCESO = "en_proceso"
+    COMPLETADA = "completada"
+    FALLIDA = "fallida"
+    ESTADOS = [
+        (PENDIENTE, "Pendiente"),
+        (EN_PROCESO, "En proceso"),
+        (COMPLETADA, "Completada"),
+        (FALLIDA, "Fallida"),
+    ]
+
+    intento = models.OneToOneField(Intento, on_delete=models.CASCADE, related_name="tarea_feedback")
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=PENDIENTE)
+    payload = models.JSONField(verbose_name="datos para el LLM")
+    intentos = models.PositiveSmallIntegerField(default=0)
+    disponible_desde = models.DateTimeField(default=timezone.now, help_text="No se toma antes (backoff entre reintentos)")
+    tomada_en = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    creada = models.DateTimeField(auto_now_add=True)
+    actualizada = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Tarea de feedback"
+        verbose_name_plural = "Tareas de feedback"
+        indexes = [
+            models.Index(fields=["estado", "disponible_desde"]),
+        ]
+
+    def __str__(self):
+        return f"Tarea feedback intento {self.intento_id} ({self.estado})"
+
 class TipoFeedback(models.Model):
     nombre = models.CharField(max_length=50, unique=True, verbose_name="tipo de feedback")
     def __str__(self):
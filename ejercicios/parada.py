@@ -0,0 +1,235 @@
+# Reglas de término del diagnóstico adaptativo.
+# Cada regla mira el estado incremental del diagnóstico (Diagnostico.respuestas, theta, SE y
+# el índice en memoria del banco) y devuelve el motivo de término o None; no hace consultas.
+# Las reglas se configuran en settings.DIAGNOSTICO_PARADA (por materia, con valores por defecto
+# tomados de DIAGNOSTICO_*) y se instancian una sola vez por materia.
+
+import logging
+import threading
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class EstadoDiagnostico:
+    """
+    Lo que necesitan las reglas, armado desde el diagnóstico ya actualizado:
+    n_items, theta, se, historial de SE (respuestas["se"]), tiempo restante y los ids respondidos.
+    `indice` es el índice del banco a usar (por defecto el del proceso, ver banco_items).
+    """
+
+    def __init__(self, diagnostico, theta, se, indice=None):
+        respuestas = diagnostico.respuestas or {}
+        self.diagnostico = diagnostico
+        self.ids = respuestas.get("ids") or []
+        self.n_items = len(self.ids)
+        self.theta = float(theta)
+        self.se = float(se)
+        self.historial_se = respuestas.get("se") or []
+        self.tiempo_restante = diagnostico.tiempo_restante()
+        self._indice = indice
+
+    @property
+    def indice(self):
+        if self._indice is None:
+            from .banco_items import obtener_indice  # import local, banco_items carga modelos
+            self._indice = obtener_indice()
+        return self._indice
+
+
+class Regla:
+    nombre = ""
+    motivo = ""
+    # si respeta el mínimo de ítems antes de poder terminar el diagnóstico
+    respeta_minimo = True
+
+    def __init__(self, **kwargs):
+        # cada regla toma de la configuración solo los parámetros que usa
+        pass
+
+    def evaluar(self, estado):
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.__dict__})"
+
+
+class ReglaError(Regla):
+    # SE bajo el umbral
+    nombre = "error"
+    motivo = "Precisión alcanzada"
+
+    def __init__(self, umbral_se=0.4, **kwargs):
+        self.umbral_se = float(umbral_se)
+
+    def evaluar(self, estado):
+        return estado.se < self.umbral_se
+
+
+class ReglaMaxItems(Regla):
+    nombre = "max_items"
+    motivo = "Límite de ejercicios alcanzado"
+    respeta_minimo = False
+
+    def __init__(self, max_items=30, **kwargs):
+        self.max_items = int(max_items)
+
+    def evaluar(self, estado):
+        return estado.n_items >= self.max_items
+
+
+class ReglaTiempo(Regla):
+    nombre = "tiempo"
+    motivo = "Tiempo agotado"
+    respeta_minimo = False
+
+    def evaluar(self, estado):
+        return estado.tiempo_restante <= 0
+
+
+class ReglaNivelExtremo(Regla):
+    # theta pegado a los extremos de la escala después de varios ítems: no hay ítems que aporten más
+    nombre = "nivel_extremo"
+    motivo = "Nivel extremo detectado"
+
+    def __init__(self, umbral_extremo=2.9, min_items_extremo=10, **kwargs):
+        self.umbral_extremo = float(umbral_extremo)
+        self.min_items_extremo = int(min_items_extremo)
+
+    def evaluar(self, estado):
+        return abs(estado.theta) >= self.umbral_extremo and estado.n_items >= self.min_items_extremo
+
+
+class ReglaMeseta(Regla):
+    # El SE casi no bajó en las últimas `ventana` respuestas
+    nombre = "meseta"
+    motivo = "Sin ganancia de información"
+
+    def __init__(self, ventana_meseta=5, delta_meseta=0.01, **kwargs):
+        self.ventana = int(ventana_meseta)
+        self.delta = float(delta_meseta)
+
+    def evaluar(self, estado):
+        historial = estado.historial_se
+        if len(historial) <= self.ventana:
+            return False
+        return historial[-self.ventana - 1] - historial[-1] < self.delta
+
+
+class ReglaReduccionPredicha(Regla):
+    """
+    Predicted standard error reduction: SE esperado si se administra el mejor ítem disponible,
+    SE' = 1 / sqrt(1 / SE^2 + I_max(theta)). Si SE - SE' es menor al umbral, seguir no vale la pena.
+    I_max sale de la tabla precalculada del índice del banco.
+    """
+    nombre = "reduccion_predicha"
+    motivo = "Reducción de error esperada insuficiente"
+
+    def __init__(self, umbral_reduccion=0.01, **kwargs):
+        self.umbral = float(umbral_reduccion)
+
+    def evaluar(self, estado):
+        indice = estado.indice
+        if len(indice) == 0:
+            return False
+        excluidos = indice.mascara_excluidos(estado.ids)
+        if excluidos.all():
+            return False
+        _, info = indice.candidatos(estado.theta, excluidos, 1)
+        if not len(info) or estado.se <= 0:
+            return False
+        se_predicho = 1.0 / np.sqrt(1.0 / estado.se ** 2 + float(info[0]))
+        return estado.se - se_predicho < self.umbral
+
+
+REGLAS = {
+    regla.nombre: regla
+    for regla in (ReglaTiempo, ReglaMaxItems, ReglaError, ReglaNivelExtremo, ReglaMeseta, ReglaReduccionPredicha)
+}
+
+
+def configuracion_por_defecto():
+    return {
+        "reglas": ["tiempo", "max_items", "error", "nivel_extremo"],
+        "min_items": getattr(settings, "DIAGNOSTICO_MIN_EJERCICIOS", 5),
+        "max_items": getattr(settings, "DIAGNOSTICO_MAX_EJERCICIOS", 30),
+        "umbral_se": getattr(settings, "DIAGNOSTICO_UMBRAL_SE", 0.4),
+        "umbral_extremo": getattr(settings, "DIAGNOSTICO_UMBRAL_EXTREMO", 2.9),
+    }
+
+
+class MotorParada:
+    """
+    Evalúa las reglas configuradas en orden y devuelve el motivo de la primera que se cumpla.
+    Mientras no se llegue a min_items solo cuentan las reglas que no respetan el mínimo (tiempo, máximo).
+    """
+
+    def __init__(self, configuracion):
+        self.min_items = int(configuracion.get("min_items", 0))
+        self.reglas = []
+        for nombre in configuracion.get("reglas", []):
+            try:
+                self.reglas.append(REGLAS[nombre](**configuracion))
+            except KeyError:
+                logger.warning("Regla de término desconocida: %s. Opciones: %s", nombre, ", ".join(REGLAS))
+
+    def evaluar(self, estado):
+        for regla in self.reglas:
+            if regla.respeta_minimo and estado.n_items < self.min_items:
+                continue
+            try:
+                if regla.evaluar(estado):
+                    return regla.motivo
+            except Exception:
+                logger.exception("Error evaluando la regla de término %s", regla.nombre)
+        return None
+
+
+_motores = {}
+_lock = threading.Lock()
+
+
+def motor_para_materia(materia_id=None):
+    # Motor de reglas de la materia (se arma una sola vez por proceso).
+    # settings.DIAGNOSTICO_PARADA = {"default": {...}, "<materia_id>": {...}}; cada nivel pisa al anterior.
+    clave = str(materia_id) if materia_id is not None else "default"
+    motor = _motores.get(clave)
+    if motor is not None:
+        return motor
+    configuracion = configuracion_por_defecto()
+    parada = getattr(settings, "DIAGNOSTICO_PARADA", None) or {}
+    configuracion.update(parada.get("default", {}))
+    if materia_id is not None:
+        configuracion.update(parada.get(clave, {}))
+    motor = MotorParada(configuracion)
+    with _lock:
+        _motores[clave] = motor
+    return motor
+
+
+def materia_del_diagnostico(diagnostico, indice=None):
+    # La materia del diagnóstico es la del primer ejercicio respondido (sale del índice, sin consultas)
+    from .banco_items import obtener_indice
+    ids = (diagnostico.respuestas or {}).get("ids") or []
+    if not ids:
+        return None
+    indice = indice if indice is not None else obtener_indice()
+    posiciones = indice.posiciones(ids[:1])
+    if not posiciones.size:
+        return None
+    return int(indice.materia_ids[posiciones[0]])
+
+
+def evaluar_parada(diagnostico, theta, se, indice=None):
+    """
+    Devuelve (finalizado, motivo) para el diagnóstico ya actualizado con la última respuesta.
+    """
+    try:
+        materia_id = materia_del_diagnostico(diagnostico, indice)
+    except Exception:
+        logger.exception("No se pudo determinar la materia del diagnóstico %s", diagnostico.pk)
+        materia_id = None
+    motivo = motor_para_materia(materia_id).evaluar(EstadoDiagnostico(diagnostico, theta, se, indice))
+    return motivo is not None, motivo or ""
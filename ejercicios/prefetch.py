@@ -0,0 +1,101 @@
+# Precalentamiento especulativo de contextos del diagnóstico.
+# Cuando se entrega un ejercicio, mientras el estudiante responde se eligen por adelantado los
+# siguientes ejercicios (uno para respuesta correcta y otro para incorrecta, con el mismo selector
+# IRT) y sus contextos se generan en un pool de threads. Cuando llega la respuesta, el contexto del siguiente
+# ejercicio ya suele estar en el cache (Api_LLMs/cache_contexto.py) y no se espera al LLM.
+# Los contextos que faltan se piden juntos en una sola llamada; el lock entre procesos es el del
+# single-flight de cache_contexto.
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from usage.services import llm_context
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+_lock = threading.Lock()
+_en_curso = set()  # claves que este proceso está generando
+
+
+def _obtener_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "PREFETCH_WORKERS", 4),
+                    thread_name_prefix="prefetch-contexto",
+                )
+    return _pool
+
+
+def _generar(ejercicio_ids, modo, carrera):
+    # Corre en un thread del pool: genera los contextos que falten (usa su propia conexión a la DB),
+    # todos en una sola llamada al LLM (cache_contexto.obtener_contextos)
+    from .models import Ejercicio
+    from .mixins import contextualize_exercise, contextualize_exercise_diagnostico
+    from .Api_LLMs.cache_contexto import buscar_contexto, clave_contexto, en_curso, obtener_contextos
+    from .Api_LLMs.request import contextualize_exercises
+    from .Api_LLMs.requestdiagnostico import contextualize_exercises_diagnostico
+
+    close_old_connections()
+    claves = []
+    try:
+        ejercicios = {e.pk: e for e in Ejercicio.objects.filter(pk__in=ejercicio_ids)}
+        pendientes = []
+        for ejercicio_id in ejercicio_ids:
+            ejercicio = ejercicios.get(ejercicio_id)
+            if ejercicio is None:
+                continue
+            clave = clave_contexto(ejercicio, modo, carrera)
+            with _lock:
+                if clave in _en_curso:
+                    continue
+                _en_curso.add(clave)
+            claves.append(clave)
+            # si un request ya lo está generando, no ocupar un thread del pool esperándolo
+            if en_curso(clave) or buscar_contexto(ejercicio, modo, carrera) is not None:
+                continue
+            pendientes.append(ejercicio)
+        if not pendientes:
+            return
+        if modo == "diagnostico":
+            generar_lote = contextualize_exercises_diagnostico
+            generar_uno = contextualize_exercise_diagnostico
+        else:
+            generar_lote = lambda lista: contextualize_exercises(lista, carrera)  # noqa: E731
+            generar_uno = lambda e: contextualize_exercise(e, carrera)  # noqa: E731
+        with llm_context(mode=modo):
+            obtener_contextos(pendientes, modo, carrera, generar_lote, generar_uno)
+        logger.debug("Contextos precalentados para ejercicios %s (%s)", [e.pk for e in pendientes], modo)
+    except Exception:
+        logger.exception("Error precalentando contextos de los ejercicios %s", ejercicio_ids)
+    finally:
+        with _lock:
+            _en_curso.difference_update(claves)
+        connection.close()
+
+
+def precalentar_siguientes(diagnostico, ejercicio):
+    """
+    Reserva los siguientes ejercicios del diagnóstico después de `ejercicio` (uno por resultado posible,
+    ver services.reservar_siguientes) y encola la generación de sus contextos. No bloquea: la elección
+    usa solo el índice en memoria y el LLM corre en el pool. Nunca lanza excepciones hacia la vista.
+    """
+    if not getattr(settings, "PREFETCH_CONTEXTOS", True) or not getattr(settings, "CONTEXTO_CACHE", True):
+        return []
+    try:
+        from .services import reservar_siguientes
+        ids = reservar_siguientes(diagnostico, ejercicio)
+        if ids:
+            _obtener_pool().submit(_generar, ids, "diagnostico", "")
+        return ids
+    except Exception:
+        logger.exception("No se pudo precalentar contextos para el diagnóstico %s", getattr(diagnostico, "pk", "?"))
+        return []
@@ -7,186 +7,418 @@
     # Si el código calcula, decide, filtra, transforma datos, sí va en services.py. 
 
 import logging
-from random import random
-
 import numpy as np
-from scipy.optimize import minimize
-from scipy.special import expit  # sigmoid numéricamente estable
+from django.conf import settings
+from django.core.cache import cache
 from django.db import transaction
 
 from accounts.models import Diagnostico
 from .models import Intento, Ejercicio
+from .banco_items import obtener_indice, invalidar_indice
+from .irt import obtener_modelo, nodos_cuadratura
+from .exposicion import registrar_exposicion, elegir_con_exposicion
+from .balanceo import candidatos_balanceados
 
 logger = logging.getLogger(__name__)
 
 
-def actualizar_diagnostico(estudiante):
-    # Estimar theta y su SE usando el modelo Rasch (1PL).
-    # Devuelve (theta_estimado, se).
-    # Implementación vectorizada, con bounds en [-3,3], manejo de fallos y logging.
-    
-    intentos_qs = Intento.objects.filter(estudiante=estudiante).select_related("ejercicio")
-    if not intentos_qs.exists():
-        return 0.0, 1.0  # theta neutro, error grande por defecto
+# Elección del siguiente ejercicio hecha por adelantado (reservar_siguientes)
+KEY_RESERVA = "diagnostico:{}:reserva:{}:{}"
+TTL_RESERVA = 3600
 
-    # Extraer datos en arrays vectorizados
-    b_list = []
-    y_list = []
-    for intento in intentos_qs:
-        b_list.append(float(intento.ejercicio.dificultad))
-        y_list.append(1 if intento.es_correcto else 0)
-    b_arr = np.array(b_list, dtype=float)
-    y_arr = np.array(y_list, dtype=float)
-
-    # función de log-verosimilitud (retorna valor positivo = LL)
-    def log_likelihood(theta_array):
-        theta = float(theta_array[0])
-        z = theta - b_arr
-        # estabilidad numérica: expit es la sigmoid estable
-        p = expit(z)  # valores en (0,1)
-        # evitar logs de 0 usando log/present functions
-        ll_terms = np.where(y_arr == 1, np.log(p), np.log1p(-p))  # log(p) o log(1-p)
-        return float(np.sum(ll_terms))
-
-    # como minimize() minimiza, minimizamos la negativa de la log-verosimilitud
-    def neg_log_like(theta_array):
-        return -log_likelihood(theta_array)
-
-    # limites para theta
-    bounds = [(-3.0, 3.0)]
-
-    # ejecutar optimización
-    try:
-        result = minimize(
-            fun=neg_log_like,
-            x0=[0.0],
-            method="L-BFGS-B",
-            bounds=bounds,
-            options={"maxiter": 200}
+# Límites de theta (coinciden con los validators de Diagnostico.theta)
+THETA_MIN = -3.0
+THETA_MAX = 3.0
+
+
+def respuestas_vacias():
+    # Vector de respuestas cacheado en Diagnostico.respuestas (formato columnar, listo para np.asarray)
+    # a y c son los parámetros de discriminación y adivinanza del ítem al momento de responder
+    # se es el historial del error estándar después de cada respuesta
+    return {"ids": [], "a": [], "b": [], "c": [], "y": [], "se": []}
+
+
+def _respuestas_desde_historial(estudiante):
+    # Reconstruye el vector de respuestas desde los Intentos del estudiante.
+    # Solo se usa una vez para diagnósticos que empezaron antes de existir el cache.
+    filas = (
+        Intento.objects.filter(estudiante=estudiante)
+        .order_by("fecha_intento", "pk")
+        .values_list(
+            "ejercicio_id", "ejercicio__discriminacion", "ejercicio__dificultad",
+            "ejercicio__adivinanza", "es_correcto"
         )
+    )
+    respuestas = respuestas_vacias()
+    for ejercicio_id, discriminacion, dificultad, adivinanza, es_correcto in filas:
+        _agregar_respuesta(respuestas, ejercicio_id, discriminacion, dificultad, adivinanza, es_correcto)
+    return respuestas
+
+
+def _agregar_respuesta(respuestas, ejercicio_id, discriminacion, dificultad, adivinanza, es_correcto):
+    n_previas = len(respuestas["ids"])
+    # diagnósticos guardados antes del soporte 2PL/3PL no traen a ni c
+    respuestas.setdefault("a", [1.0] * n_previas)
+    respuestas.setdefault("c", [0.0] * n_previas)
+    respuestas["ids"].append(ejercicio_id)
+    respuestas["a"].append(float(discriminacion))
+    respuestas["b"].append(float(dificultad))
+    respuestas["c"].append(float(adivinanza or 0.0))
+    respuestas["y"].append(1 if es_correcto else 0)
+
+
+def arrays_respuestas(respuestas):
+    # (a, b, c, y) como arrays de NumPy
+    n = len(respuestas["ids"])
+    a_arr = np.asarray(respuestas.get("a") or [1.0] * n, dtype=float)
+    b_arr = np.asarray(respuestas["b"], dtype=float)
+    c_arr = np.asarray(respuestas.get("c") or [0.0] * n, dtype=float)
+    y_arr = np.asarray(respuestas["y"], dtype=float)
+    return a_arr, b_arr, c_arr, y_arr
+
+
+def estimar_theta_newton(theta0, a_arr, b_arr, c_arr, y_arr, modelo=None, max_iter=20, tol=1e-4, paso_max=1.0):
+    # Newton-Raphson (Fisher scoring) para el MLE de theta, partiendo de theta0 (warm start).
+    # Bajo 1PL/2PL la log-verosimilitud es cóncava, así que basta con amortiguar el paso y respetar los bounds.
+    # Devuelve (theta, informacion_total_en_theta).
+    modelo = modelo or obtener_modelo()
+    theta = float(np.clip(theta0, THETA_MIN, THETA_MAX))
+    for _ in range(max_iter):
+        score, info_total = modelo.score_e_informacion(theta, y_arr, a_arr, b_arr, c_arr)
+        if info_total <= 1e-12:
+            break
+        paso = float(np.clip(score / info_total, -paso_max, paso_max))
+        theta_nuevo = float(np.clip(theta + paso, THETA_MIN, THETA_MAX))
+        if abs(theta_nuevo - theta) < tol:
+            theta = theta_nuevo
+            break
+        theta = theta_nuevo
+    # información en el theta final (la del loop corresponde al paso anterior)
+    info_total = float(np.sum(modelo.informacion(theta, a_arr, b_arr, c_arr)))
+    return theta, info_total
+
+
+def _nodos_posterior():
+    return nodos_cuadratura(getattr(settings, "IRT_NODOS_CUADRATURA", 61))
+
+
+def _normalizar_log(log_pesos):
+    # Resta el logsumexp para que los log-pesos no se vayan acumulando hacia -inf
+    maximo = np.max(log_pesos)
+    return log_pesos - (maximo + np.log(np.sum(np.exp(log_pesos - maximo))))
+
+
+def posterior_desde_respuestas(respuestas, modelo=None):
+    # Log-posterior en los nodos de cuadratura: log prior N(0, 1) + log-verosimilitud de todas las respuestas
+    modelo = modelo or obtener_modelo()
+    nodos, log_prior = _nodos_posterior()
+    a_arr, b_arr, c_arr, y_arr = arrays_respuestas(respuestas)
+    if len(y_arr) == 0:
+        return _normalizar_log(log_prior)
+    return _normalizar_log(log_prior + modelo.log_verosimilitud(nodos[:, None], y_arr, a_arr, b_arr, c_arr))
+
+
+def actualizar_posterior(log_posterior, a, b, c, y, modelo=None):
+    # Suma la log-verosimilitud de una respuesta en todos los nodos (una sola operación vectorizada)
+    modelo = modelo or obtener_modelo()
+    nodos, _ = _nodos_posterior()
+    return _normalizar_log(log_posterior + modelo.log_verosimilitud(nodos[:, None], [y], [a], [b], [c]))
+
+
+def estimar_theta_eap(log_posterior):
+    # EAP: media y desviación estándar de la posterior. Devuelve (theta, se).
+    nodos, _ = _nodos_posterior()
+    pesos = np.exp(log_posterior - np.max(log_posterior))
+    pesos /= pesos.sum()
+    media = float(pesos @ nodos)
+    return media, float(np.sqrt(pesos @ (nodos - media) ** 2))
+
+
+def estimar_theta_map(log_posterior):
+    # MAP: nodo de mayor posterior refinado con la parábola por él y sus vecinos;
+    # el SE sale de la curvatura de esa parábola (-1 / segunda derivada). Devuelve (theta, se).
+    nodos, _ = _nodos_posterior()
+    k = int(np.argmax(log_posterior))
+    if 0 < k < len(nodos) - 1:
+        c2, c1, _ = np.polyfit(nodos[k - 1:k + 2], log_posterior[k - 1:k + 2], 2)
+        if c2 < 0:
+            return float(-c1 / (2.0 * c2)), float(1.0 / np.sqrt(-2.0 * c2))
+    # máximo en un extremo o parábola degenerada: nodo y SD de la posterior
+    return float(nodos[k]), estimar_theta_eap(log_posterior)[1]
+
+
+def _estimar_mle(estudiante_id, diagnostico, respuestas):
+    # MLE con Newton-Raphson (IRT_ESTIMADOR = "MLE"), con las protecciones de siempre para el SE
+    a_arr, b_arr, c_arr, y_arr = arrays_respuestas(respuestas)
+    try:
+        theta_estimado, info_total = estimar_theta_newton(diagnostico.theta or 0.0, a_arr, b_arr, c_arr, y_arr)
     except Exception as e:
-        logger.exception("Error durante la optimización de theta para estudiante %s: %s", getattr(estudiante, 'pk', '?'), e)
+        logger.exception("Error durante la estimación de theta para estudiante %s: %s", estudiante_id, e)
         # fallback seguro
-        theta_estimado = 0.0
+        theta_estimado, info_total = 0.0, None
+
+    # Calcular SE a partir de la información total (Fisher) del modelo: SE = 1/sqrt(I)
+    if info_total is None:
         se = 1.0
-        # guardar y salir
-        with transaction.atomic():
-            Diagnostico.objects.update_or_create(
-                estudiante=estudiante,
-                defaults={"theta": theta_estimado, "error_estimacion": se}
-            )
-        return theta_estimado, se
+    elif info_total < 0.1:
+        logger.warning(f"Poca información para estudiante {estudiante_id}: info_total={info_total}")
+        theta_estimado = 0.0 #neutral
+        se = 1.5 #error alto por falta de información
+    else:
+        se = 1.0 / np.sqrt(info_total)
+        # protecciones estándares para SE no pregunten por qué, asi está la documentacion en varios sitios 
+        se = float(np.clip(se, 0.2, 2.0))
+    return theta_estimado, se
+
+
+def _estimar_bayes(diagnostico, respuestas, estimador, recien_agregada):
+    # EAP / MAP sobre la log-posterior guardada en el diagnóstico.
+    # Si la posterior ya incluye todas las respuestas menos la recién agregada, basta con sumarle esa;
+    # si no (diagnóstico antiguo, cambio de nodos o de modelo) se reconstruye desde el vector de respuestas.
+    modelo = obtener_modelo()
+    nodos, _ = _nodos_posterior()
+    guardada = diagnostico.log_posterior or {}
+    log_pesos = guardada.get("log_pesos") or []
+    n = len(respuestas["ids"])
+    compatible = len(log_pesos) == len(nodos) and guardada.get("modelo") == modelo.nombre
+    if compatible and recien_agregada and guardada.get("n") == n - 1:
+        log_posterior = actualizar_posterior(
+            np.asarray(log_pesos, dtype=float), respuestas["a"][-1], respuestas["b"][-1],
+            respuestas["c"][-1], respuestas["y"][-1], modelo
+        )
+    elif compatible and guardada.get("n") == n:
+        log_posterior = np.asarray(log_pesos, dtype=float)
+    else:
+        log_posterior = posterior_desde_respuestas(respuestas, modelo)
+
+    if estimador == "MAP":
+        theta_estimado, se = estimar_theta_map(log_posterior)
+    else:
+        theta_estimado, se = estimar_theta_eap(log_posterior)
+    diagnostico.log_posterior = {"n": n, "modelo": modelo.nombre, "log_pesos": log_posterior.tolist()}
+    theta_estimado = float(np.clip(theta_estimado, THETA_MIN, THETA_MAX))
+    # error_estimacion admite hasta 2.0
+    return theta_estimado, float(min(se, 2.0))
 
-    # comprobar éxito de la optimización
-    if not getattr(result, "success", False):
-        logger.warning("Optimización no convergió para estudiante %s: message=%s, fun=%s", getattr(estudiante, 'pk', '?'), getattr(result, "message", ""), getattr(result, "fun", None))
-        # fallback razonable: usar x0 o el mejor valor encontrado
+
+def estimar_diagnostico(diagnostico, respuestas, recien_agregada=False):
+    """
+    Estima theta y SE con settings.IRT_ESTIMADOR y deja theta, error_estimacion, respuestas
+    (y log_posterior) actualizados en el objeto, sin guardarlo. Devuelve los campos modificados.
+    No toca la DB, así que también sirve para simular diagnósticos (simular_cat).
+    """
+    estudiante_id = getattr(diagnostico, "estudiante_id", None)
+    estimador = str(getattr(settings, "IRT_ESTIMADOR", "EAP")).upper()
+    campos = ["theta", "error_estimacion", "respuestas"]
+    if estimador in ("EAP", "MAP"):
         try:
-            theta_candidate = float(result.x[0])
-        except Exception:
-            theta_candidate = 0.0
+            theta_estimado, se = _estimar_bayes(diagnostico, respuestas, estimador, recien_agregada)
+            campos.append("log_posterior")
+        except Exception as e:
+            logger.exception("Error durante la estimación de theta para estudiante %s: %s", estudiante_id, e)
+            theta_estimado, se = 0.0, 1.0
     else:
-        theta_candidate = float(result.x[0])
+        theta_estimado, se = _estimar_mle(estudiante_id, diagnostico, respuestas)
 
-    # asegurar rango final
-    theta_estimado = float(np.clip(theta_candidate, -3.0, 3.0))
+    # historial de SE (una entrada por actualización), lo usan las reglas de término (parada.py)
+    respuestas.setdefault("se", []).append(float(se))
 
-    # Calcular información total (Fisher) para 1PL: sum p(1-p)
-    try:
-        z_final = theta_estimado - b_arr
-        p_final = expit(z_final)
-        info_terms = p_final * (1.0 - p_final)  # a=1 en 1PL
-        info_total = float(np.sum(info_terms))
-
-        if info_total < 0.1:
-            logger.warning(f"Poca información para estudiante {estudiante.pk}: info_total={info_total}")
-            theta_estimado = 0.0 #neutral
-            se = 1.5 #error alto por falta de información
-            
-        # si info_total es 0 o muy pequeño, evitar dividir por 0
-        elif info_total <= 0 or np.isclose(info_total, 0.0):
-            logger.warning("Información total muy pequeña (<=0) para estudiante %s: info_total=%s, n_items=%d", getattr(estudiante, 'pk', '?'), info_total, len(b_arr))
-            se = 1.0
-        else:
-            se = 1.0 / np.sqrt(info_total)
-            # protecciones estándares para SE no pregunten por qué, asi está la documentacion en varios sitios 
-            se = float(np.clip(se, 0.2, 2.0))
-    except Exception as e:
-        logger.exception("Error calculando SE para estudiante %s: %s", getattr(estudiante, 'pk', '?'), e)
-        se = 1.0
+    diagnostico.theta = theta_estimado
+    diagnostico.error_estimacion = se
+    diagnostico.respuestas = respuestas
+    return campos
+
+
+def actualizar_diagnostico(estudiante, intento=None, diagnostico=None):
+    # Estimar theta y su SE usando el modelo IRT configurado (settings.IRT_MODELO) y el
+    # estimador de settings.IRT_ESTIMADOR: EAP (por defecto), MAP o MLE. Devuelve (theta_estimado, se).
+    # Incremental: el vector de respuestas (a, b, c, y) vive en Diagnostico.respuestas y la log-posterior
+    # en Diagnostico.log_posterior, así que cada envío solo agrega el intento nuevo (una multiplicación
+    # vectorizada sobre los nodos para EAP/MAP, unos pasos de Newton desde el theta anterior para MLE).
+    # EAP/MAP no se escapan a ±3 con patrones todo bueno / todo malo como el MLE, la prior los acota.
+    # Quien pasa `diagnostico` debe tenerlo bloqueado (select_for_update) en su transacción.
+    if diagnostico is None:
+        # como antes (update_or_create): si el estudiante no tiene Diagnostico se crea con la estimación
+        with transaction.atomic():
+            diagnostico, _ = Diagnostico.objects.select_for_update().get_or_create(
+                estudiante=estudiante, defaults={"theta": 0.0, "error_estimacion": 1.0},
+            )
+            return actualizar_diagnostico(estudiante, intento=intento, diagnostico=diagnostico)
+
+    respuestas = diagnostico.respuestas or {}
+    recien_agregada = False
+    if not respuestas.get("ids"):
+        # Sin cache todavía: sembrar desde el historial (ya incluye el intento recién creado)
+        respuestas = _respuestas_desde_historial(estudiante)
+    elif intento is not None:
+        ejercicio = intento.ejercicio
+        _agregar_respuesta(
+            respuestas, intento.ejercicio_id, ejercicio.discriminacion, ejercicio.dificultad,
+            ejercicio.adivinanza, intento.es_correcto
+        )
+        recien_agregada = True
+
+    if not respuestas["ids"]:
+        return 0.0, 1.0  # theta neutro, error grande por defecto
+
+    campos = estimar_diagnostico(diagnostico, respuestas, recien_agregada)
+    theta_estimado, se = diagnostico.theta, diagnostico.error_estimacion
 
     # guardar en DB
     try:
         with transaction.atomic():
-            Diagnostico.objects.update_or_create(
-                estudiante=estudiante,
-                defaults={"theta": theta_estimado, "error_estimacion": se}
-            )
+            diagnostico.save(update_fields=campos)
     except Exception as e:
         logger.exception("No se pudo guardar Diagnostico para estudiante %s: %s", getattr(estudiante, 'pk', '?'), e)
 
     return theta_estimado, se
 
 
-def seleccionar_siguiente_ejercicio(estudiante):
+def _ids_respondidos(estudiante, diagnostico_activo=None):
+    # Durante el diagnóstico los ids ya están cacheados en Diagnostico.respuestas; en modo normal
+    # se excluye todo el historial de Intento del estudiante (práctica incluida)
+    if diagnostico_activo is not None and (diagnostico_activo.respuestas or {}).get("ids"):
+        return diagnostico_activo.respuestas["ids"]
+    return list(Intento.objects.filter(estudiante=estudiante).values_list("ejercicio_id", flat=True))
+
+
+def elegir_siguiente(indice, theta, ids_respondidos, rng=None):
+    # (id del siguiente ítem, ids considerados por el control de exposición) según la configuración
+    # (balanceo de contenido, control de exposición), o (None, []) si no quedan. Solo usa el índice
+    # en memoria, sin DB.
+    excluidos = indice.mascara_excluidos(ids_respondidos)
+    exposicion = getattr(settings, "EXPOSICION_CONTROL", True)
+    k = getattr(settings, "EXPOSICION_TOP_K", 5) if exposicion else 1
+    # Sympson-Hetter sigue con los siguientes candidatos si rechaza a los K mejores
+    n = max(k, getattr(settings, "EXPOSICION_CANDIDATOS", 20)) if exposicion else 1
+    if getattr(settings, "CAT_BALANCEO_CONTENIDO", True):
+        posiciones = candidatos_balanceados(indice, theta, excluidos, n)
+    elif exposicion:
+        posiciones, _ = indice.candidatos(theta, excluidos, n)
+    else:
+        return indice.seleccionar_maxima_informacion(theta, excluidos, rng=rng), []
+    if not len(posiciones):
+        return None, []
+    if exposicion:
+        # randomesque + Sympson-Hetter, de a K candidatos (ver exposicion.py)
+        return elegir_con_exposicion(indice.ids[posiciones], rng=rng, bloque=k)
+    return int(indice.ids[posiciones[0]]), []
+
+
+def _clave_reserva(diagnostico_id, n_respuestas, y):
+    return KEY_RESERVA.format(diagnostico_id, n_respuestas, y)
+
+
+def reservar_siguientes(diagnostico, ejercicio, indice=None):
+    """
+    Elige por adelantado el ejercicio que seguiría a `ejercicio` (el que el estudiante está respondiendo)
+    para ambos resultados: suma la respuesta correcta / incorrecta a la log-posterior, estima theta y
+    corre el mismo selector (balanceo + exposición incluidos). La elección queda reservada en el cache
+    y seleccionar_siguiente_ejercicio la usa si llega ese resultado, así el contexto que se precalienta
+    (prefetch.py) es justo el que se va a servir. También guarda los ítems que consideró el control de
+    exposición, que se cuentan recién si la reserva se sirve. Devuelve los ids reservados.
+    """
+    if diagnostico.finalizado:
+        return []
+    indice = indice if indice is not None else obtener_indice()
+    respuestas = diagnostico.respuestas or {}
+    n = len(respuestas.get("ids") or [])
+    modelo = obtener_modelo()
+    nodos, _ = _nodos_posterior()
+    guardada = diagnostico.log_posterior or {}
+    log_pesos = guardada.get("log_pesos") or []
+    if len(log_pesos) == len(nodos) and guardada.get("n") == n and guardada.get("modelo") == modelo.nombre:
+        log_posterior = np.asarray(log_pesos, dtype=float)
+    else:
+        log_posterior = posterior_desde_respuestas(respuestas if n else respuestas_vacias(), modelo)
+
+    # con MLE se aproxima con el EAP
+    estimar = estimar_theta_map if str(getattr(settings, "IRT_ESTIMADOR", "EAP")).upper() == "MAP" else estimar_theta_eap
+    ids_respondidos = list(respuestas.get("ids") or []) + [ejercicio.pk]
+    reservados = []
+    for y in (1, 0):
+        posterior = actualizar_posterior(
+            log_posterior, ejercicio.discriminacion, ejercicio.dificultad, ejercicio.adivinanza, y, modelo
+        )
+        theta = float(np.clip(estimar(posterior)[0], THETA_MIN, THETA_MAX))
+        siguiente, considerados = elegir_siguiente(indice, theta, ids_respondidos)
+        if siguiente is None:
+            continue
+        cache.set(_clave_reserva(diagnostico.pk, n + 1, y), (siguiente, considerados), timeout=TTL_RESERVA)
+        if siguiente not in reservados:
+            reservados.append(siguiente)
+    return reservados
+
+
+def _reserva(diagnostico):
+    # (id, considerados) reservado por reservar_siguientes para el resultado de la última respuesta
+    respuestas = diagnostico.respuestas or {}
+    ids = respuestas.get("ids") or []
+    if diagnostico.pk is None or diagnostico.finalizado or not ids or not respuestas.get("y"):
+        return None
+    reservado = cache.get(_clave_reserva(diagnostico.pk, len(ids), respuestas["y"][-1]))
+    if not isinstance(reservado, (tuple, list)) or reservado[0] in ids:
+        return None
+    return reservado
+
+
+def liberar_reservas(diagnostico):
+    # Al finalizar el diagnóstico sus reservas no deben servir para nada más
+    n = len((diagnostico.respuestas or {}).get("ids") or [])
+    cache.delete_many([_clave_reserva(diagnostico.pk, m, y) for m in (n, n + 1) for y in (0, 1)])
+
+
+def seleccionar_siguiente_ejercicio(estudiante, diagnostico=None):
     """
-    Selecciona el siguiente ejercicio basado en máxima información bajo 1PL:
-    I_i(theta) = P(1-P) con P = sigmoid(theta - b).
-    Implementación vectorizada que excluye ejercicios previamente respondidos.
+    Selecciona el siguiente ejercicio basado en máxima información de Fisher bajo el modelo
+    IRT configurado (1PL: I = P(1-P); 2PL: a^2 P(1-P); 3PL con adivinanza, ver irt.py).
+    Usa el índice en memoria del banco (banco_items): tabla de información precalculada más un
+    bitmap de ejercicios ya respondidos, sin materializar el queryset completo.
+    Con CAT_BALANCEO_CONTENIDO la información se pondera contra las cuotas de materia, unidad y
+    tipo del blueprint (balanceo.py).
+    Con EXPOSICION_CONTROL se elige entre los K mejores según su exposición (exposicion.py).
     """
+    # Solo un diagnóstico pasado explícitamente y en curso aporta sus ids y reservas; en modo normal
+    # el diagnóstico del estudiante solo da el theta
+    activo = diagnostico if diagnostico is not None and not diagnostico.finalizado else None
     theta = 0.0
     try:
-        if hasattr(estudiante, "diagnostico") and estudiante.diagnostico:
-            theta = float(estudiante.diagnostico.theta)
+        if diagnostico is None and hasattr(estudiante, "diagnostico"):
+            diagnostico = estudiante.diagnostico
+        if diagnostico is not None:
+            theta = float(diagnostico.theta)
     except Exception:
         # fallback
         theta = 0.0
 
     # evitar repetir items
-    intentos_previos = Intento.objects.filter(estudiante=estudiante)
-    ids_respondidos = intentos_previos.values_list("ejercicio_id", flat=True)
+    ids_respondidos = _ids_respondidos(estudiante, activo)
 
-    disponibles_qs = Ejercicio.objects.exclude(id__in=ids_respondidos)
+    try:
+        reservado = _reserva(activo) if activo is not None else None
+        if reservado is not None:
+            mejor_id, considerados = reservado
+        else:
+            mejor_id, considerados = elegir_siguiente(obtener_indice(), theta, ids_respondidos)
+    except Exception as e:
+        logger.exception("Error seleccionando siguiente ejercicio para estudiante %s: %s", getattr(estudiante, 'pk', '?'), e)
+        return Ejercicio.objects.exclude(id__in=ids_respondidos).order_by("?").first()
 
     # Si no hay disponibles, retornar aleatorio (o None)
-    if not disponibles_qs.exists():
+    if mejor_id is None:
         return Ejercicio.objects.order_by("?").first()
 
-    # Extraer arrays de ids y b
-    # Materializar queryset para indexar después
-    disponibles = list(disponibles_qs)
-    ids = [item.id for item in disponibles] # ojo aquí
-    b_arr = np.array([float(item.dificultad) for item in disponibles], dtype=float)
-
-    # calcular probabilidad e información vectorialmente
-    z = theta - b_arr
-    p = expit(z)
-    info_arr = p * (1.0 - p)  # 1PL: a=1
-
-    # elegir el índice con máxima información
-    try: 
-        max_info = float(np.max(info_arr))
-        candidates = np.where(np.isclose(info_arr, max_info, atol=1e-12))[0]
-        if len(candidates) > 1:
-            logger.info("Múltiples candidatos con info máxima para estudiante %s: theta=%.4f, max_info=%.6f, n_candidates=%d", getattr(estudiante, 'pk', '?'), theta, max_info, len(candidates))
-            max_idx = int(np.random.choice(candidates))
-        else: 
-            max_idx = int(np.argmax(info_arr))
-    except Exception as e:
-        logger.exception("Error seleccionando siguiente ejercicio para estudiante %s: %s", getattr(estudiante, 'pk', '?'), e)
-        return random.choice(disponibles)
-    
-    mejor_item = disponibles[max_idx]
-    if mejor_item.id in ids_respondidos:
-        logger.error("Error lógico: se seleccionó un ejercicio ya respondido para estudiante %s: ejercicio_id=%s", getattr(estudiante, 'pk', '?'), mejor_item.id)
-        for item in disponibles:
-            if item.id not in ids_respondidos:
-                logger.info("Seleccionando ejercicio no respondido alternativo para estudiante %s: ejercicio_id=%s", getattr(estudiante, 'pk', '?'), item.id)
-                return item
-            else:
-                mejor_item = random.choice(disponibles)
-                logger.info("Seleccionando ejercicio aleatorio para estudiante %s: ejercicio_id=%s", getattr(estudiante, 'pk', '?'), mejor_item.id)
-    return mejor_item
+    try:
+        ejercicio = Ejercicio.objects.get(pk=mejor_id)
+    except Ejercicio.DoesNotExist:
+        # el índice quedó desfasado (borrado en otro proceso): recargar y caer a aleatorio
+        logger.warning("Ejercicio %s del índice ya no existe; invalidando índice", mejor_id)
+        invalidar_indice()
+        return Ejercicio.objects.exclude(id__in=ids_respondidos).order_by("?").first()
+    if activo is not None:
+        # la tasa de exposición es por diagnóstico: la práctica normal no cuenta
+        registrar_exposicion(ejercicio.id, considerados)
+    return ejercicio
 
 
 # Vale hice una prueba con el nuevo modelo y me dio un theta de 3, lo que significaría irrealistamente un 7, o todo bueno, lo que no es verdad pues varias veces me equivoqué a propósito
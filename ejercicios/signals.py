@@ -0,0 +1,50 @@
+# ejercicios/signals.py
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from .models import Ejercicio
+from .banco_items import actualizar_item_en_indice, quitar_item_de_indice, invalidar_indice
+from .Api_LLMs.cache_contexto import invalidar_contextos
+
+
+# Cualquier alta/cambio/baja de ejercicios actualiza el índice en memoria del banco
+# (incremental en este proceso; los demás workers lo recargan al ver la versión nueva).
+# Recién después del commit: antes otro worker podía recargar viendo las filas sin el cambio y
+# quedarse con la versión nueva, y un rollback dejaba el ítem fantasma en el índice de este proceso
+@receiver(post_save, sender=Ejercicio)
+def actualizar_banco_al_guardar(sender, instance, **kwargs):
+    transaction.on_commit(lambda: actualizar_item_en_indice(instance))
+
+
+@receiver(post_delete, sender=Ejercicio)
+def actualizar_banco_al_borrar(sender, instance, **kwargs):
+    ejercicio_id = instance.pk
+    transaction.on_commit(lambda: quitar_item_de_indice(ejercicio_id))
+
+
+# Los tipos de ejercicio se guardan después del post_save (M2M), así que también se escuchan
+@receiver(m2m_changed, sender=Ejercicio.tipo_ejercicio.through)
+def actualizar_banco_al_cambiar_tipos(sender, instance, action, reverse, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if reverse:
+        # cambio desde el lado de TipoEjercicio: afecta a varios ejercicios
+        transaction.on_commit(invalidar_indice)
+    else:
+        transaction.on_commit(lambda: actualizar_item_en_indice(instance))
+
+
+# Si cambia el enunciado, los contextos generados para el ejercicio ya no sirven
+@receiver(pre_save, sender=Ejercicio)
+def detectar_cambio_enunciado(sender, instance, update_fields=None, **kwargs):
+    instance._enunciado_cambio = False
+    if instance.pk is None or (update_fields is not None and "enunciado" not in update_fields):
+        return
+    anterior = sender.objects.filter(pk=instance.pk).values_list("enunciado", flat=True).first()
+    instance._enunciado_cambio = anterior is not None and anterior != instance.enunciado
+
+
+@receiver(post_save, sender=Ejercicio)
+def invalidar_contextos_al_cambiar_enunciado(sender, instance, created, **kwargs):
+    if not created and getattr(instance, "_enunciado_cambio", False):
+        invalidar_contextos(instance.pk)
@@ -0,0 +1,253 @@
+# Cola de generación de feedback IA respaldada en la DB (TareaFeedback).
+# Antes EjercicioView.post y DiagnosticTestView.post llamaban al LLM dentro de @transaction.atomic:
+# la transacción y el worker del servidor quedaban tomados varios segundos por envío.
+# Ahora el submit solo crea la tarea (en la misma transacción que el Intento) y responde;
+# el feedback lo genera un worker:
+#   - `python manage.py procesar_feedback` (proceso aparte, recomendado en producción)
+#   - y/o un pool de threads del mismo proceso web que se despierta al hacer commit
+#     (settings.FEEDBACK_WORKER_EN_PROCESO, útil en desarrollo)
+# Las tareas se toman con un UPDATE condicional, así varios workers pueden convivir sin
+# procesar dos veces la misma. CheckAnswer consulta estado_feedback() hasta que el Feedback exista.
+# Con FEEDBACK_STREAMING la tarea nace con unos segundos de gracia (FEEDBACK_STREAM_GRACIA) para que
+# CheckAnswerStream la tome con tomar_tarea_de() y genere el feedback en streaming (SSE); si el
+# estudiante no abre la página, el worker la procesa igual cuando se cumple la gracia.
+# Si otro intento ya tuvo el mismo error (memo_feedback.py) el Feedback se copia y no se llama al LLM.
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from usage.services import llm_context
+
+from .models import Feedback, TareaFeedback
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _obtener_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "FEEDBACK_WORKERS", 2),
+                    thread_name_prefix="feedback-ia",
+                )
+    return _pool
+
+
+def payload_feedback(ejercicio, respuesta_estudiante, pasos):
+    # Lo que necesita call_my_ai_service; se guarda en la tarea para no depender del request
+    return {
+        "enunciado": ejercicio.enunciado,
+        "respuesta_estudiante": respuesta_estudiante,
+        "solucion": ejercicio.solucion,
+        "pasos": pasos,
+    }
+
+
+def encolar_feedback(intento, payload):
+    """
+    Crea la tarea de feedback del intento. Se llama dentro de la transacción del submit;
+    el worker en proceso (si está activo) se despierta recién cuando esa transacción hace commit.
+    Si el mismo error ya tiene feedback se copia ahí mismo y no se crea tarea (devuelve None).
+    """
+    from .memo_feedback import reutilizar_feedback
+
+    if reutilizar_feedback(intento, payload):
+        return None
+    gracia = _gracia_streaming()
+    tarea, _ = TareaFeedback.objects.get_or_create(
+        intento=intento,
+        defaults={"payload": payload, "disponible_desde": timezone.now() + timedelta(seconds=gracia)},
+    )
+    if getattr(settings, "FEEDBACK_WORKER_EN_PROCESO", True):
+        if gracia:
+            transaction.on_commit(lambda: _despertar_worker_en(gracia))
+        else:
+            transaction.on_commit(_despertar_worker)
+    return tarea
+
+
+def _gracia_streaming():
+    if not getattr(settings, "FEEDBACK_STREAMING", False):
+        return 0
+    return getattr(settings, "FEEDBACK_STREAM_GRACIA", 15)
+
+
+def _despertar_worker_en(segundos):
+    timer = threading.Timer(segundos, _despertar_worker)
+    timer.daemon = True
+    timer.start()
+
+
+def _despertar_worker():
+    try:
+        _obtener_pool().submit(_procesar_en_thread)
+    except RuntimeError:
+        # el pool ya se cerró (apagado del proceso); queda para el comando procesar_feedback
+        logger.warning("No se pudo despertar el worker de feedback en proceso")
+
+
+def _procesar_en_thread():
+    close_old_connections()
+    try:
+        procesar_pendientes(limite=getattr(settings, "FEEDBACK_LOTE", 10))
+    except Exception:
+        logger.exception("Error en el worker de feedback en proceso")
+    finally:
+        connection.close()
+
+
+def tomar_tarea():
+    """
+    Toma la próxima tarea disponible (pendiente y fuera de backoff, o en proceso hace más de
+    FEEDBACK_TAREA_TIMEOUT segundos: el worker que la tenía murió) y la marca en proceso.
+    Devuelve None si no hay nada que hacer.
+    """
+    ahora = timezone.now()
+    vencidas = ahora - timedelta(seconds=getattr(settings, "FEEDBACK_TAREA_TIMEOUT", 300))
+    disponibles = (
+        TareaFeedback.objects
+        .filter(
+            Q(estado=TareaFeedback.PENDIENTE, disponible_desde__lte=ahora)
+            | Q(estado=TareaFeedback.EN_PROCESO, tomada_en__lt=vencidas)
+        )
+        .order_by("disponible_desde")
+        .values_list("pk", "estado", "intentos")
+    )
+    for pk, estado, intentos in disponibles[:20]:
+        # UPDATE condicional: si otro worker la tomó entre el SELECT y acá, no se actualiza nada
+        tomada = TareaFeedback.objects.filter(pk=pk, estado=estado, intentos=intentos).update(
+            estado=TareaFeedback.EN_PROCESO, tomada_en=ahora, intentos=F("intentos") + 1, actualizada=ahora,
+        )
+        if tomada:
+            return TareaFeedback.objects.select_related("intento").get(pk=pk)
+    return None
+
+
+def tomar_tarea_de(intento):
+    """
+    Toma la tarea de un intento puntual para generarla en streaming, sin esperar la gracia
+    (disponible_desde). Solo si está pendiente y en su primer intento: si ya falló una vez, los
+    reintentos con backoff quedan para el worker. Devuelve None si otro la tiene o no existe.
+    """
+    ahora = timezone.now()
+    tomada = TareaFeedback.objects.filter(intento=intento, estado=TareaFeedback.PENDIENTE, intentos=0).update(
+        estado=TareaFeedback.EN_PROCESO, tomada_en=ahora, intentos=F("intentos") + 1, actualizada=ahora,
+    )
+    if tomada:
+        return TareaFeedback.objects.select_related("intento").get(intento=intento)
+    return None
+
+
+def _backoff(intentos):
+    base = getattr(settings, "FEEDBACK_BACKOFF", 10)
+    return timedelta(seconds=base * 2 ** max(intentos - 1, 0))
+
+
+def resolver_sin_llm(tarea):
+    """
+    Cierra una tarea ya tomada sin llamar al LLM si el intento ya tiene Feedback o si otro intento
+    con el mismo error terminó mientras esta esperaba (memo_feedback). True si quedó resuelta.
+    """
+    from .memo_feedback import reutilizar_feedback
+
+    with transaction.atomic():
+        if not (Feedback.objects.filter(intento_id=tarea.intento_id).exists()
+                or reutilizar_feedback(tarea.intento, tarea.payload, contar_fallo=tarea.intentos <= 1)):
+            return False
+        TareaFeedback.objects.filter(pk=tarea.pk).update(estado=TareaFeedback.COMPLETADA, error="", actualizada=timezone.now())
+    return True
+
+
+def procesar_tarea(tarea):
+    """
+    Llama al LLM (fuera de cualquier transacción) y guarda el Feedback. Si el LLM falla se
+    reintenta con backoff; en el último intento se guarda el texto de respaldo para que el
+    estudiante no quede esperando para siempre. Devuelve el estado final de la tarea.
+    """
+    from .Api_LLMs.requestfeedback import call_my_ai_service
+
+    if resolver_sin_llm(tarea):
+        return TareaFeedback.COMPLETADA
+    try:
+        # un solo intento por llamada: los reintentos los maneja la cola, sin sleeps en el worker
+        with llm_context(user_id=tarea.intento.estudiante.user_id, mode="feedback"):
+            ai_result = call_my_ai_service(tarea.payload, max_retries=1)
+        error = "" if ai_result and not ai_result.get("fallback") else "El LLM no devolvió feedback válido"
+    except Exception as e:
+        logger.exception("Error llamando IA para intento %s: %s", tarea.intento_id, str(e))
+        ai_result, error = None, str(e)
+    return finalizar_tarea(tarea, ai_result, error)
+
+
+def finalizar_tarea(tarea, ai_result, error=""):
+    """
+    Guarda el resultado del LLM de una tarea ya tomada (worker o streaming): reprograma con
+    backoff si hubo error y quedan intentos, si no crea el Feedback y cierra la tarea.
+    """
+    from .ia_feedback import save_ai_feedback_intento
+    from .memo_feedback import clave_feedback, recordar
+
+    max_intentos = getattr(settings, "FEEDBACK_MAX_INTENTOS", 3)
+    if error and tarea.intentos < max_intentos:
+        TareaFeedback.objects.filter(pk=tarea.pk).update(
+            estado=TareaFeedback.PENDIENTE, error=error[:2000],
+            disponible_desde=timezone.now() + _backoff(tarea.intentos), actualizada=timezone.now(),
+        )
+        return TareaFeedback.PENDIENTE
+
+    estado = TareaFeedback.FALLIDA if error else TareaFeedback.COMPLETADA
+    with transaction.atomic():
+        if ai_result and not Feedback.objects.filter(intento_id=tarea.intento_id).exists():
+            # solo el feedback real del LLM sirve de plantilla, no el texto de respaldo
+            fb = save_ai_feedback_intento(
+                intento=tarea.intento,
+                contexto_ia=ai_result.get("texto") or ai_result.get("contexto") or "",
+                feedback_json=ai_result.get("feedback_json") or ai_result.get("correccion") or {},
+                fuente=ai_result.get("fuente") or "chatgpt",
+                pasos_feedback=ai_result.get("pasos"),
+                clave_memo="" if error else clave_feedback(tarea.intento.ejercicio_id, tarea.payload),
+            )
+            transaction.on_commit(lambda: recordar(fb))
+        TareaFeedback.objects.filter(pk=tarea.pk).update(estado=estado, error=error[:2000], actualizada=timezone.now())
+    if error:
+        logger.error("Feedback del intento %s falló tras %d intentos: %s", tarea.intento_id, tarea.intentos, error)
+    return estado
+
+
+def procesar_pendientes(limite=None):
+    # Procesa tareas hasta vaciar la cola (o hasta `limite`); devuelve cuántas tomó
+    procesadas = 0
+    while limite is None or procesadas < limite:
+        tarea = tomar_tarea()
+        if tarea is None:
+            break
+        procesar_tarea(tarea)
+        procesadas += 1
+    return procesadas
+
+
+def estado_feedback(intento):
+    """
+    "listo" si el Feedback ya existe, "pendiente" mientras la tarea espera o corre,
+    "fallido" si se agotaron los reintentos sin feedback y "sin_feedback" si nunca se encoló.
+    """
+    if Feedback.objects.filter(intento=intento).exists():
+        return "listo"
+    estado = TareaFeedback.objects.filter(intento=intento).values_list("estado", flat=True).first()
+    if estado in (TareaFeedback.PENDIENTE, TareaFeedback.EN_PROCESO):
+        return "pendiente"
+    if estado == TareaFeedback.FALLIDA:
+        return "fallido"
+    return "sin_feedback"
@@ -1,3 +1,519 @@
-from django.test import TestCase
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import Estudiante
+from core.models import Carrera, Materia, Unidad
+from usage.services import current_llm_context
+from . import banco_items, exposicion, parada, services, tareas
+from .banco_items import IndiceBanco
+from .models import Ejercicio, Feedback, Intento, TareaFeedback
+
+
+def crear_estudiante(email="est@sinekys.com"):
+    user = get_user_model().objects.create_user(
+        email=email, password="clave-segura-123", username=email.split("@")[0],
+        first_name="Ana", last_name="Pérez",
+    )
+    carrera, _ = Carrera.objects.get_or_create(nombre="Ingeniería Civil")
+    return Estudiante.objects.create(user=user, carrera=carrera)
+
+
+def crear_ejercicio(dificultad=0.0, discriminacion=1.0, enunciado="2x + 3 = 11"):
+    materia = Materia.objects.first() or Materia.objects.create(nombre="Álgebra")
+    unidad = Unidad.objects.first() or Unidad.objects.create(materia=materia, num_unidad=1, nombre="Ecuaciones")
+    return Ejercicio.objects.create(
+        materia=materia, unidad=unidad, enunciado=enunciado, solucion="x = 4",
+        dificultad=dificultad, discriminacion=discriminacion,
+    )
+
+
+def crear_intento(estudiante, ejercicio, respuesta="7"):
+    return Intento.objects.create(
+        estudiante=estudiante, ejercicio=ejercicio, respuesta_estudiante=respuesta,
+        es_correcto=False, puntos=0.0, fecha_intento=timezone.now(), tiempo_en_segundos=30.0,
+    )
+
+
+async def _leer_stream(response):
+    partes = [parte async for parte in response.streaming_content]
+    return b"".join(p if isinstance(p, bytes) else p.encode() for p in partes).decode()
+
+
+@override_settings(FEEDBACK_MEMO=False)
+class CheckAnswerStreamTests(TestCase):
+    # La vista SSE es async: se prueba con AsyncClient (mismo camino que bajo ASGI)
+    def setUp(self):
+        self.estudiante = crear_estudiante()
+        self.otro = crear_estudiante("otro@sinekys.com")
+        self.intento = crear_intento(self.estudiante, crear_ejercicio())
+        self.url = reverse("check-respuesta-stream", kwargs={"intento_uuid": self.intento.uuid})
+
+    async def test_anonimo_redirige_al_login(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+
+    async def test_otro_estudiante_no_accede(self):
+        await self.async_client.aforce_login(self.otro.user)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 403)
+
+    async def test_feedback_existente_se_envia_como_fin(self):
+        await Feedback.objects.acreate(
+            intento=self.intento, contexto_ejercicio="Revisa el despeje", feedback={"errores": []}, fuente_ia="chatgpt",
+        )
+        await self.async_client.aforce_login(self.estudiante.user)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        cuerpo = await _leer_stream(response)
+        self.assertIn("event: fin", cuerpo)
+        self.assertIn("Revisa el despeje", cuerpo)
+
+    async def test_stream_genera_feedback_con_llm_context_solo_en_la_llamada(self):
+        await TareaFeedback.objects.acreate(intento=self.intento, payload={"enunciado": "2x + 3 = 11"})
+        contextos = []
+
+        async def stream_falso(payload, temperature=0.3):
+            contextos.append(current_llm_context())
+            yield "texto", "Te equivocaste al despejar"
+            contextos.append(current_llm_context())
+            yield "fin", {"texto": "Te equivocaste al despejar", "feedback_json": {}, "pasos": [], "fuente": "chatgpt"}
+
+        await self.async_client.aforce_login(self.estudiante.user)
+        with mock.patch("ejercicios.Api_LLMs.requestfeedback.stream_my_ai_service", stream_falso):
+            response = await self.async_client.get(self.url)
+            cuerpo = await _leer_stream(response)
+
+        self.assertIn("event: texto", cuerpo)
+        self.assertIn("event: fin", cuerpo)
+        self.assertEqual(contextos, [(self.estudiante.user_id, "feedback")] * 2)
+        # fuera del paso del stream el contexto no queda puesto
+        self.assertEqual(current_llm_context(), (None, None))
+        tarea = await TareaFeedback.objects.aget(intento=self.intento)
+        self.assertEqual(tarea.estado, TareaFeedback.COMPLETADA)
+        self.assertTrue(await Feedback.objects.filter(intento=self.intento).aexists())
+
+
+class PresupuestoStreamingTests(TestCase):
+    # El presupuesto diario consulta la DB (plan del usuario): desde un coroutine tiene que ir por
+    # sync_to_async, si no SynchronousOnlyOperation se tragaba y el límite nunca se aplicaba
+    def setUp(self):
+        from django.core.cache import cache
+        from usage.ledger import KEY_TOKENS_DIA
+
+        self.estudiante = crear_estudiante()
+        cache.set(KEY_TOKENS_DIA.format(self.estudiante.user_id, timezone.localdate().isoformat()), 10**9)
+
+    async def test_astream_chat_aplica_el_presupuesto(self):
+        from usage.services import llm_context
+        from .Api_LLMs import gateway
+
+        with mock.patch.object(gateway, "_elegir", side_effect=AssertionError("no debía llegar al proveedor")):
+            with llm_context(user_id=self.estudiante.user_id, mode="feedback"):
+                with self.assertRaises(gateway.PresupuestoAgotado):
+                    async for _ in gateway.astream_chat(model="gpt-4o-mini", messages=[]):
+                        pass
+
+    async def test_achat_aplica_el_presupuesto(self):
+        from usage.services import llm_context
+        from .Api_LLMs import gateway
+
+        with mock.patch.object(gateway, "_elegir", side_effect=AssertionError("no debía llegar al proveedor")):
+            with llm_context(user_id=self.estudiante.user_id, mode="normal"):
+                with self.assertRaises(gateway.PresupuestoAgotado):
+                    await gateway.achat(model="gpt-4o-mini", messages=[])
+
+
+class ActualizarDiagnosticoTests(TestCase):
+    def setUp(self):
+        self.estudiante = crear_estudiante()
+        self.ejercicio = crear_ejercicio()
+
+    def test_sin_diagnostico_lo_crea_con_la_estimacion(self):
+        from accounts.models import Diagnostico
+        from .services import actualizar_diagnostico
+
+        crear_intento(self.estudiante, self.ejercicio)
+        theta, se = actualizar_diagnostico(self.estudiante)
+        diagnostico = Diagnostico.objects.get(estudiante=self.estudiante)
+        self.assertEqual(diagnostico.respuestas["ids"], [self.ejercicio.pk])
+        self.assertAlmostEqual(diagnostico.theta, theta)
+        self.assertAlmostEqual(diagnostico.error_estimacion, se)
+        self.assertLess(theta, 0.0)  # una respuesta incorrecta baja theta desde la prior N(0, 1)
+
+    def test_envio_repetido_no_se_cuenta_dos_veces(self):
+        from accounts.models import Diagnostico
+
+        Diagnostico.objects.create(
+            estudiante=self.estudiante, theta=0.0, error_estimacion=1.0,
+            respuestas={"ids": [self.ejercicio.pk], "a": [1.0], "b": [0.0], "c": [0.0], "y": [0]},
+        )
+        self.client.force_login(self.estudiante.user)
+        response = self.client.post(
+            reverse("diagnostico"), {"ejercicio_id": self.ejercicio.pk, "respuesta_estudiante": "x = 4"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Intento.objects.filter(estudiante=self.estudiante).exists())
+        self.assertEqual(Diagnostico.objects.get(estudiante=self.estudiante).respuestas["ids"], [self.ejercicio.pk])
+
+
+class IndiceBancoTests(TestCase):
+    # con_item / sin_item actualizan la tabla top-K solo en las filas afectadas: tienen que dar lo
+    # mismo que reconstruir el índice completo
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        n = 150  # más que TOP_K, así se usa el camino incremental y no la reconstrucción
+        self.items = {
+            i: (float(rng.uniform(0.5, 2.0)), float(rng.normal()), 0.0, 1, 1 + i % 3, [1 + i % 2])
+            for i in range(1, n + 1)
+        }
+
+    def _reconstruir(self, items):
+        ids = list(items)
+        a, b, c, materias, unidades, tipos = zip(*(items[i] for i in ids))
+        indice = IndiceBanco(b, a, ids, materias, unidades, c)
+        indice.tipos = np.array([indice.mascara_tipos(items[i][5]) for i in indice.ids], dtype=np.int64)
+        return indice
+
+    def assertMismoIndice(self, obtenido, esperado):
+        np.testing.assert_array_equal(obtenido.ids, esperado.ids)
+        np.testing.assert_allclose(obtenido.dificultad, esperado.dificultad)
+        np.testing.assert_allclose(obtenido.discriminacion, esperado.discriminacion)
+        np.testing.assert_array_equal(obtenido.unidad_ids, esperado.unidad_ids)
+        np.testing.assert_array_equal(obtenido.tipos, esperado.tipos)
+        np.testing.assert_allclose(obtenido.top_info, esperado.top_info, rtol=1e-6)
+        # con empates el orden dentro del top-K puede variar: se comparan los conjuntos de ids
+        for fila in range(len(esperado.grid)):
+            self.assertEqual(
+                set(obtenido.ids[obtenido.top_pos[fila]]), set(esperado.ids[esperado.top_pos[fila]])
+            )
+        for theta in (-2.0, 0.0, 1.3):
+            self.assertEqual(
+                obtenido.seleccionar_maxima_informacion(theta, obtenido.mascara_excluidos([1, 2])),
+                esperado.seleccionar_maxima_informacion(theta, esperado.mascara_excluidos([1, 2])),
+            )
+
+    def test_con_item_nuevo_igual_a_reconstruir(self):
+        indice = self._reconstruir(self.items)
+        self.items[999] = (2.5, 0.1, 0.0, 1, 2, [2])
+        nuevo = indice.con_item(999, 2.5, 0.1, 0.0, 1, 2, [2])
+        self.assertMismoIndice(nuevo, self._reconstruir(self.items))
+        self.assertNotIn(999, indice.ids)  # el índice original no se modifica
+
+    def test_con_item_existente_lo_reemplaza(self):
+        indice = self._reconstruir(self.items)
+        self.items[10] = (2.4, -1.7, 0.0, 1, 3, [1, 2])
+        nuevo = indice.con_item(10, 2.4, -1.7, 0.0, 1, 3, [1, 2])
+        self.assertMismoIndice(nuevo, self._reconstruir(self.items))
+
+    def test_sin_item_igual_a_reconstruir(self):
+        indice = self._reconstruir(self.items)
+        # el ítem más informativo cerca de theta=0 está en muchas filas del top-K
+        quitado = int(indice.seleccionar_maxima_informacion(0.0))
+        del self.items[quitado]
+        self.assertMismoIndice(indice.sin_item(quitado), self._reconstruir(self.items))
+
+
+class IndiceBancoSignalsTests(TestCase):
+    # El índice del proceso y la versión compartida solo cambian cuando la transacción hace commit
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.delete(banco_items.CACHE_VERSION_KEY)
+        crear_ejercicio()
+        banco_items.invalidar_indice()
+        self.indice = banco_items.obtener_indice()
+        self.version = cache.get(banco_items.CACHE_VERSION_KEY)
+
+    def test_guardar_actualiza_el_indice_al_hacer_commit(self):
+        from django.core.cache import cache
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            ejercicio = crear_ejercicio(dificultad=1.5)
+            # antes del commit nadie ve el cambio
+            self.assertEqual(cache.get(banco_items.CACHE_VERSION_KEY), self.version)
+            self.assertNotIn(ejercicio.pk, banco_items.obtener_indice().ids)
+        for callback in callbacks:
+            callback()
+        self.assertIn(ejercicio.pk, banco_items.obtener_indice().ids)
+        self.assertEqual(cache.get(banco_items.CACHE_VERSION_KEY), self.version + 1)
+
+    def test_rollback_no_deja_items_fantasma(self):
+        from django.core.cache import cache
+        from django.db import transaction
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                ejercicio = crear_ejercicio(dificultad=1.5)
+                raise RuntimeError
+        self.assertIs(banco_items.obtener_indice(), self.indice)
+        self.assertNotIn(ejercicio.pk, self.indice.ids)
+        self.assertEqual(cache.get(banco_items.CACHE_VERSION_KEY), self.version)
+
+    def test_borrar_quita_el_item_al_hacer_commit(self):
+        ejercicio = Ejercicio.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            ejercicio.delete()
+        self.assertEqual(len(banco_items.obtener_indice()), 0)
+
+
+class ExposicionTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        exposicion.establecer_parametros_exposicion([], [])
+
+    def test_dos_flush_concurrentes_no_cuentan_doble(self):
+        # el thread de un worker y el cron leen el mismo valor antes de que alguno descuente
+        from django.core.cache import cache
+
+        key = exposicion.KEY_MOSTRADO.format(1)
+        cache.set(key, 5)
+        leido = cache.get(key)
+        tomados = [exposicion._tomar(key, leido), exposicion._tomar(key, leido)]
+        self.assertEqual(sum(tomados), 5)
+        self.assertEqual(cache.get(key), 0)
+
+    def test_lo_que_llega_entre_lectura_y_descuento_queda_para_el_proximo_flush(self):
+        from django.core.cache import cache
+
+        key = exposicion.KEY_MOSTRADO.format(1)
+        cache.set(key, 5)
+        leido = cache.get(key)
+        exposicion.registrar_exposicion(1)
+        self.assertEqual(exposicion._tomar(key, leido), 5)
+        self.assertEqual(cache.get(key), 1)
+
+    @override_settings(EXPOSICION_FLUSH_SEGUNDOS=3600)
+    def test_flush_vuelca_mostrado_y_seleccionados(self):
+        from .models import EjercicioVecesMostrado
+
+        ids = [crear_ejercicio().pk for _ in range(3)]
+        exposicion.registrar_exposicion(ids[0], considerados=ids)
+        exposicion.registrar_exposicion(ids[0])
+        self.assertEqual(exposicion.flush_exposicion(ids), 3)
+        filas = dict(
+            (f[0], f[1:]) for f in
+            EjercicioVecesMostrado.objects.values_list("ejercicio_id", "veces_mostrado", "veces_seleccionado")
+        )
+        self.assertEqual(filas, {ids[0]: (2, 2), ids[1]: (0, 1), ids[2]: (0, 1)})
+        self.assertEqual(exposicion.flush_exposicion(ids), 0)
+
+    def test_k_sale_de_la_tasa_de_seleccion(self):
+        k = exposicion.calcular_parametros_exposicion([100, 50, 10], [20, 20, 5], n_diagnosticos=100)
+        np.testing.assert_allclose(k, [0.25, 0.5, 1.0])
+
+    def test_item_en_el_limite_queda_congelado(self):
+        k = exposicion.calcular_parametros_exposicion([100, 100], [25, 24], n_diagnosticos=100)
+        np.testing.assert_allclose(k, [0.0, 0.25])
+
+    def test_rechazados_los_k_mejores_sigue_con_el_siguiente_bloque(self):
+        exposicion.establecer_parametros_exposicion([1, 2, 3, 4], [0.0, 0.0, 1.0, 1.0])
+        rng = np.random.default_rng(0)
+        for _ in range(20):
+            elegido, considerados = exposicion.elegir_con_exposicion([1, 2, 3, 4], rng=rng, bloque=2)
+            self.assertIn(elegido, (3, 4))
+            self.assertEqual(set(considerados[:2]), {1, 2})
+            self.assertEqual(considerados[-1], elegido)
+
+    def test_se_administra_con_probabilidad_k_cuando_es_seleccionado(self):
+        exposicion.establecer_parametros_exposicion([1, 2], [0.3, 1.0])
+        rng = np.random.default_rng(1)
+        seleccionado = administrado = 0
+        for _ in range(4000):
+            elegido, considerados = exposicion.elegir_con_exposicion([1, 2], rng=rng)
+            seleccionado += 1 in considerados
+            administrado += elegido == 1
+        self.assertAlmostEqual(administrado / seleccionado, 0.3, delta=0.03)
+
+
+@override_settings(IRT_MODELO="2PL", IRT_NODOS_CUADRATURA=61)
+class EstimadoresTests(SimpleTestCase):
+    # Patrones de respuesta conocidos contra una integración / maximización directa en una grilla fina
+    a = [1.0, 1.5, 0.8, 1.2]
+    b = [-1.0, -0.5, 0.5, 1.0]
+    y = [1, 1, 0, 1]
+
+    def setUp(self):
+        from .irt import obtener_modelo
+
+        self.modelo = obtener_modelo()
+        self.grilla = np.linspace(-6.0, 6.0, 24001)
+        self.log_lik = self.modelo.log_verosimilitud(self.grilla[:, None], self.y, self.a, self.b)
+
+    def _respuestas(self, a, b, y):
+        return {"ids": list(range(len(y))), "a": list(a), "b": list(b), "c": [0.0] * len(y), "y": list(y)}
+
+    def test_eap_sin_respuestas_es_la_prior(self):
+        theta, se = services.estimar_theta_eap(services.posterior_desde_respuestas(services.respuestas_vacias()))
+        self.assertAlmostEqual(theta, 0.0, places=6)
+        self.assertAlmostEqual(se, 1.0, places=6)
+
+    def test_eap_igual_a_integrar_la_posterior(self):
+        theta, se = services.estimar_theta_eap(
+            services.posterior_desde_respuestas(self._respuestas(self.a, self.b, self.y))
+        )
+        pesos = np.exp(self.log_lik - self.grilla ** 2 / 2)
+        pesos /= pesos.sum()
+        media = pesos @ self.grilla
+        self.assertAlmostEqual(theta, media, places=4)
+        self.assertAlmostEqual(se, np.sqrt(pesos @ (self.grilla - media) ** 2), places=4)
+
+    def test_map_igual_al_maximo_de_la_posterior(self):
+        theta, se = services.estimar_theta_map(
+            services.posterior_desde_respuestas(self._respuestas(self.a, self.b, self.y))
+        )
+        log_post = self.log_lik - self.grilla ** 2 / 2
+        self.assertAlmostEqual(theta, self.grilla[np.argmax(log_post)], delta=0.05)
+        self.assertGreater(se, 0.0)
+        self.assertLess(se, 1.0)
+
+    def test_mle_igual_al_maximo_de_la_verosimilitud(self):
+        a_arr, b_arr, c_arr, y_arr = services.arrays_respuestas(self._respuestas(self.a, self.b, self.y))
+        theta, info = services.estimar_theta_newton(0.0, a_arr, b_arr, c_arr, y_arr, self.modelo)
+        self.assertAlmostEqual(theta, self.grilla[np.argmax(self.log_lik)], places=3)
+        self.assertAlmostEqual(info, float(np.sum(self.modelo.informacion(theta, a_arr, b_arr, c_arr))))
+
+    def test_patron_simetrico_da_theta_cero(self):
+        respuestas = self._respuestas([1.0, 1.0], [0.0, 0.0], [1, 0])
+        a_arr, b_arr, c_arr, y_arr = services.arrays_respuestas(respuestas)
+        self.assertAlmostEqual(services.estimar_theta_newton(1.0, a_arr, b_arr, c_arr, y_arr)[0], 0.0, places=4)
+        log_posterior = services.posterior_desde_respuestas(respuestas)
+        self.assertAlmostEqual(services.estimar_theta_eap(log_posterior)[0], 0.0, places=6)
+        self.assertAlmostEqual(services.estimar_theta_map(log_posterior)[0], 0.0, places=6)
+
+    def test_todo_correcto_la_prior_acota_y_el_mle_se_va_al_borde(self):
+        respuestas = self._respuestas([1.0] * 5, [0.0] * 5, [1] * 5)
+        log_posterior = services.posterior_desde_respuestas(respuestas)
+        for estimar in (services.estimar_theta_eap, services.estimar_theta_map):
+            theta, _ = estimar(log_posterior)
+            self.assertGreater(theta, 0.5)
+            self.assertLess(theta, 2.5)
+        a_arr, b_arr, c_arr, y_arr = services.arrays_respuestas(respuestas)
+        self.assertEqual(services.estimar_theta_newton(0.0, a_arr, b_arr, c_arr, y_arr)[0], services.THETA_MAX)
+
+    def test_posterior_incremental_igual_a_reconstruirla(self):
+        log_posterior = services.posterior_desde_respuestas(services.respuestas_vacias())
+        for a, b, y in zip(self.a, self.b, self.y):
+            log_posterior = services.actualizar_posterior(log_posterior, a, b, 0.0, y)
+        np.testing.assert_allclose(
+            log_posterior, services.posterior_desde_respuestas(self._respuestas(self.a, self.b, self.y)), atol=1e-9
+        )
+
+
+class MotorParadaTests(SimpleTestCase):
+    def _estado(self, n_items=10, theta=0.0, se=0.5, historial_se=(), tiempo_restante=600, indice=None):
+        return SimpleNamespace(
+            n_items=n_items, ids=list(range(1, n_items + 1)), theta=theta, se=se,
+            historial_se=list(historial_se), tiempo_restante=tiempo_restante, indice=indice,
+        )
+
+    def _motor(self, **configuracion):
+        return parada.MotorParada({**parada.configuracion_por_defecto(), **configuracion})
+
+    def test_sigue_mientras_ninguna_regla_se_cumple(self):
+        self.assertIsNone(self._motor().evaluar(self._estado(n_items=10, se=0.5)))
+
+    def test_precision_alcanzada(self):
+        self.assertEqual(self._motor(umbral_se=0.4).evaluar(self._estado(se=0.35)), "Precisión alcanzada")
+
+    def test_antes_del_minimo_solo_cuentan_tiempo_y_maximo(self):
+        motor = self._motor(min_items=5, max_items=3)
+        self.assertEqual(motor.evaluar(self._estado(n_items=3, se=0.1)), "Límite de ejercicios alcanzado")
+        motor = self._motor(min_items=5)
+        self.assertIsNone(motor.evaluar(self._estado(n_items=3, se=0.1, theta=3.0)))
+        self.assertEqual(motor.evaluar(self._estado(n_items=3, tiempo_restante=0)), "Tiempo agotado")
+
+    def test_gana_la_primera_regla_en_el_orden_configurado(self):
+        estado = self._estado(n_items=30, se=0.1, tiempo_restante=0)
+        self.assertEqual(self._motor().evaluar(estado), "Tiempo agotado")
+        self.assertEqual(self._motor(reglas=["error", "tiempo"]).evaluar(estado), "Precisión alcanzada")
+
+    def test_nivel_extremo_necesita_suficientes_items(self):
+        motor = self._motor(umbral_extremo=2.9, min_items_extremo=10)
+        self.assertIsNone(motor.evaluar(self._estado(n_items=9, theta=-2.95)))
+        self.assertEqual(motor.evaluar(self._estado(n_items=10, theta=-2.95)), "Nivel extremo detectado")
+
+    def test_meseta(self):
+        motor = self._motor(reglas=["meseta"], ventana_meseta=3, delta_meseta=0.01)
+        self.assertIsNone(motor.evaluar(self._estado(historial_se=[0.9, 0.8, 0.7])))
+        self.assertIsNone(motor.evaluar(self._estado(historial_se=[0.9, 0.8, 0.7, 0.6])))
+        self.assertEqual(
+            motor.evaluar(self._estado(historial_se=[0.9, 0.6, 0.598, 0.597, 0.596])), "Sin ganancia de información"
+        )
+
+    def test_reduccion_predicha(self):
+        # 60 ítems en theta = 0 con a = 1: el mejor aporta I = 0.25
+        indice = IndiceBanco(np.zeros(60), np.ones(60), np.arange(1, 61), np.ones(60), np.ones(60))
+        motor = self._motor(reglas=["reduccion_predicha"], umbral_reduccion=0.01)
+        # SE 0.5 -> 1 / sqrt(4 + 0.25) = 0.485: baja 0.015, sigue
+        self.assertIsNone(motor.evaluar(self._estado(n_items=5, se=0.5, indice=indice)))
+        # SE 0.2 -> 1 / sqrt(25 + 0.25) = 0.199: no vale la pena
+        self.assertEqual(
+            motor.evaluar(self._estado(n_items=5, se=0.2, indice=indice)), "Reducción de error esperada insuficiente"
+        )
+
+    def test_regla_desconocida_o_con_error_se_ignora(self):
+        with self.assertLogs("ejercicios.parada", level="WARNING"):
+            motor = self._motor(reglas=["no_existe", "reduccion_predicha", "max_items"], max_items=5)
+        self.assertEqual(len(motor.reglas), 2)
+        with self.assertLogs("ejercicios.parada", level="ERROR"):
+            # indice=None no tiene len(): la regla falla y se sigue con la próxima
+            self.assertEqual(motor.evaluar(self._estado(n_items=5)), "Límite de ejercicios alcanzado")
+
+
+class TomarTareaTests(TestCase):
+    def setUp(self):
+        self.intento = crear_intento(crear_estudiante(), crear_ejercicio())
+        self.tarea = TareaFeedback.objects.create(intento=self.intento, payload={"enunciado": "2x + 3 = 11"})
+
+    def test_se_toma_una_sola_vez(self):
+        tomada = tareas.tomar_tarea()
+        self.assertEqual(tomada.pk, self.tarea.pk)
+        self.assertEqual((tomada.estado, tomada.intentos), (TareaFeedback.EN_PROCESO, 1))
+        self.assertIsNone(tareas.tomar_tarea())
+        self.assertIsNone(tareas.tomar_tarea_de(self.intento))
+
+    def test_dos_workers_no_toman_la_misma_tarea(self):
+        # el otro worker la toma entre el SELECT y el UPDATE condicional de este
+        from django.db.models.query import QuerySet
+
+        update_original = QuerySet.update
+        competidor = {}
+
+        def update_con_carrera(queryset, **kwargs):
+            if "tarea" not in competidor:
+                competidor["tarea"] = None
+                competidor["tarea"] = tareas.tomar_tarea()
+            return update_original(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, "update", update_con_carrera):
+            self.assertIsNone(tareas.tomar_tarea())
+        self.assertEqual(competidor["tarea"].pk, self.tarea.pk)
+        self.tarea.refresh_from_db()
+        self.assertEqual(self.tarea.intentos, 1)
+
+    def test_stream_y_worker_no_toman_la_misma_tarea(self):
+        self.assertIsNotNone(tareas.tomar_tarea_de(self.intento))
+        self.assertIsNone(tareas.tomar_tarea())
+
+    def test_respeta_la_gracia_y_retoma_las_vencidas(self):
+        ahora = timezone.now()
+        TareaFeedback.objects.filter(pk=self.tarea.pk).update(disponible_desde=ahora + timedelta(seconds=30))
+        self.assertIsNone(tareas.tomar_tarea())
+        # en proceso hace más que el timeout: el worker que la tenía murió
+        TareaFeedback.objects.filter(pk=self.tarea.pk).update(
+            estado=TareaFeedback.EN_PROCESO, intentos=1, tomada_en=ahora - timedelta(hours=1),
+        )
+        retomada = tareas.tomar_tarea()
+        self.assertEqual((retomada.pk, retomada.intentos), (self.tarea.pk, 2))
+        self.assertIsNone(tareas.tomar_tarea())
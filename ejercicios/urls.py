@@ -1,5 +1,5 @@
 from django.urls import path,register_converter
-from .views import DiagnosticTestView,EjercicioView,MatchMakingGroupView, CheckAnswer
+from .views import DiagnosticTestView,EjercicioView,MatchMakingGroupView, CheckAnswer, CheckAnswerStream
 from . import converters
 
 
@@ -10,5 +10,6 @@ urlpatterns = [
     path('', EjercicioView.as_view(), name='ejercicio'),                      
     path('<int:ejercicio_id>/', EjercicioView.as_view(), name='ejercicio_detalle'), 
     path('check/<uuid:intento_uuid>/', CheckAnswer.as_view(), name='check-respuesta'),
+    path('check/<uuid:intento_uuid>/stream/', CheckAnswerStream.as_view(), name='check-respuesta-stream'),
     path('matchmaking-grupo/', MatchMakingGroupView.as_view(), name='matchmakingGroup'),
 ]
\ No newline at end of file
@@ -0,0 +1,14 @@
+from django.core.cache import cache
+
+
+def incrementar(key, delta=1, timeout=None):
+    """
+    cache.incr atómico que crea la clave si no existe (incr sobre una clave ausente lanza ValueError).
+    Si otro proceso la crea entremedio, add falla y se vuelve a incrementar.
+    """
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        if cache.add(key, delta, timeout=timeout):
+            return delta
+        return cache.incr(key, delta)
@@ -1,3 +1,4 @@
+import re
 import unicodedata
 from unidecode import unidecode
 
@@ -25,4 +26,32 @@ def normalize_text(text, for_storage=True, for_json=False):
         return unidecode(text)
     
     # Para almacenamiento: mantener caracteres legítimos intactos
-    return text.strip()
\ No newline at end of file
+    return text.strip()
+
+
+# Normalizar respuesta
+#  2X === 2x
+def normalizar_respuesta(respuesta: str) -> str:
+    if respuesta is None:
+        return ""
+    r = respuesta.strip().lower() 
+    
+    # Eliminar espacios alrededor de operadores
+    r = re.sub(r'\s*\+\s*', '+', r)
+    r = re.sub(r'\s*-\s*', '-', r)
+    r = re.sub(r'\s*=\s*', '=', r)
+    r = re.sub(r'\s*\*\s*', '*', r)
+    r = re.sub(r'\s*/\s*', '/', r)
+    
+    # Simplificar paréntesis: ( x + 1 ) → (x+1)
+    r = re.sub(r'\(\s*', '(', r)
+    r = re.sub(r'\s*\)', ')', r)
+    
+    # Unificar potencias: ^2, **2, al_cuadrado → ^2
+    r = re.sub(r'\*\*2|\^2|\b(al\s*_*\s*cuadrado)\b', '^2', r)
+    
+    # Por último tengo que trabajar con los puntos y los decimales
+    # lo que se puede volver un problema, que pasa si pone 
+    # 17,5 esta puede ser la respuestas de algebra o de funciones siendo 17,5 un punto en una gráfica
+    
+    return r
@@ -2,13 +2,14 @@ from django.views import View
 from django.utils.decorators import method_decorator
 
 from django.shortcuts import render,get_object_or_404, redirect
-from django.http import JsonResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotFound, Http404,HttpResponseNotAllowed
+from django.http import JsonResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotFound, Http404,HttpResponseNotAllowed, StreamingHttpResponse
 from django.utils.decorators import method_decorator
 from django.db import transaction
 from django.utils import timezone
 from django.urls import reverse
+from django.conf import settings
 
-from usage.services import can_user_attempt, register_attempt
+from usage.services import can_user_attempt, register_attempt, llm_context
 
 
 
@@ -16,7 +17,8 @@ from usage.services import can_user_attempt, register_attempt
 
 import ast
 import json
-import re
+
+from asgiref.sync import sync_to_async
 
 from django.contrib import messages
 # registro
@@ -24,13 +26,16 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
 
 # Models
-from ejercicios.models import Ejercicio, Intento, IntentoPaso,PasoEjercicio,Feedback,FeedbackPasos,TipoFeedback
+from ejercicios.models import Ejercicio, Intento, IntentoPaso,PasoEjercicio,Feedback,FeedbackPasos,TipoFeedback,TareaFeedback
 from accounts.models import Estudiante, Diagnostico
 
 # services
-from ejercicios.services import actualizar_diagnostico, seleccionar_siguiente_ejercicio
-from ejercicios.ia_feedback import save_ai_feedback_intento
-from ejercicios.Api_LLMs.requestfeedback import call_my_ai_service
+from ejercicios.services import actualizar_diagnostico, liberar_reservas, seleccionar_siguiente_ejercicio
+from ejercicios.parada import evaluar_parada
+from ejercicios.tareas import encolar_feedback, payload_feedback, estado_feedback, tomar_tarea_de, finalizar_tarea, resolver_sin_llm
+from ejercicios.exposicion import registrar_acierto
+from ejercicios.prefetch import precalentar_siguientes
+from ejercicios.utils.text import normalizar_respuesta
 # logs
 import logging
 logger = logging.getLogger(__name__)
@@ -40,12 +45,12 @@ from .mixins import (
     _diag_session_key,
     _ejercicio_session_key,
     get_estudiante_from_request,
-    prepare_next_payload_diagnostico,
     prepare_next_payload_normal,
     crear_intento_servidor,
     # render_diagnostico_template,
     json_next_excercise_response,   
     obtener_o_validar_diagnostico, 
+    diagnostico_activo_para_api,
     DiagnosticoCompletadoMixin,
     select_mode,
 )
@@ -54,34 +59,6 @@ from .mixins import (
 
 
 
-# Normalizar respuesta
-#  2X === 2x
-def normalizar_respuesta(respuesta: str) -> str:
-    if respuesta is None:
-        return ""
-    r = respuesta.strip().lower() 
-    
-    # Eliminar espacios alrededor de operadores
-    r = re.sub(r'\s*\+\s*', '+', r)
-    r = re.sub(r'\s*-\s*', '-', r)
-    r = re.sub(r'\s*=\s*', '=', r)
-    r = re.sub(r'\s*\*\s*', '*', r)
-    r = re.sub(r'\s*/\s*', '/', r)
-    
-    # Simplificar paréntesis: ( x + 1 ) → (x+1)
-    r = re.sub(r'\(\s*', '(', r)
-    r = re.sub(r'\s*\)', ')', r)
-    
-    # Unificar potencias: ^2, **2, al_cuadrado → ^2
-    r = re.sub(r'\*\*2|\^2|\b(al\s*_*\s*cuadrado)\b', '^2', r)
-    
-    # Por último tengo que trabajar con los puntos y los decimales
-    # lo que se puede volver un problema, que pasa si pone 
-    # 17,5 esta puede ser la respuestas de algebra o de funciones siendo 17,5 un punto en una gráfica
-    
-    return r
-
-    
 def evaluar_respuesta(respuesta_estudiante: str, respuesta_correcta: str) -> tuple[bool, float]:
     es_correcto = normalizar_respuesta(respuesta_estudiante) == normalizar_respuesta(respuesta_correcta)
 
@@ -113,10 +90,11 @@ class DiagnosticTestView(View):
                 request.session.pop(session_key,None)
                 ejercicio = None
         if not ejercicio:
-            ejercicio = seleccionar_siguiente_ejercicio(estudiante)
+            ejercicio = seleccionar_siguiente_ejercicio(estudiante, diagnostico=diagnostico)
             if not ejercicio:
                 diagnostico.finalizado = True
                 diagnostico.save(update_fields=['finalizado'])
+                liberar_reservas(diagnostico)
                 return render(request, "diagnostico/finalizado.html", {
                     "finalizado": True,
                     "diagnostico": diagnostico,
@@ -125,6 +103,8 @@ class DiagnosticTestView(View):
             # Reservamos en sesión: ahora GET repetido devolverá mismo ejercicio
             request.session[session_key] = ejercicio.id
         contexto = select_mode(estudiante, ejercicio,"diagnostico")
+        # mientras responde, generar en background los contextos de los siguientes probables
+        precalentar_siguientes(diagnostico, ejercicio)
         remaining_seconds= max(0,int(diagnostico.tiempo_restante()))
         payload = {
             "ejercicio": ejercicio,
@@ -169,12 +149,12 @@ class DiagnosticTestView(View):
             return err_resp
         
         # validar diagnostico activo para API
-        payload_check, err = prepare_next_payload_diagnostico(estudiante, wants_json=True) #???
-        if err:
-            return err #incluye caos finalizado
-        
-        
-        diagnostico = payload_check["diagnostico"]
+        # (solo el diagnóstico: preparar el payload completo elegía otro ejercicio y generaba su contexto)
+        # La fila queda bloqueada hasta el commit: respuestas/log_posterior se leen, se les agrega
+        # este intento y se reescriben, así un doble envío espera en vez de pisar al otro
+        diagnostico = diagnostico_activo_para_api(estudiante, bloquear=True)
+        if not diagnostico:
+            return JsonResponse({"error":"El diagnostico ya finalizó o expiró", "finalizado":True},status=403)
         
         try:
             data = json.loads(request.body)
@@ -191,6 +171,9 @@ class DiagnosticTestView(View):
             return JsonResponse({"error":"Falta id del ejercicio"}, status=400)
         
         ejercicio = get_object_or_404(Ejercicio, pk=ejercicio_id)
+        if ejercicio.pk in ((diagnostico.respuestas or {}).get("ids") or []):
+            # el mismo envío llegó dos veces (doble clic / reintento): ya está contado
+            return JsonResponse({"error": "Ese ejercicio ya fue respondido en el diagnóstico"}, status=409)
         es_correcto, puntos = evaluar_respuesta(respuesta_estudiante, ejercicio.solucion)
         
         server_remaining = max(0.0, float(diagnostico.tiempo_restante()))
@@ -209,6 +192,7 @@ class DiagnosticTestView(View):
         if diagnostico.is_expired():
             diagnostico.finalizado = True
             diagnostico.save(update_fields=["finalizado"])
+            liberar_reservas(diagnostico)
             return JsonResponse({"success": True, "final":True,"motivo":"Tiempo agotado antes del envío"}, status=200)
         
         intento = crear_intento_servidor(
@@ -222,73 +206,28 @@ class DiagnosticTestView(View):
             "Intento creado (ejercicios.view - diagnostico) intento_id=%s  estudiante=%s ejercicio=%s puntos=%s es_correcto=%s",
             intento.id,estudiante.pk,ejercicio.id,puntos,es_correcto
         )
+        if es_correcto:
+            registrar_acierto(ejercicio.id)
         
         
-        try: 
-            ai_payload = {
-                "enunciado": ejercicio.enunciado,
-                "respuesta_estudiante": respuesta_estudiante,
-                "solucion": ejercicio.solucion,
-                "pasos": pasos
-            }
-            ai_result = call_my_ai_service(ai_payload)
-        except Exception as e:
-            logger.exception("Error llamando IA para intento %s: %s", intento.id, str(e))
-            ai_result = None
-        
-        if ai_result:
-            contexto_ia = ai_result.get("texto") or ai_result.get("contexto") or ""
-            feedback_json = ai_result.get("feedback_json") or ai_result.get("correccion") or {}
-            pasos_feedback = ai_result.get("pasos")  # opcional
-            save_ai_feedback_intento(
-                intento=intento,
-                contexto_ia=contexto_ia,
-                feedback_json=feedback_json,
-                fuente="chatgpt",
-                pasos_feedback=pasos_feedback
-            )
+        # el feedback IA se genera en background (ver tareas.py), no dentro de esta transacción
+        encolar_feedback(intento, payload_feedback(ejercicio, respuesta_estudiante, pasos))
         
         
         
         # actualizar dianostico y obtener theta + SE
-        theta_actual, se = actualizar_diagnostico(estudiante)
-        # actualizar el objeto Diagnostico con los nuevos valores
-        diagnostico.theta = theta_actual
-        diagnostico.error_estimacion = se
-        diagnostico.save(update_fields=["theta","error_estimacion"])
-        
-        # criterios de finalizacion
-        # criterios de finalizacion
-        # criterios de finalizacion
-        num_items = Intento.objects.filter(estudiante=estudiante).count() #Ojo puede haber un problema, ya que si el es estudiante cancela la prueba, los intentos seguiran registrados y por lo tanto el número aumentaría
-        max_items = 2 # CAMBIAR A 30 CAMBIAR A 30 CAMBIAR A 30 CAMBIAR A 30 CAMBIAR A 30 CAMBIAR A 30
-        umbral_se = 0.4
+        # (actualiza y guarda theta, error_estimacion y el vector de respuestas en el mismo objeto)
+        theta_actual, se = actualizar_diagnostico(estudiante, intento=intento, diagnostico=diagnostico)
         
-        
-        finalizado = (
-            se<umbral_se or
-            num_items>=max_items or
-            diagnostico.is_expired() or
-            (abs(theta_actual) >= 2.9 and num_items >=10)
-        )
-        finalizado = False
-        motivo = ""
-        if se < umbral_se:
-            finalizado = True
-            motivo = "Precisión alcanzada"
-        elif num_items >= max_items:
-            finalizado = True
-            motivo = "Límite de ejercicios alcanzado"
-        elif diagnostico.is_expired():
-            finalizado = True
-            motivo = "Tiempo agotado"
-        elif abs(theta_actual) >= 2.9 and num_items >= 10:
-            motivo = "Nivel extremo detectado"
+        # criterios de finalizacion (reglas configurables por materia, ver parada.py)
+        num_items = len(diagnostico.respuestas.get("ids", []))
+        finalizado, motivo = evaluar_parada(diagnostico, theta_actual, se)
 
         session_key = _diag_session_key(diagnostico)
         if finalizado:
             diagnostico.finalizado = True
             diagnostico.save(update_fields=["finalizado"])
+            liberar_reservas(diagnostico)
             request.session.pop(session_key,None)
             return JsonResponse({
                 "success": True,
@@ -298,11 +237,12 @@ class DiagnosticTestView(View):
                 "error": se
             })
         
-        siguiente_ejercicio = seleccionar_siguiente_ejercicio(estudiante)
+        siguiente_ejercicio = seleccionar_siguiente_ejercicio(estudiante, diagnostico=diagnostico)
         if not siguiente_ejercicio:
             # Caso extremo: no hay más ejercicios
             diagnostico.finalizado = True
             diagnostico.save(update_fields=["finalizado"])
+            liberar_reservas(diagnostico)
             request.session.pop(session_key,None)
             return JsonResponse({
                 "success": True,
@@ -313,6 +253,7 @@ class DiagnosticTestView(View):
             })
         request.session[session_key] = siguiente_ejercicio.id
         contexto = select_mode(estudiante,siguiente_ejercicio,"diagnostico")
+        precalentar_siguientes(diagnostico, siguiente_ejercicio)
         
         return json_next_excercise_response(siguiente_ejercicio,contexto,theta=theta_actual,se=se,num_items=num_items)
         
@@ -440,29 +381,8 @@ class EjercicioView(DiagnosticoCompletadoMixin,LoginRequiredMixin,View):
             "Intento creado (ejercicios.view)_ intento_id=%s  estudiante=%s ejercicio=%s puntos=%s es_correcto=%s",
             intento.id, estudiante.pk, ejercicio.id, puntos, es_correcto
         )
-        try: 
-            ai_payload = {
-                "enunciado": ejercicio.enunciado,
-                "respuesta_estudiante": respuesta,
-                "solucion": ejercicio.solucion,
-                "pasos": pasos
-            }
-            ai_result = call_my_ai_service(ai_payload)
-        except Exception as e:
-            logger.exception("Error llamando IA para intento %s: %s", intento.id, str(e))
-            ai_result = None
-        
-        if ai_result:
-            contexto_ia = ai_result.get("texto") or ai_result.get("contexto") or ""
-            feedback_json = ai_result.get("feedback_json") or ai_result.get("correccion") or {}
-            pasos_feedback = ai_result.get("pasos")  # opcional
-            save_ai_feedback_intento(
-                intento=intento,
-                contexto_ia=contexto_ia,
-                feedback_json=feedback_json,
-                fuente="chatgpt",
-                pasos_feedback=pasos_feedback
-            )
+        # el feedback IA se genera en background (ver tareas.py): se responde sin esperar al LLM
+        encolar_feedback(intento, payload_feedback(ejercicio, respuesta, pasos))
         
         
         is_ajax = request.headers.get("X-Requested-With") == "XMLHttpRequest" or request.GET.get("json")
@@ -471,6 +391,7 @@ class EjercicioView(DiagnosticoCompletadoMixin,LoginRequiredMixin,View):
             return JsonResponse({
                 "success": True,
                 "intento_id": intento.id,
+                "intento_uuid": str(intento.uuid),
                 "es_correcto": es_correcto,
                 "puntos": puntos,
                 "redirect_url": redirect_url
@@ -670,6 +591,9 @@ class CheckAnswer(View):
                 FeedbackPasos.objects.filter(feedback=feedback).select_related("tipo_feedback").order_by("orden")
             )
 
+        # mientras la tarea de feedback no termine la plantilla consulta ?json=1 hasta que aparezca
+        feedback_estado = "listo" if feedback else estado_feedback(intento)
+
         # --- Normalizar feedback para la plantilla ---
         feedback_parsed = {}
         feedback_parse_error = None
@@ -694,6 +618,8 @@ class CheckAnswer(View):
             "feedback_raw": feedback_raw,          # raw (debug)
             "feedback_parse_error": feedback_parse_error,
             "feedback_pasos": feedback_pasos,
+            "feedback_estado": feedback_estado,
+            "feedback_streaming": getattr(settings, "FEEDBACK_STREAMING", False),
         }
 
         # JSON endpoint (útil para debugging o front-end async)
@@ -705,6 +631,7 @@ class CheckAnswer(View):
                 "puntos": puntos,
                 "pasos_intento": [{"orden": p.orden, "contenido": p.contenido} for p in pasos_intento],
                 "pasos_correctos": [{"orden": p.orden, "contenido": p.contenido} for p in pasos_correctos],
+                "feedback_estado": feedback_estado,
                 "feedback_raw": feedback_raw,
                 "feedback_parsed": feedback_parsed,
                 "feedback_pasos": [
@@ -720,4 +647,77 @@ class CheckAnswer(View):
         return render(request, "ejercicios/check-respuesta.html", contexto)
     
     # https://www.sympy.org/es/
-    # CALCULADORA/MUESTRA DE SIGNOS MATEMÁTICOS
\ No newline at end of file
+    # CALCULADORA/MUESTRA DE SIGNOS MATEMÁTICOS
+
+
+def _evento_sse(evento, datos):
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+
+async def _siguiente_evento(eventos, user_id):
+    # El llm_context cubre solo el paso del stream (la llamada al LLM), nunca un yield de la vista
+    with llm_context(user_id=user_id, mode="feedback"):
+        return await anext(eventos, None)
+
+
+class CheckAnswerStream(View):
+    # Feedback IA en streaming (server-sent events) para check-respuesta. Vista async: necesita el
+    # servidor ASGI (sinekys/asgi.py) para no tomar un worker mientras dura la respuesta del LLM.
+    # Eventos: "texto" (pedazo de explicación), "paso" (un paso completo), "fin" (resultado final
+    # ya guardado) y "pendiente" (otro worker tiene la tarea: la plantilla vuelve a consultar ?json=1).
+    # login_required va en get y no en dispatch: dispatch es sync y leería request.user dentro del
+    # event loop (SynchronousOnlyOperation); sobre un método async usa `await request.auser()`
+    @method_decorator(login_required)
+    async def get(self, request, intento_uuid):
+        user = await request.auser()
+        intento = await Intento.objects.select_related("ejercicio", "estudiante__user").filter(uuid=intento_uuid).afirst()
+        if intento is None:
+            raise Http404("Intento no encontrado")
+        if intento.estudiante.user_id != user.id and not user.is_staff:
+            return HttpResponseForbidden("No tienes acceso a este intento.")
+
+        response = StreamingHttpResponse(self._eventos(intento), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # nginx: no bufferear el stream
+        return response
+
+    async def _eventos(self, intento):
+        from ejercicios.Api_LLMs.requestfeedback import stream_my_ai_service
+
+        feedback = await Feedback.objects.filter(intento=intento).order_by("-fecha_feedback").afirst()
+        if feedback:
+            yield _evento_sse("fin", {"texto": feedback.contexto_ejercicio, "feedback_json": feedback.feedback})
+            return
+
+        tarea = await sync_to_async(tomar_tarea_de)(intento)
+        if tarea is None:
+            yield _evento_sse("pendiente", {"estado": await sync_to_async(estado_feedback)(intento)})
+            return
+        if await sync_to_async(resolver_sin_llm)(tarea):
+            # mismo error que otro intento: se copió su feedback
+            feedback = await Feedback.objects.filter(intento=intento).order_by("-fecha_feedback").afirst()
+            yield _evento_sse("fin", {"texto": feedback.contexto_ejercicio, "feedback_json": feedback.feedback})
+            return
+
+        ai_result, error = None, "El stream se cortó antes de terminar"
+        eventos = stream_my_ai_service(tarea.payload)
+        try:
+            while (siguiente := await _siguiente_evento(eventos, intento.estudiante.user_id)) is not None:
+                evento, datos = siguiente
+                if evento == "fin":
+                    ai_result = datos
+                else:
+                    yield _evento_sse(evento, datos)
+            error = "" if ai_result and not ai_result.get("fallback") else "El LLM no devolvió feedback válido"
+        except Exception as e:
+            logger.exception("Error en el streaming de feedback del intento %s: %s", intento.id, str(e))
+            error = str(e)
+        finally:
+            await eventos.aclose()
+            # se guarda aunque el cliente corte la conexión a mitad del stream
+            estado = await sync_to_async(finalizar_tarea)(tarea, ai_result, error)
+
+        if estado == TareaFeedback.COMPLETADA:
+            yield _evento_sse("fin", ai_result)
+        else:
+            yield _evento_sse("pendiente", {"estado": await sync_to_async(estado_feedback)(intento)})
@@ -1,4 +1,5 @@
 # settings.py — versión lista para producción (pegada sobre tu base actual)
+import json
 import os
 from pathlib import Path
 from dotenv import load_dotenv
@@ -241,6 +242,91 @@ LOGIN_REDIRECT_URL = os.getenv('LOGIN_REDIRECT_URL', '/')
 DIAGNOSTICO_MAX_EJERCICIOS = int(os.getenv('DIAGNOSTICO_MAX_EJERCICIOS', '30'))
 DIAGNOSTICO_UMBRAL_SE = float(os.getenv('DIAGNOSTICO_UMBRAL_SE', '0.4'))
 DIAGNOSTICO_UMBRAL_EXTREMO = float(os.getenv('DIAGNOSTICO_UMBRAL_EXTREMO', '2.9'))
+DIAGNOSTICO_MIN_EJERCICIOS = int(os.getenv('DIAGNOSTICO_MIN_EJERCICIOS', '5'))
+# Reglas de término por materia (ver ejercicios/parada.py), ej:
+# {"default": {"reglas": ["tiempo", "max_items", "error", "meseta"]}, "3": {"max_items": 20, "umbral_se": 0.35}}
+DIAGNOSTICO_PARADA = json.loads(os.getenv('DIAGNOSTICO_PARADA', '{}'))
+# Modelo IRT para estimar theta y seleccionar ítems: 1PL, 2PL o 3PL
+IRT_MODELO = os.getenv('IRT_MODELO', '2PL')
+# Estimador de theta en el diagnóstico: EAP, MAP (posterior en nodos de Gauss-Hermite) o MLE
+IRT_ESTIMADOR = os.getenv('IRT_ESTIMADOR', 'EAP')
+IRT_NODOS_CUADRATURA = int(os.getenv('IRT_NODOS_CUADRATURA', '61'))
+# Control de exposición: randomesque entre los K ítems más informativos + Sympson-Hetter
+EXPOSICION_CONTROL = os.getenv('EXPOSICION_CONTROL', 'True').lower() in ('1', 'true', 'yes')
+EXPOSICION_TOP_K = int(os.getenv('EXPOSICION_TOP_K', '5'))
+# Candidatos que Sympson-Hetter puede recorrer (de a EXPOSICION_TOP_K) antes de administrar uno rechazado
+EXPOSICION_CANDIDATOS = int(os.getenv('EXPOSICION_CANDIDATOS', '20'))
+EXPOSICION_TASA_MAXIMA = float(os.getenv('EXPOSICION_TASA_MAXIMA', '0.25'))
+EXPOSICION_FLUSH_SEGUNDOS = int(os.getenv('EXPOSICION_FLUSH_SEGUNDOS', '60'))
+# Balanceo de contenido del diagnóstico (materia/unidad/tipo), ver ejercicios/balanceo.py
+CAT_BALANCEO_CONTENIDO = os.getenv('CAT_BALANCEO_CONTENIDO', 'True').lower() in ('1', 'true', 'yes')
+CAT_PESO_CONTENIDO = float(os.getenv('CAT_PESO_CONTENIDO', '1.0'))
+# Proporciones explícitas, ej: {"unidad": {"3": 0.5, "4": 0.5}, "tipo": {"funciones": 0.3}}
+CAT_BLUEPRINT = json.loads(os.getenv('CAT_BLUEPRINT', '{}'))
+# Cache de contextos generados por el LLM (LRU del proceso + cache de Django + tabla ContextoGenerado)
+CONTEXTO_CACHE = os.getenv('CONTEXTO_CACHE', 'True').lower() in ('1', 'true', 'yes')
+CONTEXTO_CACHE_TTL = int(os.getenv('CONTEXTO_CACHE_TTL', str(7 * 24 * 3600)))
+CONTEXTO_CACHE_LRU = int(os.getenv('CONTEXTO_CACHE_LRU', '2048'))
+CONTEXTO_CACHE_LRU_TTL = int(os.getenv('CONTEXTO_CACHE_LRU_TTL', '600'))
+# Pedidos simultáneos del mismo contexto comparten una llamada al LLM (espera máx. y TTL del lock entre procesos)
+CONTEXTO_COALESCER = os.getenv('CONTEXTO_COALESCER', 'True').lower() in ('1', 'true', 'yes')
+CONTEXTO_COALESCER_ESPERA = float(os.getenv('CONTEXTO_COALESCER_ESPERA', '30'))  # tope: LLM_PRESUPUESTO
+CONTEXTO_COALESCER_LOCK = int(os.getenv('CONTEXTO_COALESCER_LOCK', '40'))
+# Ejercicios por llamada al LLM al generar contextos en lote (pregenerar_contextos, prefetch)
+CONTEXTO_LOTE = int(os.getenv('CONTEXTO_LOTE', '8'))
+# Precalentamiento en background de los contextos de los siguientes ejercicios del diagnóstico
+PREFETCH_CONTEXTOS = os.getenv('PREFETCH_CONTEXTOS', 'True').lower() in ('1', 'true', 'yes')
+PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', '4'))
+# Cola de feedback IA (TareaFeedback). Con FEEDBACK_WORKER_EN_PROCESO el proceso web también la procesa
+# en threads al hacer commit; en producción se puede apagar y correr `manage.py procesar_feedback`
+FEEDBACK_WORKER_EN_PROCESO = os.getenv('FEEDBACK_WORKER_EN_PROCESO', 'True').lower() in ('1', 'true', 'yes')
+FEEDBACK_WORKERS = int(os.getenv('FEEDBACK_WORKERS', '2'))
+FEEDBACK_MAX_INTENTOS = int(os.getenv('FEEDBACK_MAX_INTENTOS', '3'))
+FEEDBACK_BACKOFF = int(os.getenv('FEEDBACK_BACKOFF', '10'))
+FEEDBACK_TAREA_TIMEOUT = int(os.getenv('FEEDBACK_TAREA_TIMEOUT', '300'))
+# Feedback en streaming (SSE) desde check-respuesta; requiere servir con ASGI (sinekys/asgi.py, p. ej.
+# `uvicorn sinekys.asgi:application`): bajo WSGI el stream queda bufferizado, por eso viene apagado.
+# La tarea espera FEEDBACK_STREAM_GRACIA segundos antes de que la tome el worker
+FEEDBACK_STREAMING = os.getenv('FEEDBACK_STREAMING', 'False').lower() in ('1', 'true', 'yes')
+FEEDBACK_STREAM_GRACIA = int(os.getenv('FEEDBACK_STREAM_GRACIA', '15'))
+# Reutilizar el feedback de un error ya visto (mismo ejercicio, respuesta y pasos), ver memo_feedback.py
+FEEDBACK_MEMO = os.getenv('FEEDBACK_MEMO', 'True').lower() in ('1', 'true', 'yes')
+FEEDBACK_MEMO_TTL = int(os.getenv('FEEDBACK_MEMO_TTL', str(7 * 24 * 3600)))
+# Gateway LLM compartido (ejercicios/Api_LLMs/gateway.py): un solo pool httpx con keep-alive/HTTP2
+LLM_MAX_CONCURRENCIA = int(os.getenv('LLM_MAX_CONCURRENCIA', '8'))
+LLM_MAX_CONEXIONES = int(os.getenv('LLM_MAX_CONEXIONES', '20'))
+LLM_KEEPALIVE = int(os.getenv('LLM_KEEPALIVE', '60'))
+LLM_TIMEOUT = int(os.getenv('LLM_TIMEOUT', '60'))
+LLM_HTTP2 = os.getenv('LLM_HTTP2', 'True').lower() in ('1', 'true', 'yes')
+# Plazo por llamada, presupuesto total con reintentos, hedging y circuit breaker del gateway
+LLM_PLAZO = float(os.getenv('LLM_PLAZO', '20'))
+LLM_PRESUPUESTO = float(os.getenv('LLM_PRESUPUESTO', '25'))
+LLM_HEDGE_DESPUES = float(os.getenv('LLM_HEDGE_DESPUES', '6'))  # 0 desactiva el hedging; solo hacia otro proveedor
+LLM_BREAKER_FALLOS = int(os.getenv('LLM_BREAKER_FALLOS', '5'))
+LLM_BREAKER_ESPERA = int(os.getenv('LLM_BREAKER_ESPERA', '30'))
+# Registro de uso del LLM (usage/ledger.py): se vuelca en lote cada LLM_USAGE_FLUSH segundos
+LLM_USAGE = os.getenv('LLM_USAGE', 'True').lower() in ('1', 'true', 'yes')
+LLM_USAGE_FLUSH = int(os.getenv('LLM_USAGE_FLUSH', '10'))
+LLM_USAGE_LOTE = int(os.getenv('LLM_USAGE_LOTE', '200'))
+# USD por 1M tokens [entrada, salida]
+LLM_PRECIOS = json.loads(os.getenv('LLM_PRECIOS', '{"gpt-4o-mini": [0.15, 0.60], "gpt-4o": [2.50, 10.00]}'))
+# prompt_cache_key por plantilla (ejercicios/Api_LLMs/prompts.py) para reutilizar el prefijo cacheado del proveedor
+LLM_PROMPT_CACHE_KEY = os.getenv('LLM_PROMPT_CACHE_KEY', 'True').lower() in ('1', 'true', 'yes')
+# Pruebas de carga sin OpenAI (ejercicios/Api_LLMs/replay.py): LLM_GRABAR guarda cada pedido/respuesta
+# en LLM_GRABACIONES_DIR; `manage.py servidor_llm` las sirve y LLM_BASE_URL apunta el gateway al stub
+LLM_GRABAR = os.getenv('LLM_GRABAR', 'False').lower() in ('1', 'true', 'yes')
+LLM_GRABACIONES_DIR = os.getenv('LLM_GRABACIONES_DIR', os.path.join(BASE_DIR, 'llm_grabaciones'))
+LLM_BASE_URL = os.getenv('LLM_BASE_URL', '')  # p. ej. http://127.0.0.1:8765/v1
+# Proveedores LLM compatibles con OpenAI (ejercicios/Api_LLMs/router.py). Por defecto solo OpenAI (con LLM_BASE_URL).
+# Ej.: {"chatgpt": {}, "local": {"base_url": "http://127.0.0.1:11434/v1", "api_key_env": "LOCAL_LLM_KEY",
+#       "modelo": "llama3.1:8b", "fuente": "llama", "modos": ["normal", "feedback"], "responses": false}}
+# "fuente" debe ser una de las opciones de Feedback.fuente_ia; "modos" vacío = todos
+LLM_PROVEEDORES = json.loads(os.getenv('LLM_PROVEEDORES', '{}'))
+LLM_ROUTER_VENTANA = int(os.getenv('LLM_ROUTER_VENTANA', '200'))  # llamadas recordadas por proveedor
+LLM_ROUTER_VENTANA_SEG = int(os.getenv('LLM_ROUTER_VENTANA_SEG', '600'))
+LLM_ROUTER_MIN_MUESTRAS = int(os.getenv('LLM_ROUTER_MIN_MUESTRAS', '5'))
+LLM_ROUTER_MAX_ERRORES = float(os.getenv('LLM_ROUTER_MAX_ERRORES', '0.5'))
+LLM_ROUTER_EXPLORAR = float(os.getenv('LLM_ROUTER_EXPLORAR', '0.05'))
 
 # ---------------------------
 # Celery (opcional)
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Subscription',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('plan_type', models.CharField(choices=[('basic', 'Basic'), ('profesor', 'Profesor'), ('superpro', 'Super Pro'), ('superprofesor', 'Super Profesor')], default='basic', max_length=30)),
+                ('stripe_customer_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('stripe_subscription_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('status', models.CharField(default='inactive', max_length=50)),
+                ('current_period_end', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
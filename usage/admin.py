@@ -1,7 +1,13 @@
 from django.contrib import admin
-from .models import DailyQuota
+from .models import DailyQuota, LLMCall
 
 @admin.register(DailyQuota)
 class DailyQuotaAdmin(admin.ModelAdmin):
-    list_display = ('user', 'date', 'attempts_count', 'messages_count')
+    list_display = ('user', 'date', 'attempts_count', 'messages_count', 'prompt_tokens', 'completion_tokens', 'cost_usd')
     list_filter = ('date',)
+
+
+@admin.register(LLMCall)
+class LLMCallAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'user', 'mode', 'model', 'prompt_tokens', 'completion_tokens', 'latency_ms', 'cache_hit', 'cost_usd')
+    list_filter = ('mode', 'cache_hit', 'model')
@@ -0,0 +1,140 @@
+# Registro de uso del LLM (tokens, latencia, costo) por llamada.
+# record() solo encola en memoria; un thread del proceso vuelca la cola cada LLM_USAGE_FLUSH
+# segundos (o al juntar LLM_USAGE_LOTE registros) con un bulk_create de LLMCall y una
+# actualización por (usuario, día) de DailyQuota. Así registrar no agrega escrituras al request.
+# Para aplicar presupuestos sin esperar el volcado, los tokens del día también se suman en el
+# cache (incr atómico); ver usage.services.can_user_call_llm.
+
+import atexit
+import logging
+import threading
+from collections import defaultdict, deque
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from ejercicios.utils.cache import incrementar
+
+logger = logging.getLogger(__name__)
+
+KEY_TOKENS_DIA = "llm:tokens:{}:{}"
+
+_cola = deque()
+_lock = threading.Lock()
+_despertar = threading.Event()
+_thread = None
+
+
+def precio(model, prompt_tokens, completion_tokens):
+    # LLM_PRECIOS: {"modelo": [usd por 1M tokens de entrada, usd por 1M de salida]}
+    entrada, salida = getattr(settings, "LLM_PRECIOS", {}).get(model, (0, 0))
+    costo = (prompt_tokens * entrada + completion_tokens * salida) / 1_000_000
+    return Decimal(str(round(costo, 6)))
+
+
+def tokens_hoy(user_id):
+    return cache.get(KEY_TOKENS_DIA.format(user_id, timezone.localdate().isoformat())) or 0
+
+
+def record(model="", prompt_tokens=0, completion_tokens=0, latency_ms=0, cache_hit=False, mode=None, user_id=None):
+    if not getattr(settings, "LLM_USAGE", True):
+        return
+    registro = {
+        "user_id": user_id,
+        "mode": mode or "otro",
+        "model": model or "",
+        "prompt_tokens": int(prompt_tokens or 0),
+        "completion_tokens": int(completion_tokens or 0),
+        "latency_ms": int(latency_ms or 0),
+        "cache_hit": bool(cache_hit),
+        "cost_usd": precio(model, prompt_tokens or 0, completion_tokens or 0),
+        "created_at": timezone.now(),
+    }
+    if user_id and (registro["prompt_tokens"] or registro["completion_tokens"]):
+        try:
+            incrementar(KEY_TOKENS_DIA.format(user_id, timezone.localdate().isoformat()),
+                        registro["prompt_tokens"] + registro["completion_tokens"], timeout=2 * 24 * 3600)
+        except Exception:
+            logger.warning("No se pudo sumar tokens del usuario %s en el cache", user_id)
+    with _lock:
+        _cola.append(registro)
+        lleno = len(_cola) >= getattr(settings, "LLM_USAGE_LOTE", 200)
+    _asegurar_thread()
+    if lleno:
+        _despertar.set()
+
+
+def _asegurar_thread():
+    global _thread
+    if _thread is not None:
+        return
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_bucle, name="llm-usage", daemon=True)
+            _thread.start()
+
+
+def _bucle():
+    while True:
+        _despertar.wait(getattr(settings, "LLM_USAGE_FLUSH", 10))
+        _despertar.clear()
+        close_old_connections()
+        try:
+            flush()
+        except Exception:
+            logger.exception("Error volcando el registro de uso del LLM")
+        finally:
+            connection.close()
+
+
+def flush():
+    """Escribe lo encolado (LLMCall + rollup DailyQuota). Devuelve cuántos registros volcó."""
+    from usage.models import DailyQuota, LLMCall
+
+    with _lock:
+        registros = list(_cola)
+        _cola.clear()
+    if not registros:
+        return 0
+
+    rollup = defaultdict(lambda: {"messages": 0, "prompt": 0, "completion": 0, "cost": Decimal(0)})
+    for r in registros:
+        if r["user_id"]:
+            fila = rollup[(r["user_id"], timezone.localdate(r["created_at"]))]
+            fila["messages"] += 1
+            fila["prompt"] += r["prompt_tokens"]
+            fila["completion"] += r["completion_tokens"]
+            fila["cost"] += r["cost_usd"]
+    try:
+        with transaction.atomic():
+            LLMCall.objects.bulk_create([LLMCall(**r) for r in registros])
+            for (user_id, dia), fila in rollup.items():
+                DailyQuota.objects.get_or_create(user_id=user_id, date=dia)
+                DailyQuota.objects.filter(user_id=user_id, date=dia).update(
+                    messages_count=F("messages_count") + fila["messages"],
+                    prompt_tokens=F("prompt_tokens") + fila["prompt"],
+                    completion_tokens=F("completion_tokens") + fila["completion"],
+                    cost_usd=F("cost_usd") + fila["cost"],
+                )
+    except Exception:
+        # se devuelven a la cola para el próximo intento (con tope, para no crecer sin límite)
+        with _lock:
+            if len(_cola) < 10 * getattr(settings, "LLM_USAGE_LOTE", 200):
+                _cola.extendleft(reversed(registros))
+        raise
+    return len(registros)
+
+
+def _flush_al_salir():
+    try:
+        flush()
+    except Exception:
+        logger.exception("No se pudo volcar el registro de uso del LLM al salir")
+
+
+atexit.register(_flush_al_salir)
+
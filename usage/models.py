@@ -7,10 +7,42 @@ class DailyQuota(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     date = models.DateField()
     attempts_count = models.PositiveIntegerField(default=0)
-    messages_count = models.PositiveIntegerField(default=0)  
+    messages_count = models.PositiveIntegerField(default=0)  # llamadas al LLM (incluye aciertos de cache)
+    # Rollup diario de LLMCall (lo actualiza usage.ledger al volcar el lote)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    cost_usd = models.DecimalField(max_digits=10, decimal_places=6, default=0)
 
     class Meta:
         unique_together = ('user', 'date')
 
     def __str__(self):
         return f"{self.user.email} - {self.date}"
+
+
+class LLMCall(models.Model):
+    # Una llamada al LLM (o un acierto de cache que la evitó). Se escriben en lote, ver usage/ledger.py
+    MODES = [
+        ("diagnostico", "Diagnóstico"),
+        ("normal", "Normal"),
+        ("feedback", "Feedback"),
+        ("otro", "Otro"),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    mode = models.CharField(max_length=20, choices=MODES, default="otro")
+    model = models.CharField(max_length=100, blank=True)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    latency_ms = models.PositiveIntegerField(default=0)
+    cache_hit = models.BooleanField(default=False)
+    cost_usd = models.DecimalField(max_digits=10, decimal_places=6, default=0)
+    created_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "created_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.mode} - {self.model} - {self.prompt_tokens}+{self.completion_tokens}"
@@ -1,4 +1,10 @@
+import contextvars
+from contextlib import contextmanager
 from datetime import date
+
+from django.core.cache import cache
+
+from usage import ledger
 from usage.models import DailyQuota
 from subscriptions.models import Subscription
 
@@ -11,6 +17,18 @@ PLAN_LIMITS = {
     "superprofesor": None,   # ilimitado
 }
 
+# Tokens de LLM por día según plan (None = ilimitado)
+PLAN_TOKEN_LIMITS = {
+    "free": 60_000,
+    "basic": 60_000,
+    "superpro": 200_000,
+    "profesor": None,
+    "superprofesor": None,
+}
+
+# Usuario y modo de las llamadas al LLM del request/tarea actual (los lee el gateway)
+_llm_context = contextvars.ContextVar("llm_context", default=(None, None))
+
 
 def can_user_attempt(user):
     today = date.today()
@@ -55,3 +73,61 @@ def register_attempt(user):
     quota.save()
 
     return quota.attempts_count
+
+
+@contextmanager
+def llm_context(user_id=None, mode=None):
+    """
+    Atribuye las llamadas al LLM hechas dentro del bloque a `user_id` y `mode`
+    (diagnostico/normal/feedback) para el registro de uso y el presupuesto diario.
+    """
+    token = _llm_context.set((user_id, mode))
+    try:
+        yield
+    finally:
+        _llm_context.reset(token)
+
+
+def current_llm_context():
+    return _llm_context.get()
+
+
+def record_llm_call(model="", prompt_tokens=0, completion_tokens=0, latency_ms=0, cache_hit=False, mode=None, user_id=None):
+    # Los datos que no se pasan se toman del llm_context actual
+    ctx_user, ctx_mode = _llm_context.get()
+    ledger.record(
+        model=model,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        latency_ms=latency_ms,
+        cache_hit=cache_hit,
+        mode=mode or ctx_mode,
+        user_id=user_id or ctx_user,
+    )
+
+
+def llm_token_limit(user_id):
+    # Límite diario de tokens del plan del usuario (cacheado 5 minutos)
+    key = f"llm:plan:{user_id}"
+    plan = cache.get(key)
+    if plan is None:
+        subscription = Subscription.objects.filter(user_id=user_id, status="active").first()
+        plan = subscription.plan_type if subscription else "free"
+        cache.set(key, plan, timeout=300)
+    return PLAN_TOKEN_LIMITS.get(plan, PLAN_TOKEN_LIMITS["free"])
+
+
+def can_user_call_llm(user_id=None):
+    """
+    Hook de presupuesto: (puede, límite, usados) con los tokens del día del usuario. Sin usuario
+    (tareas de sistema, prefetch) no hay límite. Lo consulta el gateway antes de cada llamada.
+    """
+    if user_id is None:
+        user_id, _ = _llm_context.get()
+    if user_id is None:
+        return True, None, 0
+    limit = llm_token_limit(user_id)
+    used = ledger.tokens_hoy(user_id)
+    if limit is not None and used >= limit:
+        return False, limit, used
+    return True, limit, used